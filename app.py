@@ -340,6 +340,7 @@ else:
                         enc = vault_ingestion.encrypt_password_with_dek(dek=dek, password=new_password)
 
                         vault_ingestion.update_password_entry(
+                            owner_id=ObjectId(user_id),
                             service=password['service'],
                             encrypted_content=enc['password_encrypted'],
                             nonce=enc['nonce']
@@ -356,7 +357,7 @@ else:
             # Delete button
             with col3:
                 if st.button(f"Delete 🗑️", key=f"del-{password['_id']}"):
-                    deleted = vault_ingestion.delete_password_entry(password['service'])
+                    deleted = vault_ingestion.delete_password_entry(ObjectId(user_id), password['service'])
                     if deleted:
                         st.success("Deleted.")
                         st.rerun()
@@ -1,8 +1,38 @@
 import streamlit as st
+from pymongo.errors import PyMongoError
 from services.views.user import new_user, login_page
+from services.components.indexes import IndexManager
 
 st.set_page_config(page_title="CryptoLab", page_icon="🔐", layout="wide")
 
+# Provision indexes once per process (idempotent, cached across reruns;
+# errors are not cached, so a later session retries)
+@st.cache_resource
+def bootstrap_indexes():
+    return IndexManager(st.secrets["MONGO_URI"]).ensure_indexes()
+
+def check_indexes():
+    # The app still renders when MongoDB is unreachable; a session only
+    # waits for the server once
+    if st.session_state.get("indexes_unreachable"):
+        st.sidebar.warning("MongoDB is unreachable, indexes were not checked.")
+        return
+    try:
+        report = bootstrap_indexes()
+    except PyMongoError as e:
+        st.session_state["indexes_unreachable"] = True
+        st.sidebar.warning(f"MongoDB is unreachable, indexes were not checked: {e}")
+        return
+
+    # Failed builds include conflicts with an existing index of the same name
+    for entry in report:
+        if entry["status"] == "failed":
+            st.sidebar.warning(f"Index {entry['collection']}.{entry['name']} could not be created: {entry['error']}")
+        elif entry["status"] == "conflict":
+            st.sidebar.warning(f"Index {entry['collection']}.{entry['name']} does not match its definition: {entry['error']}")
+
+check_indexes()
+
 # Initial state
 if "page" not in st.session_state:
     st.session_state.page = "Home"
@@ -133,5 +163,6 @@ elif st.session_state.page == "Files":
     files_page()
 
 elif st.session_state.page == "Settings":
-    from services.views.settings import delete_user
+    from services.views.settings import delete_user, rotate_key
     delete_user()
+    rotate_key()
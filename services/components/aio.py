@@ -0,0 +1,472 @@
+import io
+import asyncio
+import hashlib
+from functools import partial
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+import gridfs
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from services.components.connection import get_async_client
+from services.components.users import UserIngestion
+from services.components.notes import NoteIngestion, NOTE_LIST_PROJECTION, SEARCH_INDEX_BATCH_SIZE
+from services.components import blind_index
+from services.components.vault import VaultIngestion
+from services.components.compression import CODEC_NONE, CODEC_ZLIB, decompressor as new_decompressor
+from services.components.envelope import object_key, current_kek_filter, STALE_KEK_MESSAGE
+from services.components.file import (
+    FileIngestion,
+    FILE_FORMAT_SEGMENTED,
+    HEADER_SIZE,
+    TAG_SIZE,
+    SEGMENT_SIZE
+)
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_USERS,
+    COLLECTION_NOTES,
+    COLLECTION_VAULT,
+    COLLECTION_SHARES
+)
+
+# ------------------
+# asyncio variants of the Ingestion components
+# ------------------
+# Same method names and arguments as the blocking classes, but every method is
+# a coroutine. Database calls go through pymongo's AsyncMongoClient and all
+# AES / RSA / bcrypt work runs in an executor so the event loop never blocks.
+# `client` may be a URI or an existing async client (e.g. an in-process
+# stand-in for tests).
+#
+# Each class wraps an instance of the blocking component (`self.blocking`)
+# for the crypto, document builders and serializers, so both APIs share the
+# same schema and crypto code. That instance has no database handles.
+
+
+def _offline(component_cls):
+    """An instance of a blocking component without database handles."""
+    return component_cls.__new__(component_cls)
+
+
+class _AsyncMixin:
+    executor = None
+
+    async def _offload(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def _check_current_kek(self, owner_id, wrapped_kek_id: str):
+        # Async check_current_kek
+        if wrapped_kek_id is None:
+            return
+        if await self.database[COLLECTION_USERS].find_one(current_kek_filter(owner_id, wrapped_kek_id), {"_id": 1}) is None:
+            raise Exception(STALE_KEK_MESSAGE)
+
+
+class AsyncUserIngestion(_AsyncMixin):
+    def __init__(self, client, executor=None):
+        self.client = get_async_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.collection = self.database[COLLECTION_USERS]
+        self.executor = executor
+        self.blocking = _offline(UserIngestion)
+
+    async def generate_rsa_keypair(self):
+        return await self._offload(self.blocking.generate_rsa_keypair)
+
+    async def encrypt_with_public(self, public_key, plaintext: str) -> str:
+        return await self._offload(self.blocking.encrypt_with_public, public_key, plaintext)
+
+    async def decrypt_with_private(self, private_key, hex_ciphertext: str) -> str:
+        return await self._offload(self.blocking.decrypt_with_private, private_key, hex_ciphertext)
+
+    async def create_user(self, username: str, password: str):
+        if await self.collection.find_one({"username": username}):
+            return "User already exists!"
+        doc = await self._offload(self.blocking._build_user_doc, username, password)
+        await self.collection.insert_one(doc)
+        return "User created successfully!"
+
+    async def verify_password(self, username: str, candidate_password: str) -> bool:
+        doc = await self.collection.find_one({"username": username})
+        return await self._offload(self.blocking._check_password_hash, doc, candidate_password)
+
+
+class AsyncNoteIngestion(_AsyncMixin):
+    def __init__(self, client, executor=None):
+        self.client = get_async_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.collection = self.database[COLLECTION_NOTES]
+        self.executor = executor
+        self.blocking = _offline(NoteIngestion)
+
+    async def encrypt_note_with_dek(self, dek: bytes, plaintext: str, compression: int = CODEC_ZLIB, note: dict = None, search_key: bytes = None) -> dict:
+        return await self._offload(self.blocking.encrypt_note_with_dek, dek, plaintext, compression, note, search_key)
+
+    async def decrypt_note_with_dek(self, dek: bytes, ciphertext_b64: str, nonce_b64: str, wrapped_key=None, kek_id: str = None) -> str:
+        return await self._offload(self.blocking.decrypt_note_with_dek, dek, ciphertext_b64, nonce_b64, wrapped_key, kek_id)
+
+    async def create_note(self, owner_id: ObjectId, encrypted_content: str, nonce: str, sha256: str, wrapped_key=None, kek_id: str = None, search_tokens: list = None):
+        doc = self.blocking._new_note_doc(owner_id, encrypted_content, nonce, sha256, wrapped_key, kek_id, search_tokens)
+        await self._check_current_kek(owner_id, kek_id)
+        res = await self.collection.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def create_notes_bulk(self, owner_id: ObjectId, dek: bytes, plaintexts, batch_size: int = 500, ordered: bool = False, max_workers: int = None, search_key: bytes = None) -> dict:
+        inserted_ids = []
+        errors = []
+        plaintexts = iter(plaintexts)
+        offset = 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                batch = list(islice(plaintexts, batch_size))
+                if not batch:
+                    break
+
+                docs, positions = await self._offload(
+                    self.blocking._encrypt_note_batch, executor, owner_id, dek, batch, offset, errors, search_key
+                )
+                if docs:
+                    await self._check_current_kek(owner_id, docs[0].get("kek_id"))
+                try:
+                    if docs:
+                        await self.collection.insert_many(docs, ordered=ordered)
+                    stop = self.blocking._record_insert_batch(docs, positions, ordered, inserted_ids, errors)
+                except BulkWriteError as bwe:
+                    stop = self.blocking._record_insert_batch(docs, positions, ordered, inserted_ids, errors, bwe)
+
+                offset += len(batch)
+                if stop:
+                    self.blocking._record_not_attempted(plaintexts, offset, errors)
+                    break
+
+        errors.sort(key=lambda e: e["index"])
+        return {
+            "inserted_ids": inserted_ids,
+            "errors": errors
+        }
+
+    async def fetch_notes(self, owner_id: ObjectId):
+        cursor = self.collection.find({"owner_id": ObjectId(owner_id)})
+        return [self.blocking._serialize_note(doc) async for doc in cursor]
+
+    async def fetch_notes_page(self, owner_id: ObjectId, page_size: int = 20, cursor: str = None, include_content: bool = False) -> dict:
+        query = {"owner_id": ObjectId(owner_id)}
+        if cursor:
+            query["_id"] = {"$lt": self.blocking._decode_cursor(cursor)}
+
+        projection = None if include_content else NOTE_LIST_PROJECTION
+        docs = await self.collection.find(query, projection).sort("_id", -1).limit(page_size + 1).to_list()
+
+        next_cursor = None
+        if len(docs) > page_size:
+            docs = docs[:page_size]
+            next_cursor = self.blocking._encode_cursor(docs[-1]["_id"])
+
+        return {
+            "notes": [self.blocking._serialize_note(doc) for doc in docs],
+            "next_cursor": next_cursor
+        }
+
+    async def fetch_note(self, note_id: str, owner_id: ObjectId):
+        doc = await self.collection.find_one({"_id": ObjectId(note_id), "owner_id": ObjectId(owner_id)})
+        return self.blocking._serialize_note(doc) if doc else None
+
+    async def update_note(self, note_id: str, encrypted_content: str, nonce: str, sha256: str, wrapped_key=None, kek_id: str = None, search_tokens: list = None, owner_id: ObjectId = None):
+        doc = self.blocking._updated_note_doc(encrypted_content, nonce, sha256, wrapped_key, kek_id, search_tokens)
+        query = {"_id": ObjectId(note_id)}
+        if owner_id is not None:
+            query["owner_id"] = ObjectId(owner_id)
+        elif kek_id is not None:
+            owner_id = (await self.collection.find_one(query, {"owner_id": 1}) or {}).get("owner_id")
+        if owner_id is not None:
+            await self._check_current_kek(owner_id, kek_id)
+        return await self.collection.update_one(query, {"$set": doc, "$unset": self.blocking._updated_note_unset(search_tokens)})
+
+    async def search_notes(self, owner_id: ObjectId, search_key: bytes, query: str, limit: int = 50) -> list:
+        tokens = blind_index.query_tokens(search_key, query)
+        if not tokens:
+            return []
+        cursor = self.collection.find(
+            {"owner_id": ObjectId(owner_id), "search_tokens": {"$all": tokens}}, NOTE_LIST_PROJECTION
+        ).sort("_id", -1).limit(limit)
+        return [self.blocking._serialize_note(doc) for doc in await cursor.to_list()]
+
+    async def count_unindexed(self, owner_id: ObjectId) -> int:
+        return await self.collection.count_documents({"owner_id": ObjectId(owner_id), "search_tokens": {"$exists": False}})
+
+    async def index_notes(self, owner_id: ObjectId, dek: bytes, search_key: bytes, batch_size: int = SEARCH_INDEX_BATCH_SIZE, progress=None) -> int:
+        owner_id = ObjectId(owner_id)
+        unindexed = {"owner_id": owner_id, "search_tokens": {"$exists": False}}
+        total = await self.collection.count_documents(unindexed)
+        indexed = 0
+        done = 0
+        last_id = None
+
+        while True:
+            query = dict(unindexed)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = await self.collection.find(query).sort("_id", 1).limit(batch_size).to_list()
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            requests = []
+            for doc in batch:
+                plaintext = await self.decrypt_note_with_dek(dek, doc["encrypted_content"], doc["nonce"], doc.get("wrapped_key"), doc.get("kek_id"))
+                requests.append(UpdateOne(
+                    {"_id": doc["_id"], "nonce": doc["nonce"], "search_tokens": {"$exists": False}},
+                    {"$set": {"search_tokens": blind_index.search_tokens(search_key, plaintext)}}
+                ))
+            res = await self.collection.bulk_write(requests, ordered=False)
+            indexed += res.modified_count
+            done += len(batch)
+            if progress:
+                progress(done, total)
+
+        return indexed
+
+    async def delete_note(self, note_id: str):
+        res = await self.collection.delete_one({"_id": ObjectId(note_id)})
+        await self.database[COLLECTION_SHARES].delete_many({"object_id": ObjectId(note_id)})
+        return res.deleted_count
+
+
+class AsyncVaultIngestion(_AsyncMixin):
+    def __init__(self, client, executor=None):
+        self.client = get_async_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.collection = self.database[COLLECTION_VAULT]
+        self.executor = executor
+        self.blocking = _offline(VaultIngestion)
+
+    async def encrypt_password_with_dek(self, dek: bytes, password: str) -> dict:
+        return await self._offload(self.blocking.encrypt_password_with_dek, dek, password)
+
+    async def decrypt_password_with_dek(self, dek: bytes, password_encrypted_b64: str, nonce_64: str, wrapped_key=None, kek_id: str = None) -> str:
+        return await self._offload(self.blocking.decrypt_password_with_dek, dek, password_encrypted_b64, nonce_64, wrapped_key, kek_id)
+
+    async def check_password_strength(self, password: str) -> dict:
+        return await self._offload(self.blocking.check_password_strength, password)
+
+    async def fetch_services(self, owner_id: ObjectId):
+        services = await self.collection.distinct("service", {"owner_id": ObjectId(owner_id)})
+        return sorted(services)
+
+    async def fetch_vault_overview(self, owner_id: ObjectId, service: str = None, page_size: int = 50) -> dict:
+        cursor = await self.collection.aggregate(self.blocking._overview_pipeline(owner_id, service, page_size))
+        results = await cursor.to_list(length=1)
+        return self.blocking._build_overview(results[0] if results else None)
+
+    async def create_password_entry(self, owner_id: ObjectId, password_encrypted: str, nonce: str, service: str, username: str, url: str, wrapped_key=None, kek_id: str = None):
+        doc = self.blocking._new_password_doc(owner_id, password_encrypted, nonce, service, username, url, wrapped_key, kek_id)
+        await self._check_current_kek(owner_id, kek_id)
+        res = await self.collection.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def fetch_passwords_by_service(self, owner_id: ObjectId, service: str):
+        cursor = self.collection.find({
+            "owner_id": ObjectId(owner_id),
+            "service": service
+        })
+        return [self.blocking._serialize_password(doc) async for doc in cursor]
+
+    async def update_password_entry(self, owner_id: ObjectId, service: str, encrypted_content: str, nonce: str, wrapped_key=None, kek_id: str = None):
+        doc = self.blocking._updated_password_doc(encrypted_content, nonce, wrapped_key, kek_id)
+        await self._check_current_kek(owner_id, kek_id)
+        return await self.collection.update_one({"owner_id": ObjectId(owner_id), "service": service}, {"$set": doc, "$unset": {"legacy_key": ""}})
+
+    async def delete_password_entry(self, owner_id: ObjectId, service: str):
+        return await self.collection.delete_one({"owner_id": ObjectId(owner_id), "service": service})
+
+
+class AsyncFileIngestion(_AsyncMixin):
+    def __init__(self, client, executor=None):
+        self.client = get_async_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.fs = gridfs.AsyncGridFS(self.database)
+        self.bucket = gridfs.AsyncGridFSBucket(self.database)
+        self.executor = executor
+        self.blocking = _offline(FileIngestion)
+
+    async def encrypt_file(self, data, dek: bytes) -> dict:
+        return await self._offload(self.blocking.encrypt_file, data, dek)
+
+    async def decrypt_file(self, encrypted_bytes: bytes, dek: bytes) -> bytes:
+        return await self._offload(self.blocking.decrypt_file, encrypted_bytes, dek)
+
+    async def encrypt_file_stream(self, fileobj, dek: bytes, filename: str, metadata: dict = None, segment_size: int = SEGMENT_SIZE, compression: int = CODEC_NONE, compression_level: int = None) -> dict:
+        state = {}
+        segments = self.blocking._encrypt_segments(fileobj, dek, segment_size, state, compression, compression_level)
+        grid_in = self.bucket.open_upload_stream(filename)
+        try:
+            while True:
+                # Reading + encrypting the next segment runs off the loop
+                chunk = await self._offload(next, segments, None)
+                if chunk is None:
+                    break
+                await grid_in.write(chunk)
+            owner_id = (metadata or {}).get("owner_id")
+            if owner_id is not None:
+                await self._check_current_kek(owner_id, state["key"]["kek_id"])
+        except Exception:
+            await grid_in.abort()
+            raise
+
+        await grid_in.set("metadata", self.blocking._stream_metadata(metadata, state, segment_size))
+        await grid_in.close()
+
+        return {
+            "file_id": grid_in._id,
+            "sha256": state["sha256"],
+            "length": state["length"]
+        }
+
+    async def stream_decrypted_file(self, file_id, dek: bytes, start: int = 0, end: int = None, data_key: bytes = None):
+        grid_out = await self.bucket.open_download_stream(file_id)
+        if (grid_out.metadata or {}).get("blob_id") is not None:
+            grid_out = await self.bucket.open_download_stream(grid_out.metadata["blob_id"])
+        metadata = grid_out.metadata or {}
+        full_read = start == 0 and end is None
+        dek = data_key or object_key(dek, metadata.get("wrapped_key"), metadata.get("kek_id"))
+
+        if metadata.get("format") != FILE_FORMAT_SEGMENTED:
+            data = await self.decrypt_file(await grid_out.read(), dek)
+            if full_read and metadata.get("sha256") and not self.blocking.integrity_check(data, metadata["sha256"]):
+                raise Exception("Integrity check failed")
+            yield data[start:end]
+            return
+
+        aes = AESGCM(dek)
+
+        header = await grid_out.read(HEADER_SIZE)
+        header += await grid_out.read(self.blocking._header_size(header) - len(header))
+        segment_size, _ = self.blocking._parse_stream_header(header)
+        encrypted_size = segment_size + TAG_SIZE
+        codec = self.blocking._stream_codec(header)
+        sha = hashlib.sha256() if full_read else None
+
+        if codec != CODEC_NONE:
+            segment_count = self.blocking._segment_range(grid_out.length, segment_size, 0, None, len(header))[0]
+            decompressor = new_decompressor(codec)
+            offset = 0
+            for index in range(segment_count):
+                if end is not None and offset >= end:
+                    return
+                encrypted = await grid_out.read(encrypted_size)
+                segment = await self._offload(
+                    self.blocking._decrypt_segment, aes, header, index, index == segment_count - 1, encrypted
+                )
+                data = await self._offload(decompressor.decompress, segment)
+                for chunk in self.blocking._slice_stream([data], max(start - offset, 0), None if end is None else end - offset):
+                    if sha is not None:
+                        sha.update(chunk)
+                    yield chunk
+                offset += len(data)
+            if not decompressor.eof:
+                raise Exception("Truncated compressed stream")
+            if sha is not None and metadata.get("sha256") and sha.hexdigest() != metadata["sha256"]:
+                raise Exception("Integrity check failed")
+            return
+
+        segment_count, first, last, end = self.blocking._segment_range(grid_out.length, segment_size, start, end)
+        if first > last:
+            return
+
+        await grid_out.seek(HEADER_SIZE + first * encrypted_size)
+        for index in range(first, last + 1):
+            encrypted = await grid_out.read(encrypted_size)
+            segment = await self._offload(
+                self.blocking._decrypt_segment, aes, header, index, index == segment_count - 1, encrypted
+            )
+            if sha is not None:
+                sha.update(segment)
+            offset = index * segment_size
+            yield segment[max(start - offset, 0):end - offset]
+
+        if sha is not None and metadata.get("sha256") and sha.hexdigest() != metadata["sha256"]:
+            raise Exception("Integrity check failed")
+
+    async def upload_deduplicated(self, fileobj, dek: bytes, dedup_key: bytes, filename: str, metadata: dict, segment_size: int = SEGMENT_SIZE, compression: int = CODEC_NONE) -> dict:
+        if isinstance(fileobj, (bytes, bytearray)):
+            fileobj = io.BytesIO(fileobj)
+
+        owner_id = ObjectId(metadata["owner_id"])
+        content_hmac = await self._offload(self.blocking._content_hmac, fileobj, dedup_key)
+        fileobj.seek(0)
+
+        blob = await self.database.fs.files.find_one_and_update(
+            self.blocking._acquire_blob_query(owner_id, content_hmac),
+            {"$inc": {"metadata.refcount": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is not None:
+            res = await self.database.fs.files.insert_one(self.blocking._alias_doc(blob, filename, metadata, owner_id))
+            return self.blocking._alias_result(res.inserted_id, blob)
+
+        blob_metadata = self.blocking._blob_metadata(metadata, owner_id, content_hmac)
+        enc = await self.encrypt_file_stream(fileobj, dek, filename, metadata=blob_metadata, segment_size=segment_size, compression=compression)
+        enc.update({"blob_id": enc["file_id"], "deduplicated": False})
+        return enc
+
+    async def delete_file(self, file_id) -> bool:
+        file_id = ObjectId(file_id)
+        doc = await self.database.fs.files.find_one({"_id": file_id}, {"metadata.blob_id": 1})
+        if doc is None:
+            return False
+
+        blob_id = (doc.get("metadata") or {}).get("blob_id")
+        if blob_id is not None:
+            res = await self.database.fs.files.delete_one({"_id": file_id})
+            if res.deleted_count != 1:
+                return False
+            await self._release_blob(blob_id, hide=False)
+        elif not await self._release_blob(file_id, hide=True):
+            return False
+        await self.database[COLLECTION_SHARES].delete_many({"object_id": file_id})
+        return True
+
+    async def _release_blob(self, blob_id, hide: bool) -> bool:
+        query, update = self.blocking._release_blob_update(blob_id, hide)
+        blob = await self.database.fs.files.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if blob is None:
+            return False
+        if self.blocking._blob_unreferenced(blob):
+            await self.fs.delete(blob_id)
+        return True
+
+    async def get_files_list(self, owner_id: ObjectId):
+        cursor = self.database.fs.files.find(self.blocking._files_query(owner_id)).sort("uploadDate", -1)
+        return await cursor.to_list()
+
+    async def upload_to_gridfs(self, filename, encrypted_bytes: bytes, metadata: dict = None):
+        return await self.fs.put(encrypted_bytes, filename=filename, metadata=metadata or {})
+
+    async def download_from_gridfs(self, file_id):
+        grid_out = await self.fs.get(file_id)
+        return await grid_out.read()
+
+    async def delete_from_gridfs(self, file_id):
+        # Raw GridFS delete: ignores dedup references and shares, use delete_file
+        await self.fs.delete(file_id)
+        return True
+
+
+async def fetch_user_overview(notes: AsyncNoteIngestion, vault: AsyncVaultIngestion, files: AsyncFileIngestion, owner_id: ObjectId) -> dict:
+    """
+    Loads a user's notes, vault services and file list concurrently.
+    """
+    notes_list, services, files_list = await asyncio.gather(
+        notes.fetch_notes(owner_id),
+        vault.fetch_services(owner_id),
+        files.get_files_list(owner_id)
+    )
+    return {
+        "notes": notes_list,
+        "services": services,
+        "files": files_list
+    }
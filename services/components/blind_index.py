@@ -0,0 +1,51 @@
+import re
+import hmac
+import hashlib
+import unicodedata
+from bson import Binary
+
+# ------------------
+# Blind index
+# ------------------
+# Notes can carry `search_tokens`: one truncated HMAC-SHA256 per distinct word,
+# computed with a per-user search key that is separate from the DEK. A search
+# term maps to the same token, so a lookup is one indexed query on
+# (owner_id, search_tokens) and only the matching notes are decrypted.
+#
+# Tokens reveal which of a user's notes share a word (and how often a word
+# occurs), never the word itself. Only whole words match.
+SEARCH_KEY_SIZE = 32
+# 64-bit tokens: collisions within one user's vocabulary are negligible and
+# candidates are decrypted anyway
+SEARCH_TOKEN_BYTES = 8
+MIN_TERM_LENGTH = 2
+# Bounds the array (and index entries) of very long notes; later words are
+# not searchable
+MAX_TOKENS_PER_NOTE = 2000
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def terms(text: str) -> list:
+    """Distinct normalized words of `text`, in order of first occurrence."""
+    normalized = unicodedata.normalize("NFKC", text).casefold()
+    seen = {}
+    for word in _WORD.findall(normalized):
+        if len(word) >= MIN_TERM_LENGTH:
+            seen.setdefault(word, None)
+    return list(seen)
+
+
+def term_token(search_key: bytes, term: str) -> Binary:
+    digest = hmac.new(search_key, b"note-term:" + term.encode('utf-8'), hashlib.sha256).digest()
+    return Binary(digest[:SEARCH_TOKEN_BYTES])
+
+
+def search_tokens(search_key: bytes, text: str) -> list:
+    """Tokens stored with a note."""
+    return [term_token(search_key, term) for term in terms(text)[:MAX_TOKENS_PER_NOTE]]
+
+
+def query_tokens(search_key: bytes, query: str) -> list:
+    """Tokens a note must all contain to match `query`."""
+    return [term_token(search_key, term) for term in terms(query)]
@@ -0,0 +1,155 @@
+import time
+import threading
+from collections import OrderedDict
+
+# ------------------
+# In-memory secret cache
+# ------------------
+# Values are kept as bytearrays so they can be overwritten when they leave the
+# cache. Python may still hold other copies (decoded strings, widget state),
+# so the wipe is best effort only.
+
+
+class SecretCache:
+    def __init__(self, max_entries: int = 128, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at, tag, bytearray), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns a copy of the cached bytes, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, _, value = entry
+            if expires_at <= time.monotonic():
+                self._evict(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return bytes(value)
+
+    def put(self, key, value: bytes, tag=None):
+        """
+        Caches `value` under `key`. `tag` groups entries for invalidate(),
+        e.g. the document id when the key is (document id, nonce).
+        """
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, tag, bytearray(value))
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def get_or_set(self, key, factory, tag=None) -> bytes:
+        """
+        Returns the cached bytes for `key`, computing and caching them with
+        factory() on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value, tag=tag)
+        return value
+
+    def invalidate(self, tag):
+        """Drops every entry stored with `tag`."""
+        with self._lock:
+            for key in [k for k, (_, t, _) in self._entries.items() if t == tag]:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, key):
+        _, _, value = self._entries.pop(key)
+        value[:] = bytes(len(value))
+
+
+# ------------------
+# In-memory object cache
+# ------------------
+# For parsed, non-secret objects (e.g. RSA public keys) that are expensive to
+# rebuild. Unlike SecretCache, values are returned as-is and never expire.
+
+
+class ObjectCache:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        # key -> (tag, value), least recently used first
+        self._entries = OrderedDict()
+        # tag -> keys stored with it, so invalidation does not scan the cache
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key, factory, tag=None):
+        """
+        Returns the object cached under `key`, building it with factory() on a
+        miss. A miss first drops the other entries of `tag`, so a changed
+        source (new key in the same tag) replaces the stale object.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = factory()
+
+        with self._lock:
+            if tag is not None:
+                self._invalidate(tag)
+            self._discard(key)
+            self._entries[key] = (tag, value)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+        return value
+
+    def invalidate(self, tag):
+        """Drops every entry stored with `tag`."""
+        with self._lock:
+            self._invalidate(tag)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _invalidate(self, tag):
+        for key in self._tags.pop(tag, ()):
+            del self._entries[key]
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] is None:
+            return
+        keys = self._tags[entry[0]]
+        keys.discard(key)
+        if not keys:
+            del self._tags[entry[0]]
+
+
+def session_cache(session_state, name: str = "plaintext_cache", max_entries: int = 128, ttl_seconds: float = 300) -> SecretCache:
+    """
+    Returns the SecretCache stored in a Streamlit session, creating it on first use.
+    """
+    if name not in session_state:
+        session_state[name] = SecretCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return session_state[name]
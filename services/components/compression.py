@@ -0,0 +1,241 @@
+import os
+import io
+import sys
+import lzma
+import time
+import zlib
+import struct
+import argparse
+
+# ------------------
+# Compress-then-encrypt
+# ------------------
+# Ciphertext does not compress, so compression has to happen before
+# encryption. Notes carry a small header inside the encrypted payload:
+#
+#   note payload = 0xFF | version (1) | codec (1) | compressed UTF-8
+#
+# 0xFF never occurs in UTF-8, so payloads stored before compression existed
+# (plain UTF-8) are still recognised. Files record the codec in the
+# segmented stream header instead (see services.components.file).
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_NAMES = {CODEC_NONE: "none", CODEC_ZLIB: "zlib", CODEC_LZMA: "lzma"}
+CODECS = {name: codec for codec, name in CODEC_NAMES.items()}
+
+NOTE_MARKER = b"\xff"
+NOTE_FORMAT_VERSION = 1
+NOTE_HEADER_SIZE = 3
+# Below this size the header and codec overhead usually outweigh the savings
+NOTE_COMPRESS_MIN_BYTES = 256
+
+DEFAULT_LEVELS = {CODEC_ZLIB: 6, CODEC_LZMA: 6}
+# Bytes of a file sampled to decide whether compressing it is worthwhile
+SAMPLE_BYTES = 64 * 1024
+# Compress only if the sample shrinks to at most this fraction
+MIN_SAVINGS_RATIO = 0.9
+
+# MIME types whose content is already compressed
+INCOMPRESSIBLE_PREFIXES = ("image/", "video/", "audio/")
+INCOMPRESSIBLE_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/zstd",
+    "application/pdf",
+    "application/epub+zip",
+    "application/java-archive",
+}
+INCOMPRESSIBLE_SUFFIXES = (".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp")
+
+
+def compress(data: bytes, codec: int, level: int = None) -> bytes:
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, DEFAULT_LEVELS[CODEC_ZLIB] if level is None else level)
+    if codec == CODEC_LZMA:
+        return lzma.compress(data, preset=DEFAULT_LEVELS[CODEC_LZMA] if level is None else level)
+    raise Exception(f"Unknown compression codec: {codec}")
+
+
+def decompress(data: bytes, codec: int) -> bytes:
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_LZMA:
+        return lzma.decompress(data)
+    raise Exception(f"Unknown compression codec: {codec}")
+
+
+def compressor(codec: int, level: int = None):
+    """Returns a streaming compressor with compress()/flush()."""
+    if codec == CODEC_ZLIB:
+        return zlib.compressobj(DEFAULT_LEVELS[CODEC_ZLIB] if level is None else level)
+    if codec == CODEC_LZMA:
+        return lzma.LZMACompressor(preset=DEFAULT_LEVELS[CODEC_LZMA] if level is None else level)
+    raise Exception(f"Unknown compression codec: {codec}")
+
+
+def decompressor(codec: int):
+    """Returns a streaming decompressor with decompress()."""
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codec == CODEC_LZMA:
+        return lzma.LZMADecompressor()
+    raise Exception(f"Unknown compression codec: {codec}")
+
+
+# ------------------
+# Notes
+# ------------------
+def pack_note(data: bytes, codec: int = CODEC_ZLIB, level: int = None) -> bytes:
+    """
+    Returns the payload to encrypt for a note: compressed with a header if
+    that makes it smaller, otherwise the UTF-8 bytes unchanged.
+    """
+    if codec == CODEC_NONE or len(data) < NOTE_COMPRESS_MIN_BYTES:
+        return data
+
+    packed = NOTE_MARKER + struct.pack(">BB", NOTE_FORMAT_VERSION, codec) + compress(data, codec, level)
+    return packed if len(packed) < len(data) else data
+
+
+def unpack_note(payload: bytes) -> bytes:
+    """Inverse of pack_note; plain UTF-8 payloads are returned as-is."""
+    if not payload.startswith(NOTE_MARKER):
+        return payload
+
+    version, codec = struct.unpack(">BB", payload[1:NOTE_HEADER_SIZE])
+    if version != NOTE_FORMAT_VERSION:
+        raise Exception(f"Unsupported note format version: {version}")
+    return decompress(payload[NOTE_HEADER_SIZE:], codec)
+
+
+# ------------------
+# Files
+# ------------------
+def choose_file_codec(content_type: str = None, filename: str = None, sample: bytes = None) -> int:
+    """
+    Picks the codec for a file: none for already-compressed formats or a
+    sample that barely shrinks, zlib otherwise.
+    """
+    content_type = (content_type or "").lower()
+    if content_type.startswith(INCOMPRESSIBLE_PREFIXES) or content_type in INCOMPRESSIBLE_TYPES:
+        return CODEC_NONE
+    if filename and filename.lower().endswith(INCOMPRESSIBLE_SUFFIXES):
+        return CODEC_NONE
+
+    if sample is not None:
+        if not sample or len(zlib.compress(sample, 1)) > len(sample) * MIN_SAVINGS_RATIO:
+            return CODEC_NONE
+    return CODEC_ZLIB
+
+
+class CompressingReader:
+    """
+    Read-only file object returning the compressed form of another one, so
+    the segmented encryptor can consume it like the original file.
+    """
+    def __init__(self, fileobj, codec: int, level: int = None, block_size: int = 256 * 1024):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self._compressor = compressor(codec, level)
+        self._buffer = bytearray()
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            block = self.fileobj.read(self.block_size)
+            if block:
+                self._buffer += self._compressor.compress(block)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+# ------------------
+# Benchmark
+# ------------------
+def _sample_corpus() -> dict:
+    text = b"".join(
+        b"Meeting notes %d: rotate the vault keys, review GridFS usage, ship the release.\n" % i
+        for i in range(20000)
+    )
+    return {
+        "text (repetitive notes)": text,
+        "json-like": b"[" + b",".join(b'{"id": %d, "service": "svc-%d", "ok": true}' % (i, i % 97) for i in range(30000)) + b"]",
+        "random (like images/zips)": os.urandom(len(text)),
+    }
+
+
+def benchmark(corpus: dict = None, settings: list = None) -> list:
+    """
+    Compresses each corpus entry with each (codec, level) and reports the
+    stored size (ciphertext plus AES-GCM tag, as notes store it in a Binary)
+    and compression/decompression speed.
+    """
+    # file.py imports this module
+    from services.components.file import TAG_SIZE
+
+    corpus = corpus or _sample_corpus()
+    settings = settings or [
+        (CODEC_NONE, None),
+        (CODEC_ZLIB, 1), (CODEC_ZLIB, 6), (CODEC_ZLIB, 9),
+        (CODEC_LZMA, 1), (CODEC_LZMA, 6),
+    ]
+
+    rows = []
+    for name, data in corpus.items():
+        for codec, level in settings:
+            started = time.perf_counter()
+            packed = compress(data, codec, level)
+            compress_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            assert decompress(packed, codec) == data
+            decompress_seconds = time.perf_counter() - started
+
+            rows.append({
+                "input": name,
+                "codec": CODEC_NAMES[codec] + ("" if level is None else f"-{level}"),
+                "ratio": len(packed) / len(data),
+                "stored_bytes": len(packed) + TAG_SIZE,
+                "compress_mb_s": len(data) / 1e6 / max(compress_seconds, 1e-9),
+                "decompress_mb_s": len(data) / 1e6 / max(decompress_seconds, 1e-9),
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compression codecs on sample data or files")
+    parser.add_argument("files", nargs="*", help="Files to benchmark instead of the built-in samples")
+    args = parser.parse_args()
+
+    corpus = None
+    if args.files:
+        corpus = {}
+        for path in args.files:
+            with open(path, "rb") as f:
+                corpus[path] = f.read()
+
+    out = io.StringIO()
+    out.write(f"{'input':<28} {'codec':<8} {'ratio':>7} {'stored bytes':>13} {'comp MB/s':>10} {'decomp MB/s':>12}\n")
+    for row in benchmark(corpus):
+        out.write(
+            f"{row['input'][:28]:<28} {row['codec']:<8} {row['ratio']:>7.3f} {row['stored_bytes']:>13} "
+            f"{row['compress_mb_s']:>10.1f} {row['decompress_mb_s']:>12.1f}\n"
+        )
+    sys.stdout.write(out.getvalue())
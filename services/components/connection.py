@@ -0,0 +1,85 @@
+import os
+import atexit
+import threading
+from pymongo import MongoClient, AsyncMongoClient
+
+# ------------------
+# Shared MongoClient registry
+# ------------------
+# MongoClient is thread-safe and owns its own connection pool and monitor
+# threads, so the whole process should share one client per URI instead of
+# building one per component. Module state survives Streamlit reruns.
+MAX_POOL_SIZE = int(os.getenv("CRYPTOLAB_MAX_POOL_SIZE", "50"))
+MIN_POOL_SIZE = int(os.getenv("CRYPTOLAB_MIN_POOL_SIZE", "0"))
+MAX_IDLE_TIME_MS = int(os.getenv("CRYPTOLAB_MAX_IDLE_TIME_MS", "300000"))
+
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def _pool_options(overrides: dict) -> dict:
+    options = {
+        "maxPoolSize": MAX_POOL_SIZE,
+        "minPoolSize": MIN_POOL_SIZE,
+        "maxIdleTimeMS": MAX_IDLE_TIME_MS,
+    }
+    options.update(overrides)
+    return options
+
+
+def get_client(client, **pool_options) -> MongoClient:
+    """
+    Returns the process-wide MongoClient for a URI, creating it on first use.
+
+    Args:
+        client: A MongoDB URI, or an existing client which is returned as is.
+        **pool_options: MongoClient options (maxPoolSize, minPoolSize, ...).
+            They only apply when the client for this URI is first created.
+
+    Returns:
+        MongoClient: The shared client.
+    """
+    if not isinstance(client, str):
+        return client
+
+    with _lock:
+        if client not in _clients:
+            _clients[client] = MongoClient(client, **_pool_options(pool_options))
+        return _clients[client]
+
+
+def get_async_client(client, **pool_options) -> AsyncMongoClient:
+    """
+    Async counterpart of get_client, used by services.components.aio.
+
+    An AsyncMongoClient is bound to the event loop it is first used on, so
+    the async front end should run a single long-lived loop.
+    """
+    if not isinstance(client, str):
+        return client
+
+    with _lock:
+        if client not in _async_clients:
+            _async_clients[client] = AsyncMongoClient(client, **_pool_options(pool_options))
+        return _async_clients[client]
+
+
+async def aclose_all():
+    """Closes every registered async client. Call it before the event loop stops."""
+    with _lock:
+        async_clients = list(_async_clients.values())
+        _async_clients.clear()
+    for mongo_client in async_clients:
+        await mongo_client.close()
+
+
+def close_all():
+    """Closes every registered client. Called automatically at interpreter exit."""
+    with _lock:
+        for mongo_client in _clients.values():
+            mongo_client.close()
+        _clients.clear()
+
+
+atexit.register(close_all)
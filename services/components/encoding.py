@@ -0,0 +1,27 @@
+import base64
+import binascii
+from bson import Binary
+
+# ------------------
+# Stored ciphertext encoding
+# ------------------
+# Documents at SCHEMA_VERSION_BINARY keep ciphertexts and nonces as BSON
+# Binary. Older documents (no schema_version) hold base64 strings; reads accept
+# both until services.components.migrations has rewritten them.
+
+
+def to_binary(value) -> Binary:
+    """Stores raw bytes (or a legacy base64 string) as BSON Binary."""
+    if isinstance(value, str):
+        value = base64.b64decode(value)
+    return Binary(bytes(value))
+
+
+def from_stored(value) -> bytes:
+    """Returns the raw bytes of a stored Binary or legacy base64 field."""
+    if isinstance(value, str):
+        try:
+            return base64.b64decode(value, validate=True)
+        except binascii.Error:
+            raise Exception("Stored value is neither binary nor base64")
+    return bytes(value)
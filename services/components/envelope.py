@@ -0,0 +1,100 @@
+import os
+import base64
+import hmac
+import hashlib
+from bson import Binary, ObjectId
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap, InvalidUnwrap
+from services.components.encoding import from_stored
+
+# ------------------
+# Envelope encryption
+# ------------------
+# Every note, vault entry and file gets its own random data key. The user's DEK
+# only acts as the key-encryption key (KEK): it wraps each data key (AES key
+# wrap, RFC 3394) and the wrapped key is stored next to the ciphertext with the
+# id of the KEK that wrapped it. Rotating the KEK therefore only rewraps these
+# 40-byte keys instead of re-encrypting the data.
+#
+# Objects stored before envelopes have no wrapped_key: their data key is the
+# user's DEK itself, which rotation wraps like any other data key and flags
+# with legacy_key. Such a key is shared by all of the user's legacy objects,
+# so it is never reused for new ciphertexts or handed out in a share.
+DATA_KEY_SIZE = 32
+
+# The user document records the id of the current KEK. Writes check it, so a
+# session still holding a KEK that was rotated away (or that is being rotated,
+# see services.components.rotation) cannot store objects under it.
+STALE_KEK_MESSAGE = "Your encryption key was rotated (or is being rotated), log in again"
+
+
+def _as_key(key) -> bytes:
+    if isinstance(key, str):
+        key = base64.b64decode(key)
+    return key
+
+
+def kek_id(kek: bytes) -> str:
+    """Short public identifier of a KEK (does not reveal the key)."""
+    return hmac.new(_as_key(kek), b"CryptoLab KEK id", hashlib.sha256).hexdigest()[:16]
+
+
+def new_data_key(kek: bytes) -> tuple:
+    """
+    Returns (data_key, {"wrapped_key", "kek_id"}) for a new object.
+    """
+    kek = _as_key(kek)
+    data_key = os.urandom(DATA_KEY_SIZE)
+    return data_key, wrap_data_key(kek, data_key)
+
+
+def current_data_key(kek: bytes, wrapped_key=None, wrapped_kek_id: str = None, legacy: bool = False) -> tuple:
+    """
+    Like new_data_key, but keeps an existing object's own data key (so shares
+    of the object stay valid when it is re-encrypted).
+    """
+    if wrapped_key is None or legacy:
+        return new_data_key(kek)
+    return object_key(kek, wrapped_key, wrapped_kek_id), {"wrapped_key": wrapped_key, "kek_id": wrapped_kek_id}
+
+
+def current_kek_filter(owner_id, wrapped_kek_id: str) -> dict:
+    """
+    Matches the owner's user document only if `wrapped_kek_id` is their current
+    KEK and no rotation is running. Users created before the field have none.
+    """
+    return {
+        "_id": ObjectId(owner_id),
+        "pending_user_dek": {"$exists": False},
+        "kek_id": {"$in": [wrapped_kek_id, None]}
+    }
+
+
+def check_current_kek(users, owner_id, wrapped_kek_id: str):
+    """Raises if a write under `wrapped_kek_id` would use a stale KEK."""
+    if wrapped_kek_id is not None and users.find_one(current_kek_filter(owner_id, wrapped_kek_id), {"_id": 1}) is None:
+        raise Exception(STALE_KEK_MESSAGE)
+
+
+def wrap_data_key(kek: bytes, data_key: bytes) -> dict:
+    kek = _as_key(kek)
+    return {
+        "wrapped_key": Binary(aes_key_wrap(kek, data_key)),
+        "kek_id": kek_id(kek)
+    }
+
+
+def object_key(kek: bytes, wrapped_key=None, wrapped_kek_id: str = None) -> bytes:
+    """
+    Returns the key that encrypted an object: its unwrapped data key, or the
+    KEK itself for objects stored before envelopes.
+    """
+    kek = _as_key(kek)
+    if wrapped_key is None:
+        return kek
+
+    if wrapped_kek_id is not None and wrapped_kek_id != kek_id(kek):
+        raise Exception("Object key is wrapped by another key (key rotation in progress?), log in again")
+    try:
+        return aes_key_unwrap(kek, from_stored(wrapped_key))
+    except InvalidUnwrap:
+        raise Exception("Could not unwrap the object key")
@@ -0,0 +1,127 @@
+import os
+import time
+import atexit
+import threading
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# ------------------
+# Crypto executor
+# ------------------
+# Serves CPU-heavy crypto (bcrypt) from a bounded worker pool instead of the
+# Streamlit script thread. bcrypt releases the GIL, so the default thread pool
+# already scales across cores; "process" is available for other workloads.
+BCRYPT_ROUNDS = int(os.getenv("CRYPTOLAB_BCRYPT_ROUNDS", "12"))
+CRYPTO_EXECUTOR_KIND = os.getenv("CRYPTOLAB_CRYPTO_EXECUTOR", "thread")
+CRYPTO_WORKERS = int(os.getenv("CRYPTOLAB_CRYPTO_WORKERS", str(os.cpu_count() or 1)))
+CRYPTO_QUEUE_SIZE = int(os.getenv("CRYPTOLAB_CRYPTO_QUEUE_SIZE", "64"))
+CRYPTO_SUBMIT_TIMEOUT = float(os.getenv("CRYPTOLAB_CRYPTO_SUBMIT_TIMEOUT", "30"))
+
+
+class CryptoExecutorBusy(Exception):
+    """Raised when the queue stays full for longer than the submit timeout."""
+
+
+# Module-level so they can be pickled into a process pool
+def hash_password(password: bytes, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def check_password(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _timed_call(fn, args):
+    # Returns when the task actually started, to measure queue wait time
+    started_at = time.time()
+    return started_at, fn(*args)
+
+
+class CryptoExecutor:
+    def __init__(self, max_workers: int = CRYPTO_WORKERS, max_queue: int = CRYPTO_QUEUE_SIZE, kind: str = CRYPTO_EXECUTOR_KIND, submit_timeout: float = CRYPTO_SUBMIT_TIMEOUT):
+        """
+        max_workers: pool size
+        max_queue: tasks allowed to wait on top of the running ones
+        kind: "thread" or "process"
+        submit_timeout: seconds to wait for a free slot before raising CryptoExecutorBusy
+        """
+        if kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crypto")
+
+        self.max_workers = max_workers
+        self.submit_timeout = submit_timeout
+        # Backpressure: at most max_workers + max_queue tasks in flight
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    def run(self, fn, *args):
+        """
+        Runs fn(*args) on the pool and blocks until it finishes.
+
+        Raises:
+            CryptoExecutorBusy: If no slot frees up within submit_timeout.
+        """
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            with self._lock:
+                self._rejected += 1
+            raise CryptoExecutorBusy("Crypto executor queue is full, try again later")
+
+        submitted_at = time.time()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            started_at, result = self._pool.submit(_timed_call, fn, args).result()
+            finished_at = time.time()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+        with self._lock:
+            wait = max(started_at - submitted_at, 0.0)
+            self._completed += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._run_total += finished_at - started_at
+        return result
+
+    def metrics(self) -> dict:
+        """
+        Queue depth is estimated as the in-flight tasks beyond the worker count.
+        """
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": max(self._in_flight - self.max_workers, 0),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": self._wait_total / completed,
+                "max_wait_seconds": self._wait_max,
+                "avg_run_seconds": self._run_total / completed
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_crypto_executor() -> CryptoExecutor:
+    """Returns the process-wide CryptoExecutor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = CryptoExecutor()
+            atexit.register(_executor.shutdown)
+        return _executor
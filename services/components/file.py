@@ -1,20 +1,116 @@
 import os 
+import io
 import base64
-from pymongo import MongoClient
+import struct
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from services.components.connection import get_client
 import gridfs
 import hashlib
+import hmac
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from pymongo import ReturnDocument
 import binascii
 from bson import ObjectId
-from services.constant.collection_pipeline import DATABASE_NAME
-from datetime import datetime
+from services.components.compression import (
+    CODEC_NONE,
+    CODEC_NAMES,
+    SAMPLE_BYTES,
+    CompressingReader,
+    choose_file_codec,
+    decompressor as new_decompressor
+)
+from services.components.envelope import new_data_key, object_key, check_current_kek
+from services.constant.collection_pipeline import DATABASE_NAME, COLLECTION_USERS, COLLECTION_SHARES
+from datetime import datetime, timezone
+
+# ------------------
+# Segmented AES-GCM stream format
+# ------------------
+# header    = MAGIC | version (1) | segment_size (4) | nonce_prefix (8) [| codec (1), v2]
+# segment i = AES-GCM(nonce_prefix | i, plaintext[i], aad = header | i | final)
+# Every segment is authenticated on its own, and the final flag stops an
+# attacker from truncating or reordering segments without detection.
+# Version 2 streams compress the whole file first and segment the compressed
+# bytes, so they can only be decrypted from the start.
+STREAM_MAGIC = b"CLSF"
+STREAM_VERSION = 1
+STREAM_VERSION_COMPRESSED = 2
+SEGMENT_SIZE = 256 * 1024
+NONCE_PREFIX_SIZE = 8
+TAG_SIZE = 16
+HEADER_SIZE = len(STREAM_MAGIC) + 1 + 4 + NONCE_PREFIX_SIZE
+HEADER_SIZE_COMPRESSED = HEADER_SIZE + 1
+FILE_FORMAT_SEGMENTED = "aes-gcm-segmented-v1"
+
+# ------------------
+# Per-owner deduplication
+# ------------------
+# An upload is identified by HMAC-SHA256(dedup_key, plaintext), where dedup_key
+# is a random per-user secret (UserIngestion.dedup_key), so identical files
+# from different users (or a guessed plaintext without the key) can't be
+# matched. It is not derived from the DEK, so DEK rotation keeps dedup working. The first upload is
+# the blob and carries metadata.refcount. Re-uploads become alias fs.files
+# documents (length 0, no chunks) with metadata.blob_id. A deleted blob that
+# still has aliases stays stored but hidden until its refcount reaches zero.
+DEDUP_KEY_SIZE = 32
+
+
+class _HashingReader:
+    # Hashes and counts the plaintext as the encryptor (or compressor) reads it
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha = hashlib.sha256()
+        self.length = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.sha.update(data)
+        self.length += len(data)
+        return data
+
+
+class _ProgressReader:
+    # Reports how far an upload has read its source. upload_deduplicated reads
+    # the file twice (hash, then encrypt); seeking back starts the next phase.
+    STEPS = 20
+
+    def __init__(self, fileobj, total: int, report):
+        self.fileobj = fileobj
+        self.total = total
+        self.report = report
+        self.phase = "hash"
+        self.done = 0
+        self._step = -1
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.done += len(data)
+        step = self.done * self.STEPS // self.total if self.total else self.STEPS
+        if step != self._step:
+            self._step = step
+            self.report(self.phase, self.done, self.total)
+        return data
+
+    def tell(self) -> int:
+        return self.fileobj.tell()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        position = self.fileobj.seek(offset, whence)
+        if position == 0 and self.done:
+            self.phase = "encrypt"
+            self.done = 0
+            self._step = -1
+        return position
 
 
 class FileIngestion:
     def __init__(self, client):
-        self.client = MongoClient(client)
+        self.client = get_client(client)
         self.database = self.client[DATABASE_NAME]
         self.fs = gridfs.GridFS(self.database)
+        # Same "fs" bucket as self.fs, but exposes the streaming upload/download API
+        self.bucket = gridfs.GridFSBucket(self.database)
 
     def encrypt_file(self, data, dek: bytes) -> dict:
         """
@@ -76,13 +172,434 @@ class FileIngestion:
         # Later in the app code, I'll save the decrypted data to a file
         return decrypted_data
 
+    # ------------------
+    # Streaming (segmented) AES-GCM
+    # ------------------
+    def _segment_nonce(self, nonce_prefix: bytes, index: int) -> bytes:
+        return nonce_prefix + struct.pack(">I", index)
+
+    def _segment_aad(self, header: bytes, index: int, final: bool) -> bytes:
+        return header + struct.pack(">I?", index, final)
+
+    def _read_exact(self, fileobj, size: int) -> bytes:
+        # file.read(n) may legally return fewer bytes before EOF
+        parts = []
+        remaining = size
+        while remaining > 0:
+            part = fileobj.read(remaining)
+            if not part:
+                break
+            parts.append(part)
+            remaining -= len(part)
+        return b"".join(parts)
+
+    def _encrypt_segments(self, fileobj, dek: bytes, segment_size: int, state: dict, compression: int = CODEC_NONE, compression_level: int = None):
+        """
+        Yields the stream header followed by every encrypted segment.
+
+        Once exhausted, state holds the plaintext "sha256" and "length", the
+        "compression" codec and the file's wrapped data "key".
+        """
+        if isinstance(fileobj, (bytes, bytearray)):
+            fileobj = io.BytesIO(fileobj)
+
+        # The file is encrypted under its own data key, wrapped by the DEK
+        data_key, state["key"] = new_data_key(dek)
+        aes = AESGCM(data_key)
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        plaintext = _HashingReader(fileobj)
+        if compression == CODEC_NONE:
+            source = plaintext
+            header = STREAM_MAGIC + struct.pack(">BI", STREAM_VERSION, segment_size) + nonce_prefix
+        else:
+            source = CompressingReader(plaintext, compression, compression_level, block_size=segment_size)
+            header = STREAM_MAGIC + struct.pack(">BI", STREAM_VERSION_COMPRESSED, segment_size) + nonce_prefix + struct.pack(">B", compression)
+
+        yield header
+
+        index = 0
+        segment = self._read_exact(source, segment_size)
+        while True:
+            # Look one segment ahead so the last one can be flagged as final
+            next_segment = self._read_exact(source, segment_size)
+            final = not next_segment
+
+            yield aes.encrypt(
+                self._segment_nonce(nonce_prefix, index),
+                segment,
+                self._segment_aad(header, index, final)
+            )
+
+            if final:
+                break
+            segment = next_segment
+            index += 1
+
+        state["sha256"] = plaintext.sha.hexdigest()
+        state["length"] = plaintext.length
+        state["compression"] = compression
+
+    def _stream_metadata(self, metadata: dict, state: dict, segment_size: int) -> dict:
+        file_metadata = dict(metadata or {})
+        file_metadata.update({
+            "sha256": state["sha256"],
+            "format": FILE_FORMAT_SEGMENTED,
+            "segment_size": segment_size,
+            "plaintext_length": state["length"],
+            "compression": CODEC_NAMES[state["compression"]],
+            **state["key"]
+        })
+        return file_metadata
+
+    def encrypt_file_stream(self, fileobj, dek: bytes, filename: str, metadata: dict = None, segment_size: int = SEGMENT_SIZE, compression: int = CODEC_NONE, compression_level: int = None) -> dict:
+        """
+        Encrypts a file segment by segment and writes it straight into GridFS.
+
+        Only a couple of segments are held in memory at a time, and the
+        SHA-256 of the plaintext is computed in the same pass.
+
+        Parameters:
+            fileobj: A readable binary file-like object (or raw bytes).
+            dek (bytes): The raw bytes of the Data Encryption Key (DEK).
+            dedup_key (bytes): The owner's UserIngestion.dedup_key.
+            filename (str): The GridFS filename.
+            metadata (dict): Extra metadata stored on the fs.files document.
+            segment_size (int): Plaintext bytes per encrypted segment.
+            compression (int): Codec applied before encryption (see choose_compression).
+            compression_level (int): Codec level (None = codec default).
+
+        Returns:
+            dict: The GridFS file id, the SHA-256 hash and the plaintext length.
+        """
+        state = {}
+        grid_in = self.bucket.open_upload_stream(filename)
+        try:
+            for chunk in self._encrypt_segments(fileobj, dek, segment_size, state, compression, compression_level):
+                grid_in.write(chunk)
+            # Checked last so a rotation that started during the upload is seen
+            owner_id = (metadata or {}).get("owner_id")
+            if owner_id is not None:
+                check_current_kek(self.database[COLLECTION_USERS], owner_id, state["key"]["kek_id"])
+        except Exception:
+            grid_in.abort()
+            raise
+
+        # Written to fs.files together with the file document on close()
+        grid_in.metadata = self._stream_metadata(metadata, state, segment_size)
+        grid_in.close()
+
+        return {
+            "file_id": grid_in._id,
+            "sha256": state["sha256"],
+            "length": state["length"]
+        }
+
+    def _header_size(self, prefix: bytes) -> int:
+        """
+        Full header size, given at least the magic and version bytes.
+        """
+        if prefix[:len(STREAM_MAGIC)] != STREAM_MAGIC or len(prefix) <= len(STREAM_MAGIC):
+            raise Exception("Invalid encrypted stream header")
+
+        version = prefix[len(STREAM_MAGIC)]
+        if version == STREAM_VERSION:
+            return HEADER_SIZE
+        if version == STREAM_VERSION_COMPRESSED:
+            return HEADER_SIZE_COMPRESSED
+        raise Exception(f"Unsupported encrypted stream version: {version}")
+
+    def _read_stream_header(self, fileobj) -> bytes:
+        header = self._read_exact(fileobj, HEADER_SIZE)
+        return header + self._read_exact(fileobj, self._header_size(header) - len(header))
+
+    def _parse_stream_header(self, header: bytes):
+        if len(header) < HEADER_SIZE or len(header) != self._header_size(header):
+            raise Exception("Invalid encrypted stream header")
+
+        segment_size = struct.unpack(">I", header[len(STREAM_MAGIC) + 1:len(STREAM_MAGIC) + 5])[0]
+        nonce_prefix = header[len(STREAM_MAGIC) + 5:HEADER_SIZE]
+        return segment_size, nonce_prefix
+
+    def _stream_codec(self, header: bytes) -> int:
+        return header[HEADER_SIZE] if len(header) > HEADER_SIZE else CODEC_NONE
+
+    def _decrypt_segment(self, aes: AESGCM, header: bytes, index: int, final: bool, encrypted: bytes) -> bytes:
+        nonce_prefix = header[len(STREAM_MAGIC) + 5:HEADER_SIZE]
+        return aes.decrypt(
+            self._segment_nonce(nonce_prefix, index),
+            encrypted,
+            self._segment_aad(header, index, final)
+        )
+
+    def decrypt_file_stream(self, fileobj, data_key: bytes):
+        """
+        Decrypts a segmented stream, yielding verified plaintext segments.
+
+        `data_key` is the file's own key, not the user's DEK: unwrap it from
+        the file metadata with envelope.object_key first (as
+        stream_decrypted_file does).
+
+        Raises cryptography's InvalidTag if any segment was tampered with,
+        reordered or if the stream was truncated.
+        """
+        if isinstance(data_key, str):
+            data_key = base64.b64decode(data_key)
+
+        aes = AESGCM(data_key)
+        header = self._read_stream_header(fileobj)
+        segment_size, _ = self._parse_stream_header(header)
+        encrypted_size = segment_size + TAG_SIZE
+
+        def segments():
+            index = 0
+            segment = self._read_exact(fileobj, encrypted_size)
+            while True:
+                next_segment = self._read_exact(fileobj, encrypted_size)
+                final = not next_segment
+
+                yield self._decrypt_segment(aes, header, index, final, segment)
+
+                if final:
+                    break
+                segment = next_segment
+                index += 1
+
+        yield from self._decompress_segments(segments(), self._stream_codec(header))
+
+    def _decompress_segments(self, segments, codec: int):
+        if codec == CODEC_NONE:
+            yield from segments
+            return
+
+        decompressor = new_decompressor(codec)
+        for segment in segments:
+            data = decompressor.decompress(segment)
+            if data:
+                yield data
+        if not decompressor.eof:
+            raise Exception("Truncated compressed stream")
+
     def integrity_check(self, decrypted_data: bytes, sha256: str) -> bool:
         sha_digest = hashlib.sha256(decrypted_data).hexdigest()
         return sha_digest == sha256
     
     def get_files_list(self, owner_id: ObjectId):
-        files = self.database.fs.files.find({"metadata.owner_id": ObjectId(owner_id)}).sort("uploadDate", -1)
+        files = self.database.fs.files.find(self._files_query(owner_id)).sort("uploadDate", -1)
         return list(files)
+
+    def _files_query(self, owner_id: ObjectId) -> dict:
+        # Deleted blobs kept alive by aliases are not listed
+        return {"metadata.owner_id": ObjectId(owner_id), "metadata.hidden": {"$ne": True}}
+
+    # ------------------
+    # Deduplicated uploads
+    # ------------------
+    def _content_hmac(self, fileobj, dedup_key: bytes) -> str:
+        mac = hmac.new(dedup_key, digestmod=hashlib.sha256)
+        while True:
+            block = fileobj.read(SEGMENT_SIZE)
+            if not block:
+                break
+            mac.update(block)
+        return mac.hexdigest()
+
+    def _acquire_blob(self, owner_id: ObjectId, content_hmac: str):
+        """
+        Takes a reference on the owner's blob with this content, if any.
+        A blob whose refcount already dropped to zero is being collected
+        and can't be revived.
+        """
+        return self.database.fs.files.find_one_and_update(
+            self._acquire_blob_query(owner_id, content_hmac),
+            {"$inc": {"metadata.refcount": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _acquire_blob_query(self, owner_id: ObjectId, content_hmac: str) -> dict:
+        return {
+            "metadata.owner_id": ObjectId(owner_id),
+            "metadata.content_hmac": content_hmac,
+            "metadata.blob_id": {"$exists": False},
+            "metadata.refcount": {"$gt": 0}
+        }
+
+    def _alias_doc(self, blob: dict, filename: str, metadata: dict, owner_id: ObjectId) -> dict:
+        alias_metadata = dict(metadata)
+        alias_metadata.update({
+            "owner_id": owner_id,
+            "blob_id": blob["_id"],
+            "sha256": blob["metadata"].get("sha256")
+        })
+        return {
+            "length": 0,
+            "chunkSize": blob.get("chunkSize", gridfs.DEFAULT_CHUNK_SIZE),
+            "uploadDate": datetime.now(timezone.utc),
+            "filename": filename,
+            "metadata": alias_metadata
+        }
+
+    def _alias_result(self, alias_id, blob: dict) -> dict:
+        return {
+            "file_id": alias_id,
+            "blob_id": blob["_id"],
+            "sha256": blob["metadata"].get("sha256"),
+            "length": blob["metadata"].get("plaintext_length"),
+            "deduplicated": True
+        }
+
+    def _blob_metadata(self, metadata: dict, owner_id: ObjectId, content_hmac: str) -> dict:
+        blob_metadata = dict(metadata)
+        blob_metadata.update({"owner_id": owner_id, "content_hmac": content_hmac, "refcount": 1})
+        return blob_metadata
+
+    def upload_deduplicated(self, fileobj, dek: bytes, dedup_key: bytes, filename: str, metadata: dict, segment_size: int = SEGMENT_SIZE, compression: int = CODEC_NONE) -> dict:
+        """
+        Stores a file for metadata["owner_id"], reusing the owner's existing
+        blob when an identical file was uploaded before. A duplicate costs one
+        hashing pass and two small writes instead of encryption and upload.
+
+        Parameters:
+            fileobj: A seekable binary file-like object (or raw bytes).
+            dek (bytes): The raw bytes of the Data Encryption Key (DEK).
+            dedup_key (bytes): The owner's UserIngestion.dedup_key.
+            filename (str): The GridFS filename.
+            metadata (dict): Metadata of the logical file; must hold owner_id.
+
+        Returns:
+            dict: The logical file id, the blob id, the SHA-256 hash, the
+                plaintext length and whether the upload was deduplicated.
+        """
+        if isinstance(fileobj, (bytes, bytearray)):
+            fileobj = io.BytesIO(fileobj)
+
+        owner_id = ObjectId(metadata["owner_id"])
+        content_hmac = self._content_hmac(fileobj, dedup_key)
+        fileobj.seek(0)
+
+        blob = self._acquire_blob(owner_id, content_hmac)
+        if blob is not None:
+            alias_id = self.database.fs.files.insert_one(self._alias_doc(blob, filename, metadata, owner_id)).inserted_id
+            return self._alias_result(alias_id, blob)
+
+        blob_metadata = self._blob_metadata(metadata, owner_id, content_hmac)
+        enc = self.encrypt_file_stream(fileobj, dek, filename, metadata=blob_metadata, segment_size=segment_size, compression=compression)
+        enc.update({"blob_id": enc["file_id"], "deduplicated": False})
+        return enc
+
+    def upload_many(self, uploads, dek: bytes, dedup_key: bytes, max_workers: int = None):
+        """
+        Uploads several files in parallel, yielding progress events in the
+        caller's thread.
+
+        Each file runs upload_deduplicated in a worker thread: AES-GCM and
+        hashing release the GIL, and GridFS writes of one file overlap with
+        encryption of the others. Files are streamed segment by segment and
+        at most max_workers are in flight, so memory stays bounded no matter
+        how many files are queued.
+
+        Parameters:
+            uploads: Iterable of (fileobj, filename, metadata) tuples; metadata
+                must hold owner_id and may hold content_type/original_filename.
+            dek (bytes): The raw bytes of the Data Encryption Key (DEK).
+            dedup_key (bytes): The owner's UserIngestion.dedup_key.
+            max_workers (int): Parallel uploads (None = CPU count).
+
+        Yields:
+            dict: {"index", "filename", "event", ...} where event is
+                "progress" (with "phase", "done", "total"), "done" (with
+                "file_id", "deduplicated") or "error" (with "error").
+        """
+        workers = max_workers or os.cpu_count() or 1
+        events = queue.Queue()
+        uploads = iter(enumerate(uploads))
+
+        def run(index, fileobj, filename, metadata):
+            def report(phase, done, total):
+                events.put({"index": index, "filename": filename, "event": "progress", "phase": phase, "done": done, "total": total})
+
+            try:
+                fileobj.seek(0, io.SEEK_END)
+                total = fileobj.tell()
+                fileobj.seek(0)
+                reader = _ProgressReader(fileobj, total, report)
+                compression = self.choose_compression(fileobj, metadata.get("content_type"), metadata.get("original_filename"))
+                enc = self.upload_deduplicated(reader, dek, dedup_key, filename, metadata, compression=compression)
+                events.put({"index": index, "filename": filename, "event": "done", "file_id": enc["file_id"], "deduplicated": enc["deduplicated"]})
+            except Exception as e:
+                events.put({"index": index, "filename": filename, "event": "error", "error": str(e)})
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as executor:
+            in_flight = 0
+            exhausted = False
+            while True:
+                # Keep at most `workers` files in flight
+                while not exhausted and in_flight < workers:
+                    item = next(uploads, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    index, (fileobj, filename, metadata) = item
+                    executor.submit(run, index, fileobj, filename, metadata)
+                    in_flight += 1
+                if not in_flight:
+                    break
+
+                # run() reports every file exactly once as "done" or "error"
+                event = events.get()
+                if event["event"] != "progress":
+                    in_flight -= 1
+                yield event
+
+    def delete_file(self, file_id) -> bool:
+        """
+        Deletes a logical file: an alias is removed and releases its blob, a
+        blob is hidden and released. The ciphertext is only deleted once no
+        entry references it any more. Returns False if the entry was already
+        deleted, so a repeated call never releases the blob twice.
+        """
+        file_id = ObjectId(file_id)
+        doc = self.database.fs.files.find_one({"_id": file_id}, {"metadata.blob_id": 1})
+        if doc is None:
+            return False
+
+        blob_id = (doc.get("metadata") or {}).get("blob_id")
+        if blob_id is not None:
+            # Aliases have no chunks; only the call that removed it releases
+            if self.database.fs.files.delete_one({"_id": file_id}).deleted_count != 1:
+                return False
+            self._release_blob(blob_id, hide=False)
+        elif not self._release_blob(file_id, hide=True):
+            return False
+        # Drop the shares of the entry with it
+        self.database[COLLECTION_SHARES].delete_many({"object_id": file_id})
+        return True
+
+    def _release_blob(self, blob_id, hide: bool) -> bool:
+        """
+        Drops one reference on a blob (hiding it if its own entry is deleted)
+        and deletes the ciphertext once none are left. Returns False if the
+        blob was gone, or already hidden when `hide` is set.
+        """
+        query, update = self._release_blob_update(blob_id, hide)
+        blob = self.database.fs.files.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if blob is None:
+            return False
+        if self._blob_unreferenced(blob):
+            self.fs.delete(blob_id)
+        return True
+
+    def _release_blob_update(self, blob_id, hide: bool) -> tuple:
+        query = {"_id": blob_id}
+        update = {"$inc": {"metadata.refcount": -1}}
+        if hide:
+            # Hiding is this entry's own reference: release it only once
+            query["metadata.hidden"] = {"$ne": True}
+            update["$set"] = {"metadata.hidden": True}
+        return query, update
+
+    def _blob_unreferenced(self, blob: dict) -> bool:
+        # Files stored before dedup have no refcount: $inc takes them to -1
+        return blob["metadata"]["refcount"] <= 0
     
     
     def upload_to_gridfs(self, filename, encrypted_bytes: bytes, metadata: dict = None):
@@ -93,7 +610,127 @@ class FileIngestion:
     def download_from_gridfs(self, file_id):
         data = self.fs.get(file_id).read()
         return data
+
+    def _segment_range(self, stored_length: int, segment_size: int, start: int, end: int, header_size: int = HEADER_SIZE):
+        """
+        Maps a plaintext byte range onto segment indexes.
+
+        Returns (segment_count, first, last, end); first > last means the
+        range is empty.
+        """
+        encrypted_size = segment_size + TAG_SIZE
+        # An empty file is still one (empty, final) segment
+        segment_count = max(1, -(-(stored_length - header_size) // encrypted_size))
+        plaintext_length = stored_length - header_size - segment_count * TAG_SIZE
+
+        end = plaintext_length if end is None else min(end, plaintext_length)
+        if start == 0 and end == plaintext_length:
+            return segment_count, 0, segment_count - 1, end
+        if start >= end:
+            return segment_count, 1, 0, end
+
+        return segment_count, start // segment_size, (end - 1) // segment_size, end
+
+    def stream_decrypted_file(self, file_id, dek: bytes, start: int = 0, end: int = None, data_key: bytes = None):
+        """
+        Lazily decrypts a stored file, yielding plaintext chunks.
+
+        GridFS chunks are pulled on demand and every encrypted segment is
+        authenticated before its bytes are yielded. With a byte range only the
+        segments overlapping [start, end) are fetched and decrypted.
+
+        Parameters:
+            file_id: The GridFS file id.
+            dek (bytes): The raw bytes of the Data Encryption Key (DEK).
+            start (int): First plaintext byte to return.
+            end (int): One past the last plaintext byte (None = end of file).
+            data_key (bytes): The file's own key (e.g. from a share), used
+                instead of unwrapping it with `dek`.
+
+        Raises:
+            Exception: If a full read does not match the stored SHA-256.
+        """
+        grid_out = self.bucket.open_download_stream(file_id)
+        if (grid_out.metadata or {}).get("blob_id") is not None:
+            # Deduplicated entry: the ciphertext lives in the blob
+            grid_out = self.bucket.open_download_stream(grid_out.metadata["blob_id"])
+        metadata = grid_out.metadata or {}
+        full_read = start == 0 and end is None
+        dek = data_key or object_key(dek, metadata.get("wrapped_key"), metadata.get("kek_id"))
+
+        if metadata.get("format") != FILE_FORMAT_SEGMENTED:
+            # Legacy single-message files can only be decrypted as a whole
+            data = self.decrypt_file(grid_out.read(), dek)
+            if full_read and metadata.get("sha256") and not self.integrity_check(data, metadata["sha256"]):
+                raise Exception("Integrity check failed")
+            yield data[start:end]
+            return
+
+        aes = AESGCM(dek)
+        header = self._read_stream_header(grid_out)
+        segment_size, _ = self._parse_stream_header(header)
+        encrypted_size = segment_size + TAG_SIZE
+        codec = self._stream_codec(header)
+        sha = hashlib.sha256() if full_read else None
+
+        if codec != CODEC_NONE:
+            # Compressed streams decompress from the first segment; a range
+            # read still stops fetching once `end` is reached
+            segment_count = self._segment_range(grid_out.length, segment_size, 0, None, len(header))[0]
+            segments = (
+                self._decrypt_segment(aes, header, index, index == segment_count - 1, self._read_exact(grid_out, encrypted_size))
+                for index in range(segment_count)
+            )
+            for data in self._slice_stream(self._decompress_segments(segments, codec), start, end):
+                if sha is not None:
+                    sha.update(data)
+                yield data
+            if sha is not None and metadata.get("sha256") and sha.hexdigest() != metadata["sha256"]:
+                raise Exception("Integrity check failed")
+            return
+
+        segment_count, first, last, end = self._segment_range(grid_out.length, segment_size, start, end)
+        if first > last:
+            return
+
+        grid_out.seek(HEADER_SIZE + first * encrypted_size)
+        for index in range(first, last + 1):
+            segment = self._decrypt_segment(
+                aes, header, index, index == segment_count - 1,
+                self._read_exact(grid_out, encrypted_size)
+            )
+            if sha is not None:
+                sha.update(segment)
+
+            offset = index * segment_size
+            yield segment[max(start - offset, 0):end - offset]
+
+        if sha is not None and metadata.get("sha256") and sha.hexdigest() != metadata["sha256"]:
+            raise Exception("Integrity check failed")
     
+    def _slice_stream(self, chunks, start: int, end: int = None):
+        # Yields the [start, end) bytes of a chunk stream and stops pulling
+        # chunks once past end
+        offset = 0
+        for chunk in chunks:
+            if end is not None and offset >= end:
+                return
+            lo = max(start - offset, 0)
+            hi = len(chunk) if end is None else min(end - offset, len(chunk))
+            if lo < hi:
+                yield chunk[lo:hi]
+            offset += len(chunk)
+
+    def choose_compression(self, fileobj, content_type: str = None, filename: str = None) -> int:
+        """
+        Picks the codec for an upload from its MIME type and a sample of its
+        first bytes (the file position is restored).
+        """
+        position = fileobj.tell()
+        sample = fileobj.read(SAMPLE_BYTES)
+        fileobj.seek(position)
+        return choose_file_codec(content_type, filename, sample)
+
     def delete_from_gridfs(self, file_id):
         self.fs.delete(file_id)
         return True
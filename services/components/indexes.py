@@ -0,0 +1,201 @@
+import os
+import sys
+import argparse
+from pprint import pprint
+from bson import ObjectId, Binary
+from pymongo.errors import OperationFailure
+from services.components.connection import get_client
+from services.components.vault import VaultIngestion
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_USERS,
+    COLLECTION_NOTES,
+    COLLECTION_VAULT,
+    COLLECTION_FILES,
+    INDEXES
+)
+
+
+class IndexManager:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.database = self.client[DATABASE_NAME]
+
+    def ensure_indexes(self) -> list:
+        """
+        Creates every index in INDEXES that does not exist yet.
+
+        Safe to run on every startup: existing indexes are left alone and a
+        failure on one index (e.g. duplicate usernames blocking the unique
+        index) is reported instead of raised. An existing index whose keys,
+        unique flag or partial filter differ from INDEXES is reported as a
+        "conflict"; it has to be dropped before it can be rebuilt.
+
+        Returns:
+            list: One {"collection", "name", "status", "error"} dict per index,
+                where status is "exists", "created", "conflict" or "failed".
+        """
+        report = []
+        for collection_name, specs in INDEXES.items():
+            collection = self.database[collection_name]
+            existing = collection.index_information()
+
+            for keys, options in specs:
+                entry = {"collection": collection_name, "name": options["name"], "status": "exists", "error": None}
+                match = self._existing_index(existing, keys, options)
+                if match is not None:
+                    name, info = match
+                    if not self._same_index(info, keys, options):
+                        entry["status"] = "conflict"
+                        entry["error"] = f"Existing index {name} differs in keys, unique or partialFilterExpression"
+                else:
+                    try:
+                        collection.create_index(keys, **options)
+                        entry["status"] = "created"
+                    except OperationFailure as e:
+                        entry["status"] = "failed"
+                        entry["error"] = str(e)
+                report.append(entry)
+        return report
+
+    def _existing_index(self, existing: dict, keys: list, options: dict):
+        # An index on the same keys under another name counts as provisioned
+        if options["name"] in existing:
+            return options["name"], existing[options["name"]]
+        for name, info in existing.items():
+            if list(map(tuple, info["key"])) == list(keys):
+                return name, info
+        return None
+
+    def _same_index(self, info: dict, keys: list, options: dict) -> bool:
+        return (
+            list(map(tuple, info["key"])) == list(keys)
+            and bool(info.get("unique", False)) == bool(options.get("unique", False))
+            and info.get("partialFilterExpression") == options.get("partialFilterExpression")
+        )
+
+    def index_status(self) -> dict:
+        """
+        Returns the existing/missing/conflicting indexes per collection and any index
+        builds currently in progress (requires the inprog privilege; skipped
+        on deployments that forbid $currentOp).
+        """
+        status = {}
+        for collection_name, specs in INDEXES.items():
+            existing = self.database[collection_name].index_information()
+            missing, conflicts = [], []
+            for keys, options in specs:
+                match = self._existing_index(existing, keys, options)
+                if match is None:
+                    missing.append(options["name"])
+                elif not self._same_index(match[1], keys, options):
+                    conflicts.append(options["name"])
+            status[collection_name] = {
+                "indexes": sorted(existing),
+                "missing": missing,
+                "conflicts": conflicts
+            }
+
+        in_progress = []
+        try:
+            ops = self.client.admin.aggregate([
+                {"$currentOp": {"allUsers": True, "idleConnections": False}},
+                {"$match": {"command.createIndexes": {"$exists": True}, "ns": {"$regex": f"^{DATABASE_NAME}\\."}}}
+            ])
+            for op in ops:
+                in_progress.append({
+                    "ns": op.get("ns"),
+                    "msg": op.get("msg"),
+                    "progress": op.get("progress")
+                })
+        except OperationFailure:
+            in_progress = None
+
+        return {
+            "collections": status,
+            "in_progress": in_progress
+        }
+
+    def explain_queries(self, owner_id: ObjectId = None, username: str = "") -> dict:
+        """
+        Runs explain() on each hot query shape and summarizes the winning plan,
+        so collection scans (COLLSCAN) are easy to spot.
+        """
+        owner_id = ObjectId(owner_id) if owner_id else ObjectId()
+        shapes = {
+            "login (users by username)":
+                self.database[COLLECTION_USERS].find({"username": username}).explain,
+            "notes page (owner_id, _id desc)":
+                self.database[COLLECTION_NOTES].find({"owner_id": owner_id}).sort("_id", -1).limit(21).explain,
+            "notes search (owner_id, search_tokens $all)":
+                self.database[COLLECTION_NOTES].find({"owner_id": owner_id, "search_tokens": {"$all": [Binary(bytes(8))]}}).sort("_id", -1).limit(50).explain,
+            "vault overview ($facet on owner_id, service)":
+                lambda: self._explain_aggregate(COLLECTION_VAULT, VaultIngestion(self.client)._overview_pipeline(owner_id, "", 50)),
+            "vault by service (owner_id, service)":
+                self.database[COLLECTION_VAULT].find({"owner_id": owner_id, "service": ""}).explain,
+            "files list (metadata.owner_id, uploadDate desc)":
+                self.database[COLLECTION_FILES].find({"metadata.owner_id": owner_id}).sort("uploadDate", -1).explain,
+        }
+
+        plans = {}
+        for shape, explain_shape in shapes.items():
+            explain = explain_shape()
+            stages, index_names = [], []
+            self._walk_plan(self._query_planner(explain).get("winningPlan", {}), stages, index_names)
+            plans[shape] = {
+                "stages": stages,
+                "indexes": index_names,
+                "collection_scan": "COLLSCAN" in stages
+            }
+        return plans
+
+    def _explain_aggregate(self, collection_name: str, pipeline: list) -> dict:
+        return self.database.command("aggregate", collection_name, pipeline=pipeline, explain=True)
+
+    def _query_planner(self, explain: dict) -> dict:
+        # Aggregations report the plan of their leading $match/$sort under
+        # stages[0].$cursor (or at the top level once pushed down to find)
+        if "queryPlanner" in explain:
+            return explain["queryPlanner"]
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                return stage["$cursor"].get("queryPlanner", {})
+        return {}
+
+    def _walk_plan(self, plan, stages: list, index_names: list):
+        # Winning plans nest their input stages ("inputStage", "inputStages",
+        # or "queryPlan" with the slot based engine)
+        if isinstance(plan, list):
+            for item in plan:
+                self._walk_plan(item, stages, index_names)
+            return
+        if not isinstance(plan, dict):
+            return
+
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            index_names.append(plan["indexName"])
+        for key in ("queryPlan", "inputStage", "inputStages"):
+            if key in plan:
+                self._walk_plan(plan[key], stages, index_names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provision and inspect CryptoLab indexes")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"), help="MongoDB URI (default: $MONGO_URI)")
+    parser.add_argument("--status", action="store_true", help="Show index status instead of creating indexes")
+    parser.add_argument("--explain", action="store_true", help="Show the query plan of every hot query")
+    parser.add_argument("--owner-id", default=None, help="Owner id used for --explain")
+    args = parser.parse_args()
+
+    if not args.uri:
+        sys.exit("Set MONGO_URI or pass --uri")
+
+    manager = IndexManager(args.uri)
+    if args.status:
+        pprint(manager.index_status())
+    elif args.explain:
+        pprint(manager.explain_queries(owner_id=args.owner_id))
+    else:
+        pprint(manager.ensure_indexes())
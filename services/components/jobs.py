@@ -0,0 +1,355 @@
+import os
+import sys
+import time
+import uuid
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ReturnDocument
+from services.components.connection import get_client
+from services.components.purge import AccountPurge
+from services.components.migrations import BinaryFieldsMigration, MIGRATION_BATCH_SIZE
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_JOBS
+)
+
+# ------------------
+# Background jobs
+# ------------------
+# Jobs live in a MongoDB collection so they survive browser refreshes and app
+# restarts. A worker claims one atomically (find_one_and_update) and holds a
+# lease it keeps renewing with heartbeats; if the worker dies, the lease runs
+# out and another worker picks the job up again. Failed jobs are retried with
+# exponential backoff until max_attempts; a lease that runs out on the last
+# attempt fails the job.
+#
+# Payloads are stored in the database, so never enqueue key material (DEKs,
+# passwords): work that needs the user's DEK stays in the user's session.
+JOB_LEASE_SECONDS = int(os.getenv("CRYPTOLAB_JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("CRYPTOLAB_JOB_POLL_INTERVAL", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("CRYPTOLAB_JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("CRYPTOLAB_JOB_RETRY_BASE_SECONDS", "5"))
+# Progress updates are written at most this often
+JOB_PROGRESS_INTERVAL = 1.0
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobQueue:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.collection = self.database[COLLECTION_JOBS]
+
+    def enqueue(self, kind: str, payload: dict = None, owner_id: ObjectId = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """
+        Adds a job and returns its id. `kind` must be a key of JOB_HANDLERS.
+        """
+        if kind not in JOB_HANDLERS:
+            raise Exception(f"Unknown job kind: {kind}")
+
+        now = _now()
+        res = self.collection.insert_one({
+            "kind": kind,
+            "payload": payload or {},
+            "owner_id": ObjectId(owner_id) if owner_id else None,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_at": now,
+            "worker_id": None,
+            "lease_expires_at": None,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        })
+        return str(res.inserted_id)
+
+    def claim(self, worker_id: str, kinds: list = None, lease_seconds: int = JOB_LEASE_SECONDS, job_id: str = None):
+        """
+        Atomically takes the oldest runnable job: a queued job that is due, or
+        a running job whose lease expired with attempts left. Returns the job
+        document or None.
+        """
+        now = _now()
+        query = {"$or": [
+            {"status": JOB_QUEUED, "run_at": {"$lte": now}},
+            {
+                "status": JOB_RUNNING,
+                "lease_expires_at": {"$lt": now},
+                "$expr": {"$lt": ["$attempts", "$max_attempts"]}
+            }
+        ]}
+        if kinds:
+            query["kind"] = {"$in": list(kinds)}
+        if job_id:
+            query["_id"] = ObjectId(job_id)
+
+        job = self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            self._fail_abandoned(now)
+        return job
+
+    def _fail_abandoned(self, now: datetime) -> int:
+        """
+        Marks failed the jobs whose worker died during their last attempt
+        (claim no longer picks them up). Returns how many were failed.
+        """
+        res = self.collection.update_many(
+            {
+                "status": JOB_RUNNING,
+                "lease_expires_at": {"$lt": now},
+                "$expr": {"$gte": ["$attempts", "$max_attempts"]}
+            },
+            {"$set": {
+                "status": JOB_FAILED,
+                "error": "Worker lost during the last attempt",
+                "lease_expires_at": None,
+                "updated_at": now
+            }}
+        )
+        return res.modified_count
+
+    def heartbeat(self, job_id, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS, progress: dict = None) -> bool:
+        """
+        Extends the lease (and records progress). Returns False if the lease
+        was lost to another worker.
+        """
+        now = _now()
+        update = {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}
+        if progress is not None:
+            update["progress"] = progress
+        res = self.collection.update_one(
+            {"_id": ObjectId(job_id), "worker_id": worker_id, "status": JOB_RUNNING},
+            {"$set": update}
+        )
+        return res.matched_count == 1
+
+    def complete(self, job_id, worker_id: str, result: dict = None) -> bool:
+        res = self.collection.update_one(
+            {"_id": ObjectId(job_id), "worker_id": worker_id, "status": JOB_RUNNING},
+            {"$set": {
+                "status": JOB_SUCCEEDED,
+                "result": result,
+                "error": None,
+                "lease_expires_at": None,
+                "updated_at": _now()
+            }}
+        )
+        return res.matched_count == 1
+
+    def fail(self, job_id, worker_id: str, error: str) -> bool:
+        """
+        Re-queues the job with exponential backoff, or marks it failed once
+        it has used up max_attempts.
+        """
+        job = self.collection.find_one({"_id": ObjectId(job_id), "worker_id": worker_id, "status": JOB_RUNNING})
+        if job is None:
+            return False
+
+        now = _now()
+        update = {"error": error, "lease_expires_at": None, "updated_at": now}
+        if job["attempts"] >= job["max_attempts"]:
+            update["status"] = JOB_FAILED
+        else:
+            update["status"] = JOB_QUEUED
+            update["run_at"] = now + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1))
+
+        res = self.collection.update_one(
+            {"_id": job["_id"], "worker_id": worker_id, "status": JOB_RUNNING},
+            {"$set": update}
+        )
+        return res.matched_count == 1
+
+    def get_status(self, job_id, owner_id: ObjectId = None):
+        """
+        Returns the job's public fields, or None if it does not exist (or
+        belongs to another owner).
+        """
+        query = {"_id": ObjectId(job_id)}
+        if owner_id is not None:
+            query["owner_id"] = ObjectId(owner_id)
+        doc = self.collection.find_one(query, {"payload": 0})
+        return self._serialize_job(doc) if doc else None
+
+    def latest_job(self, owner_id: ObjectId, kind: str):
+        """
+        Returns the owner's most recent job of `kind`, or None. Lets a page
+        find its job again after a refresh.
+        """
+        doc = self.collection.find_one(
+            {"owner_id": ObjectId(owner_id), "kind": kind}, {"payload": 0}, sort=[("created_at", -1)]
+        )
+        return self._serialize_job(doc) if doc else None
+
+    def jobs_for_owner(self, owner_id: ObjectId, limit: int = 20) -> list:
+        cursor = self.collection.find({"owner_id": ObjectId(owner_id)}, {"payload": 0}).sort("created_at", -1).limit(limit)
+        return [self._serialize_job(doc) for doc in cursor]
+
+    def _serialize_job(self, doc: dict) -> dict:
+        return {
+            "_id": str(doc["_id"]),
+            "kind": doc["kind"],
+            "status": doc["status"],
+            "attempts": doc["attempts"],
+            "max_attempts": doc["max_attempts"],
+            "progress": doc.get("progress"),
+            "result": doc.get("result"),
+            "error": doc.get("error"),
+            "created_at": doc["created_at"],
+            "updated_at": doc["updated_at"]
+        }
+
+
+class JobWorker:
+    def __init__(self, queue: JobQueue, kinds: list = None, lease_seconds: int = JOB_LEASE_SECONDS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.kinds = kinds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            if not self.run_once():
+                self._stopped.wait(self.poll_interval)
+
+    def run_once(self, job_id: str = None) -> bool:
+        """
+        Claims and runs one job (a specific one if job_id is given).
+        Returns False if there was nothing to claim.
+        """
+        job = self.queue.claim(self.worker_id, kinds=self.kinds, lease_seconds=self.lease_seconds, job_id=job_id)
+        if job is None:
+            return False
+
+        # Renew the lease in the background while the handler runs
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job["_id"], done), daemon=True)
+        beat.start()
+
+        try:
+            result = JOB_HANDLERS[job["kind"]](self.queue.client, job["payload"], self._reporter(job["_id"]))
+        except Exception as e:
+            done.set()
+            self.queue.fail(job["_id"], self.worker_id, f"{type(e).__name__}: {e}")
+            traceback.print_exc()
+        else:
+            done.set()
+            self.queue.complete(job["_id"], self.worker_id, result)
+        beat.join()
+        return True
+
+    def _heartbeat(self, job_id, done: threading.Event):
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(job_id, self.worker_id, lease_seconds=self.lease_seconds):
+                # Lease lost: complete()/fail() will no longer match, so the
+                # other worker's outcome wins
+                return
+
+    def _reporter(self, job_id):
+        last = [0.0]
+
+        def report(step: str, done: int, total: int, **extra):
+            # extra: handler-specific fields stored with the progress (e.g. rate)
+            now = time.monotonic()
+            if now - last[0] >= JOB_PROGRESS_INTERVAL or (total and done >= total):
+                last[0] = now
+                self.queue.heartbeat(
+                    job_id, self.worker_id,
+                    lease_seconds=self.lease_seconds,
+                    progress={"step": step, "done": done, "total": total, **extra}
+                )
+        return report
+
+
+# ------------------
+# Handlers: handler(client, payload, report) -> JSON-like result, where
+# report(step, done, total, **extra) records progress
+# ------------------
+def _purge_account(client, payload: dict, report) -> dict:
+    return AccountPurge(client).purge(ObjectId(payload["owner_id"]), progress=report)
+
+
+def _migrate_binary_fields(client, payload: dict, report) -> dict:
+    return BinaryFieldsMigration(client).run(batch_size=payload.get("batch_size", MIGRATION_BATCH_SIZE), progress=report)
+
+
+def _rotate_master_key(client, payload: dict, report) -> dict:
+    # Imported here: the rotation reads the master keys from st.secrets, which
+    # the other job kinds do not need
+    from services.components.rotation import MasterKeyRotation, MASTER_KEY_BATCH_SIZE
+
+    return MasterKeyRotation(client).run(
+        batch_size=payload.get("batch_size", MASTER_KEY_BATCH_SIZE),
+        workers=payload.get("workers"),
+        max_per_second=payload.get("max_per_second"),
+        progress=lambda done, total, rate: report("users", done, total, rate=round(rate, 1))
+    )
+
+
+JOB_HANDLERS = {
+    "purge_account": _purge_account,
+    "migrate_binary_fields": _migrate_binary_fields,
+    "rotate_master_key": _rotate_master_key,
+}
+
+
+def _worker_main(uri: str, kinds: list):
+    # Each process builds its own client: MongoClient is not fork-safe
+    JobWorker(JobQueue(uri), kinds=kinds).run_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run CryptoLab background job workers")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"), help="MongoDB URI (default: $MONGO_URI)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--kind", action="append", dest="kinds", choices=sorted(JOB_HANDLERS), help="Only run these job kinds (repeatable)")
+    args = parser.parse_args()
+
+    if not args.uri:
+        sys.exit("Set MONGO_URI or pass --uri")
+
+    processes = [
+        multiprocessing.Process(target=_worker_main, args=(args.uri, args.kinds), name=f"job-worker-{i}")
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
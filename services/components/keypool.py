@@ -0,0 +1,70 @@
+import queue
+import threading
+
+# ------------------
+# Pre-generated keypair pool
+# ------------------
+# RSA-2048 key generation costs tens to hundreds of milliseconds of CPU. A
+# daemon thread keeps `size` keypairs ready and refills whenever the pool
+# drops to `low_water`, so registration only pays for a queue pop.
+
+
+class KeypairPool:
+    def __init__(self, factory, size: int = 8, low_water: int = 2):
+        """
+        factory: zero-argument callable returning one keypair (any object)
+        size: keypairs kept ready
+        low_water: refill as soon as the pool holds this many or fewer
+        """
+        self.factory = factory
+        self.size = size
+        self.low_water = low_water
+        self._pool = queue.Queue(maxsize=size)
+        self._refill = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="keypair-pool", daemon=True)
+                self._thread.start()
+                self._refill.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._refill.set()
+
+    def acquire(self):
+        """
+        Returns a ready keypair, or generates one inline if the pool is empty.
+        """
+        self.start()
+        try:
+            keypair = self._pool.get_nowait()
+        except queue.Empty:
+            keypair = self.factory()
+
+        if self._pool.qsize() <= self.low_water:
+            self._refill.set()
+        return keypair
+
+    def available(self) -> int:
+        return self._pool.qsize()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._refill.wait()
+            self._refill.clear()
+            while not self._stopped.is_set() and not self._pool.full():
+                try:
+                    keypair = self.factory()
+                except Exception:
+                    # acquire() falls back to inline generation and will ask again
+                    break
+                try:
+                    self._pool.put_nowait(keypair)
+                except queue.Full:
+                    break
@@ -0,0 +1,106 @@
+import os
+import sys
+import argparse
+from pprint import pprint
+from pymongo import UpdateOne
+from services.components.connection import get_client
+from services.components.encoding import to_binary
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_NOTES,
+    COLLECTION_VAULT,
+    SCHEMA_VERSION_BINARY
+)
+
+# ------------------
+# base64 -> BSON Binary migration
+# ------------------
+# Runs online: documents are read in _id order and each update only applies if
+# the document still holds the values that were read, so a concurrent edit
+# (which already writes Binary) is never overwritten. Safe to stop and re-run.
+BINARY_FIELDS = {
+    COLLECTION_NOTES: ("encrypted_content", "nonce"),
+    COLLECTION_VAULT: ("password_encrypted", "nonce"),
+}
+MIGRATION_BATCH_SIZE = 500
+
+
+class BinaryFieldsMigration:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.database = self.client[DATABASE_NAME]
+
+    def pending(self) -> dict:
+        """Documents still stored as base64, per collection."""
+        return {
+            name: self.database[name].count_documents({"schema_version": {"$exists": False}})
+            for name in BINARY_FIELDS
+        }
+
+    def run(self, batch_size: int = MIGRATION_BATCH_SIZE, progress=None) -> dict:
+        """
+        Rewrites every legacy document with one bulk_write per batch.
+
+        Args:
+            batch_size (int): Documents per round-trip.
+            progress: Optional callable(collection, done, total).
+
+        Returns:
+            dict: {collection: {"migrated", "skipped"}} where skipped counts
+                documents changed concurrently (already migrated by the write).
+        """
+        report = {}
+        for name, fields in BINARY_FIELDS.items():
+            report[name] = self._migrate_collection(name, fields, batch_size, progress)
+        return report
+
+    def _migrate_collection(self, name: str, fields: tuple, batch_size: int, progress) -> dict:
+        collection = self.database[name]
+        legacy = {"schema_version": {"$exists": False}}
+        total = collection.count_documents(legacy)
+        counts = {"migrated": 0, "skipped": 0}
+        last_id = None
+
+        while True:
+            query = dict(legacy)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = list(collection.find(query, {field: 1 for field in fields}).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            requests = []
+            for doc in batch:
+                stored = {field: doc[field] for field in fields if field in doc}
+                update = {field: to_binary(value) for field, value in stored.items()}
+                update["schema_version"] = SCHEMA_VERSION_BINARY
+                requests.append(UpdateOne({"_id": doc["_id"], **legacy, **stored}, {"$set": update}))
+
+            res = collection.bulk_write(requests, ordered=False)
+            counts["migrated"] += res.modified_count
+            counts["skipped"] += len(requests) - res.matched_count
+            if progress:
+                progress(name, counts["migrated"] + counts["skipped"], total)
+
+        return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate base64 ciphertext fields to BSON Binary")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"), help="MongoDB URI (default: $MONGO_URI)")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--status", action="store_true", help="Only count documents left to migrate")
+    args = parser.parse_args()
+
+    if not args.uri:
+        sys.exit("Set MONGO_URI or pass --uri")
+
+    migration = BinaryFieldsMigration(args.uri)
+    if args.status:
+        pprint(migration.pending())
+    else:
+        pprint(migration.run(
+            batch_size=args.batch_size,
+            progress=lambda name, done, total: print(f"{name}: {done}/{total}")
+        ))
@@ -1,19 +1,35 @@
 import os 
 import base64
-from pymongo import MongoClient
+from services.components.connection import get_client
+from services.components.compression import CODEC_ZLIB, pack_note, unpack_note
 import hashlib
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import binascii
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from services.components.encoding import to_binary, from_stored
+from services.components.envelope import new_data_key, current_data_key, object_key, check_current_kek
+from services.components import blind_index
 from services.constant.collection_pipeline import (
     DATABASE_NAME,
-	COLLECTION_NOTES
+	COLLECTION_NOTES,
+    COLLECTION_USERS,
+    COLLECTION_SHARES,
+    SCHEMA_VERSION_BINARY
 )
 from datetime import datetime
 
+# List views only need metadata; the ciphertext is fetched when a note is opened
+NOTE_LIST_PROJECTION = {"encrypted_content": 0, "search_tokens": 0}
+# Notes (de)crypted per round-trip when building the blind index
+SEARCH_INDEX_BATCH_SIZE = 200
+
 class NoteIngestion:
     def __init__(self, client):
-        self.client = MongoClient(client)
+        self.client = get_client(client)
         self.database = self.client[DATABASE_NAME]
         self.collection = self.database[COLLECTION_NOTES]
     
@@ -21,86 +37,360 @@ class NoteIngestion:
     # ------------------
     # AES-GCM helpers
     # ------------------
-    def encrypt_note_with_dek(self, dek: bytes, plaintext: str) -> dict:
+    def encrypt_note_with_dek(self, dek: bytes, plaintext: str, compression: int = CODEC_ZLIB, note: dict = None, search_key: bytes = None) -> dict:
         """
-        dek: raw bytes (32 bytes for AES-256)
+        dek: raw bytes (32 bytes for AES-256), wraps the note's own data key
         plaintext: string
-        returns dict: {ciphertext, nonce, sha256}
+        compression: codec applied before encryption when it saves space
+        note: the stored note when updating one; its data key is kept so
+        shares of the note stay valid
+        search_key: the user's blind-index key, to also return search_tokens
+        returns dict: {ciphertext, nonce, sha256, wrapped_key, kek_id,
+        search_tokens} with raw-bytes ciphertext and nonce
         """
-        if isinstance(dek, str):
-            # defensive: if someone passes base64 string accidentally
-            dek = base64.b64decode(dek)
+        if note is None:
+            data_key, wrapped = new_data_key(dek)
+        else:
+            data_key, wrapped = current_data_key(dek, note.get("wrapped_key"), note.get("kek_id"), note.get("legacy_key", False))
 
-        aesgcm = AESGCM(dek)
+        data = plaintext.encode('utf-8')
         nonce = os.urandom(12)  # 96-bit nonce for GCM
-        ciphertext = aesgcm.encrypt(nonce, plaintext.encode('utf-8'), associated_data=None)
+        ciphertext = AESGCM(data_key).encrypt(nonce, pack_note(data, compression), associated_data=None)
 
-        sha256_digest = hashlib.sha256(plaintext.encode('utf-8')).hexdigest()
+        sha256_digest = hashlib.sha256(data).hexdigest()
 
         return {
-            "ciphertext": base64.b64encode(ciphertext).decode('utf-8'),
-            "nonce": base64.b64encode(nonce).decode('utf-8'),
-            "sha256": sha256_digest
+            "ciphertext": ciphertext,
+            "nonce": nonce,
+            "sha256": sha256_digest,
+            "search_tokens": blind_index.search_tokens(search_key, plaintext) if search_key is not None else None,
+            **wrapped
         }
 
         
     # Make the notes decrpyted with a DEK
-    def decrypt_note_with_dek(self, dek: bytes, ciphertext_b64: str, nonce_b64: str) -> str:
+    def decrypt_note_with_dek(self, dek: bytes, ciphertext_b64: str, nonce_b64: str, wrapped_key=None, kek_id: str = None) -> str:
         """
         dek: raw bytes
-        ciphertext_b64, nonce_b64: base64 strings from DB
+        ciphertext_b64, nonce_b64: stored values, Binary or legacy base64 strings
+        wrapped_key, kek_id: the note's wrapped data key (None for notes
+        encrypted directly with the DEK)
         returns plaintext string (raises on auth failure)
         """
-        if isinstance(dek, str):
-            dek = base64.b64decode(dek)
-
-        aesgcm = AESGCM(dek)
-        nonce = base64.b64decode(nonce_b64)
-        ciphertext = base64.b64decode(ciphertext_b64)
+        aesgcm = AESGCM(object_key(dek, wrapped_key, kek_id))
+        nonce = from_stored(nonce_b64)
+        ciphertext = from_stored(ciphertext_b64)
         plaintext = aesgcm.decrypt(nonce, ciphertext, associated_data=None)
-        return plaintext.decode('utf-8')
+        return unpack_note(plaintext).decode('utf-8')
     
     # ------------------
     # CRUD
     # ------------------
-    def create_note(self, owner_id: ObjectId, encrypted_content: str, nonce: str, sha256: str):
+    def create_note(self, owner_id: ObjectId, encrypted_content: str, nonce: str, sha256: str, wrapped_key=None, kek_id: str = None, search_tokens: list = None):
+        doc = self._new_note_doc(owner_id, encrypted_content, nonce, sha256, wrapped_key, kek_id, search_tokens)
+        check_current_kek(self.database[COLLECTION_USERS], owner_id, kek_id)
+        res = self.collection.insert_one(doc)
+        return str(res.inserted_id)
+
+    def _new_note_doc(self, owner_id: ObjectId, encrypted_content: str, nonce: str, sha256: str, wrapped_key=None, kek_id: str = None, search_tokens: list = None) -> dict:
         doc = {
             "owner_id": ObjectId(owner_id),
-            "encrypted_content": encrypted_content,
-            "nonce": nonce,
+            "encrypted_content": to_binary(encrypted_content),
+            "nonce": to_binary(nonce),
             "sha256": sha256,
+            **self._key_fields(wrapped_key, kek_id),
+            "schema_version": SCHEMA_VERSION_BINARY,
             "created_at": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p')
         }
-        res = self.collection.insert_one(doc)
-        return str(res.inserted_id)
+        # Notes without tokens are left for index_notes
+        if search_tokens is not None:
+            doc["search_tokens"] = search_tokens
+        return doc
+
+    def _key_fields(self, wrapped_key, kek_id: str) -> dict:
+        # Documents without a wrapped key are encrypted with the DEK directly
+        if wrapped_key is None:
+            return {}
+        return {"wrapped_key": to_binary(wrapped_key), "kek_id": kek_id}
+
+    def create_notes_bulk(self, owner_id: ObjectId, dek: bytes, plaintexts, batch_size: int = 500, ordered: bool = False, max_workers: int = None, search_key: bytes = None) -> dict:
+        """
+        Encrypts and inserts many notes at once (e.g. an import).
+
+        Plaintexts are consumed lazily in batches of `batch_size`. Each batch is
+        encrypted in a thread pool (AES-GCM releases the GIL), each note under
+        its own wrapped data key, and written with one insert_many. Per-note
+        keys mean one AESGCM context and one key wrap per note instead of a
+        single context reused for the whole import; both are microseconds
+        next to the insert.
+
+        Args:
+            owner_id (ObjectId): The owner of the notes.
+            dek (bytes): The user's DEK.
+            plaintexts (iterable[str]): The note texts.
+            batch_size (int): Notes per insert_many.
+            ordered (bool): Stop at the first failed insert, like insert_many(ordered=True).
+            max_workers (int): Encryption threads (None = executor default).
+            search_key (bytes): The user's blind-index key (None = not indexed).
+
+        Returns:
+            dict: {"inserted_ids": [str, ...], "errors": [{"index": int, "error": str}, ...]}
+                where index is the position in `plaintexts`. Notes that fail to
+                encrypt are reported and skipped even when ordered=True.
+        """
+        inserted_ids = []
+        errors = []
+        plaintexts = iter(plaintexts)
+        offset = 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                batch = list(islice(plaintexts, batch_size))
+                if not batch:
+                    break
+
+                docs, positions = self._encrypt_note_batch(executor, owner_id, dek, batch, offset, errors, search_key)
+                if docs:
+                    check_current_kek(self.database[COLLECTION_USERS], owner_id, docs[0].get("kek_id"))
+                try:
+                    if docs:
+                        self.collection.insert_many(docs, ordered=ordered)
+                    stop = self._record_insert_batch(docs, positions, ordered, inserted_ids, errors)
+                except BulkWriteError as bwe:
+                    stop = self._record_insert_batch(docs, positions, ordered, inserted_ids, errors, bwe)
+
+                offset += len(batch)
+                if stop:
+                    self._record_not_attempted(plaintexts, offset, errors)
+                    break
+
+        errors.sort(key=lambda e: e["index"])
+        return {
+            "inserted_ids": inserted_ids,
+            "errors": errors
+        }
+
+    def _encrypt_note_batch(self, executor, owner_id: ObjectId, dek: bytes, batch: list, offset: int, errors: list, search_key: bytes = None):
+        """
+        Encrypts one batch in `executor`.
+        Returns the note documents and their positions in the whole import.
+        """
+        if isinstance(dek, str):
+            dek = base64.b64decode(dek)
+
+        def encrypt(plaintext):
+            try:
+                return self.encrypt_note_with_dek(dek, plaintext, search_key=search_key)
+            except Exception as e:
+                return e
+
+        docs = []
+        positions = []
+        for i, enc in enumerate(executor.map(encrypt, batch)):
+            if isinstance(enc, Exception):
+                errors.append({"index": offset + i, "error": str(enc)})
+                continue
+            docs.append(self._new_note_doc(owner_id, enc["ciphertext"], enc["nonce"], enc["sha256"], enc["wrapped_key"], enc["kek_id"], enc["search_tokens"]))
+            positions.append(offset + i)
+        return docs, positions
+
+    def _record_insert_batch(self, docs: list, positions: list, ordered: bool, inserted_ids: list, errors: list, bwe: BulkWriteError = None) -> bool:
+        """
+        Records the ids and per-document errors of one insert_many.
+        Returns True if an ordered insert failed part-way.
+        """
+        if bwe is None:
+            inserted_ids.extend(str(doc["_id"]) for doc in docs)
+            return False
+
+        failed = {err["index"]: err.get("errmsg", "Write error") for err in bwe.details.get("writeErrors", [])}
+        # With ordered=True nothing after the first failure was written
+        cutoff = min(failed) if ordered and failed else len(docs)
+        for i, doc in enumerate(docs):
+            if i in failed:
+                errors.append({"index": positions[i], "error": failed[i]})
+            elif i < cutoff:
+                inserted_ids.append(str(doc["_id"]))
+            else:
+                errors.append({"index": positions[i], "error": "Not attempted: an earlier insert failed"})
+        return ordered and bool(failed)
+
+    def _record_not_attempted(self, plaintexts, offset: int, errors: list):
+        # Ordered imports stop at the first failure, like insert_many does
+        for i, _ in enumerate(plaintexts, start=offset):
+            errors.append({"index": i, "error": "Not attempted: an earlier insert failed"})
 
     def fetch_notes(self, owner_id: ObjectId):
         cursor = self.collection.find({"owner_id": ObjectId(owner_id)})
         notes = []
         for doc in cursor:
-            notes.append({
-                "_id": str(doc["_id"]),
-                "owner_id": str(doc["owner_id"]),
-                "encrypted_content": doc["encrypted_content"],
-                "nonce": doc["nonce"],
-                "sha256": doc.get("sha256"),
-                "created_at": doc.get("created_at"),
-                "updated_at": doc.get("updated_at")
-            })
+            notes.append(self._serialize_note(doc))
         return notes
 
-    def update_note(self, note_id: str, encrypted_content: str, nonce: str, sha256: str):
+    def fetch_notes_page(self, owner_id: ObjectId, page_size: int = 20, cursor: str = None, include_content: bool = False) -> dict:
+        """
+        Keyset-paginated note listing, newest first.
+
+        Pages are walked by `_id` (an ObjectId grows with creation time), so
+        every page is one bounded index scan no matter how deep it is.
+
+        Args:
+            owner_id (ObjectId): The owner of the notes.
+            page_size (int): Notes per page.
+            cursor (str): Opaque cursor from the previous page (None = first page).
+            include_content (bool): Also return the ciphertext. List views
+                should leave this off and call fetch_note when a note is opened.
+
+        Returns:
+            dict: {"notes": [...], "next_cursor": str or None}
+        """
+        query = {"owner_id": ObjectId(owner_id)}
+        if cursor:
+            query["_id"] = {"$lt": self._decode_cursor(cursor)}
+
+        projection = None if include_content else NOTE_LIST_PROJECTION
+        docs = list(self.collection.find(query, projection).sort("_id", -1).limit(page_size + 1))
+
+        next_cursor = None
+        if len(docs) > page_size:
+            docs = docs[:page_size]
+            next_cursor = self._encode_cursor(docs[-1]["_id"])
+
+        return {
+            "notes": [self._serialize_note(doc) for doc in docs],
+            "next_cursor": next_cursor
+        }
+
+    def fetch_note(self, note_id: str, owner_id: ObjectId):
+        """
+        Fetches a single note, ciphertext included. Returns None if it does
+        not exist or belongs to someone else.
+        """
+        doc = self.collection.find_one({"_id": ObjectId(note_id), "owner_id": ObjectId(owner_id)})
+        return self._serialize_note(doc) if doc else None
+
+    # ------------------
+    # Blind-index search
+    # ------------------
+    def search_notes(self, owner_id: ObjectId, search_key: bytes, query: str, limit: int = 50) -> list:
+        """
+        Returns the notes (metadata only) containing every word of `query`,
+        newest first, with one query on the (owner_id, search_tokens) index.
+        Only indexed notes are found; see index_notes.
+        """
+        tokens = blind_index.query_tokens(search_key, query)
+        if not tokens:
+            return []
+        cursor = self.collection.find(
+            {"owner_id": ObjectId(owner_id), "search_tokens": {"$all": tokens}}, NOTE_LIST_PROJECTION
+        ).sort("_id", -1).limit(limit)
+        return [self._serialize_note(doc) for doc in cursor]
+
+    def count_unindexed(self, owner_id: ObjectId) -> int:
+        return self.collection.count_documents({"owner_id": ObjectId(owner_id), "search_tokens": {"$exists": False}})
+
+    def index_notes(self, owner_id: ObjectId, dek: bytes, search_key: bytes, batch_size: int = SEARCH_INDEX_BATCH_SIZE, progress=None) -> int:
+        """
+        Adds search tokens to the owner's notes that have none (created before
+        search was enabled, or edited without it). Needs the DEK, so it runs
+        in the user's session. Returns the number of notes indexed.
+
+        Args:
+            progress: Optional callable(done, total).
+        """
+        owner_id = ObjectId(owner_id)
+        unindexed = {"owner_id": owner_id, "search_tokens": {"$exists": False}}
+        total = self.collection.count_documents(unindexed)
+        indexed = 0
+        done = 0
+        last_id = None
+
+        while True:
+            query = dict(unindexed)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = list(self.collection.find(query).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            requests = []
+            for doc in batch:
+                plaintext = self.decrypt_note_with_dek(dek, doc["encrypted_content"], doc["nonce"], doc.get("wrapped_key"), doc.get("kek_id"))
+                # Skipped if the note was edited in the meantime
+                requests.append(UpdateOne(
+                    {"_id": doc["_id"], "nonce": doc["nonce"], "search_tokens": {"$exists": False}},
+                    {"$set": {"search_tokens": blind_index.search_tokens(search_key, plaintext)}}
+                ))
+            res = self.collection.bulk_write(requests, ordered=False)
+            indexed += res.modified_count
+            done += len(batch)
+            if progress:
+                progress(done, total)
+
+        return indexed
+
+    def _encode_cursor(self, note_id: ObjectId) -> str:
+        return base64.urlsafe_b64encode(ObjectId(note_id).binary).decode('utf-8')
+
+    def _decode_cursor(self, cursor: str) -> ObjectId:
+        try:
+            return ObjectId(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        except (binascii.Error, TypeError, ValueError):
+            raise Exception("Invalid page cursor")
+
+    def _serialize_note(self, doc: dict) -> dict:
+        return {
+            "_id": str(doc["_id"]),
+            "owner_id": str(doc["owner_id"]),
+            "encrypted_content": doc.get("encrypted_content"),
+            "nonce": doc["nonce"],
+            "sha256": doc.get("sha256"),
+            "wrapped_key": doc.get("wrapped_key"),
+            "kek_id": doc.get("kek_id"),
+            "legacy_key": doc.get("legacy_key", False),
+            "created_at": doc.get("created_at"),
+            "updated_at": doc.get("updated_at")
+        }
+
+    def update_note(self, note_id: str, encrypted_content: str, nonce: str, sha256: str, wrapped_key=None, kek_id: str = None, search_tokens: list = None, owner_id: ObjectId = None):
+        doc = self._updated_note_doc(encrypted_content, nonce, sha256, wrapped_key, kek_id, search_tokens)
+        query = {"_id": ObjectId(note_id)}
+        if owner_id is not None:
+            query["owner_id"] = ObjectId(owner_id)
+        elif kek_id is not None:
+            owner_id = (self.collection.find_one(query, {"owner_id": 1}) or {}).get("owner_id")
+        if owner_id is not None:
+            check_current_kek(self.database[COLLECTION_USERS], owner_id, kek_id)
+        res = self.collection.update_one(query, {"$set": doc, "$unset": self._updated_note_unset(search_tokens)})
+        return res
+
+    def _updated_note_unset(self, search_tokens: list = None) -> dict:
+        # The new ciphertext is never under a legacy (shared) key, and tokens
+        # of the old text must not keep matching
+        unset = {"legacy_key": ""}
+        if search_tokens is None:
+            unset["search_tokens"] = ""
+        return unset
+
+    def _updated_note_doc(self, encrypted_content: str, nonce: str, sha256: str, wrapped_key=None, kek_id: str = None, search_tokens: list = None) -> dict:
         doc = {
-            "encrypted_content": encrypted_content,
-            "nonce": nonce,
+            "encrypted_content": to_binary(encrypted_content),
+            "nonce": to_binary(nonce),
             "sha256": sha256,
+            "wrapped_key": to_binary(wrapped_key) if wrapped_key is not None else None,
+            "kek_id": kek_id,
+            "schema_version": SCHEMA_VERSION_BINARY,
             "updated_at": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p')
         }
-        res = self.collection.update_one({"_id": ObjectId(note_id)}, {"$set": doc})
-        return res
+        if search_tokens is not None:
+            doc["search_tokens"] = search_tokens
+        return doc
     
     def delete_note(self, note_id: str):
         res = self.collection.delete_one({"_id": ObjectId(note_id)})
+        # Drop the shares of the note with it
+        self.database[COLLECTION_SHARES].delete_many({"object_id": ObjectId(note_id)})
         return res.deleted_count
     
     
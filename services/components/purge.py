@@ -0,0 +1,114 @@
+from bson import ObjectId
+from services.components.connection import get_client
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_USERS,
+    COLLECTION_NOTES,
+    COLLECTION_VAULT,
+    COLLECTION_FILES,
+    COLLECTION_CHUNKS,
+    COLLECTION_SHARES
+)
+
+# ------------------
+# Account purge
+# ------------------
+# Deletes everything a user owns in a bounded number of round-trips: GridFS
+# files and chunks go in batches of file ids with `files_id $in [...]`, the
+# rest with one delete_many per collection. The user document is removed last,
+# so a failed purge can simply be run again.
+#
+# With transactions, each batch of files is deleted in its own transaction
+# and the notes, vault, shares and user documents in a final one: a single
+# transaction over every chunk of a large account would exceed the
+# transaction size and time limits.
+PURGE_BATCH_SIZE = 1000
+
+
+class AccountPurge:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.database = self.client[DATABASE_NAME]
+
+    def supports_transactions(self) -> bool:
+        """
+        Multi-document transactions need a replica set or a sharded cluster.
+        """
+        hello = self.client.admin.command("hello")
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    def purge(self, owner_id: ObjectId, progress=None, batch_size: int = PURGE_BATCH_SIZE, use_transaction: bool = None) -> dict:
+        """
+        Removes a user's files, notes, vault entries, shares and the user itself.
+
+        Args:
+            owner_id (ObjectId): The user to delete.
+            progress: Optional callable(step, done, total) called as work completes,
+                where step is "files", "notes", "vault", "shares" or "user".
+            batch_size (int): File ids per GridFS delete.
+            use_transaction (bool): None detects support from the deployment.
+
+        Returns:
+            dict: Deleted counts per collection and whether a transaction was used.
+        """
+        owner_id = ObjectId(owner_id)
+        if use_transaction is None:
+            use_transaction = self.supports_transactions()
+
+        if not use_transaction:
+            report = self._purge(owner_id, progress, batch_size, session=None)
+        else:
+            with self.client.start_session() as session:
+                report = self._purge(owner_id, progress, batch_size, session=session)
+
+        report["transaction"] = use_transaction
+        return report
+
+    def _atomically(self, session, callback):
+        # with_transaction retries the callback on transient errors, so it
+        # must not have side effects outside the session
+        if session is None:
+            return callback(None)
+        return session.with_transaction(callback)
+
+    def _purge(self, owner_id: ObjectId, progress, batch_size: int, session) -> dict:
+        report = {"files": 0, "chunks": 0, "notes": 0, "vault": 0, "shares": 0, "user": 0}
+        notify = progress or (lambda step, done, total: None)
+
+        file_ids = [doc["_id"] for doc in self.database[COLLECTION_FILES].find(
+            {"metadata.owner_id": owner_id}, {"_id": 1}, session=session
+        )]
+        notify("files", 0, len(file_ids))
+        for i in range(0, len(file_ids), batch_size):
+            batch = file_ids[i:i + batch_size]
+            chunks, files = self._atomically(session, lambda s: self._delete_files(batch, s))
+            report["chunks"] += chunks
+            report["files"] += files
+            notify("files", i + len(batch), len(file_ids))
+
+        counts = self._atomically(session, lambda s: self._delete_documents(owner_id, s))
+        report.update(counts)
+        for step in ("notes", "vault", "shares"):
+            notify(step, counts[step], counts[step])
+        notify("user", counts["user"], 1)
+        return report
+
+    def _delete_files(self, file_ids: list, session) -> tuple:
+        # Chunks first: a file document without chunks is still listed (and
+        # purged again on retry), orphaned chunks would not be
+        chunks = self.database[COLLECTION_CHUNKS].delete_many({"files_id": {"$in": file_ids}}, session=session)
+        files = self.database[COLLECTION_FILES].delete_many({"_id": {"$in": file_ids}}, session=session)
+        return chunks.deleted_count, files.deleted_count
+
+    def _delete_documents(self, owner_id: ObjectId, session) -> dict:
+        counts = {}
+        for step, collection_name in (("notes", COLLECTION_NOTES), ("vault", COLLECTION_VAULT)):
+            counts[step] = self.database[collection_name].delete_many({"owner_id": owner_id}, session=session).deleted_count
+
+        # Shares of the user's objects and shares addressed to the user
+        counts["shares"] = self.database[COLLECTION_SHARES].delete_many(
+            {"$or": [{"owner_id": owner_id}, {"recipient_id": owner_id}]}, session=session
+        ).deleted_count
+
+        counts["user"] = self.database[COLLECTION_USERS].delete_one({"_id": owner_id}, session=session).deleted_count
+        return counts
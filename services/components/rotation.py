@@ -0,0 +1,312 @@
+import os
+import sys
+import time
+import base64
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pprint import pprint
+from bson import ObjectId
+from pymongo import UpdateOne
+from services.components.connection import get_client
+from services.components.users import (
+    UserIngestion,
+    invalidate_cached_dek,
+    reencrypt_private_key,
+    master_key,
+    previous_master_key,
+    MASTER_KEY_VERSION
+)
+from services.components.envelope import kek_id, object_key, wrap_data_key, DATA_KEY_SIZE
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_USERS,
+    COLLECTION_NOTES,
+    COLLECTION_VAULT,
+    COLLECTION_FILES
+)
+
+# ------------------
+# KEK rotation
+# ------------------
+# Rotating a user's KEK only rewraps the per-object data keys (see
+# services.components.envelope): ciphertexts are never read, so the cost is a
+# few hundred bytes per object whatever the size of the files.
+#
+# The new KEK is first stored RSA-wrapped as `pending_user_dek`, so an
+# interrupted rotation resumes with the same key. Objects are then rewrapped in
+# _id-ordered batches, each with one bulk_write of conditional updates, and
+# finally `pending_user_dek` replaces `encrypted_user_dek` and the user's
+# `kek_id` moves to the new KEK.
+#
+# Writes check that `kek_id` (see envelope.check_current_kek): while
+# `pending_user_dek` is set and after the swap, sessions still holding the old
+# KEK can read but not write, and have to log in again. A write that passed
+# the check just before the rotation started is caught by the pass that runs
+# after the swap.
+ROTATION_BATCH_SIZE = 500
+
+# collection -> (owner filter field, prefix of the key fields)
+ROTATION_TARGETS = {
+    COLLECTION_NOTES: ("owner_id", ""),
+    COLLECTION_VAULT: ("owner_id", ""),
+    # Dedup aliases hold no ciphertext, only their blob is rewrapped
+    COLLECTION_FILES: ("metadata.owner_id", "metadata."),
+}
+
+
+class KeyRotation:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.users = self.database[COLLECTION_USERS]
+        self.user_ingestion = UserIngestion(self.client)
+
+    def rotate(self, user_id, progress=None, batch_size: int = ROTATION_BATCH_SIZE) -> dict:
+        """
+        Replaces a user's KEK and rewraps every object key under it.
+
+        Args:
+            user_id: The user whose KEK is rotated.
+            progress: Optional callable(collection, done, total).
+            batch_size (int): Objects per round-trip.
+
+        Returns:
+            dict: {"dek": new raw KEK, "kek_id", "rewrapped": {collection: count}}
+        """
+        user_id = ObjectId(user_id)
+        doc = self.users.find_one({"_id": user_id})
+        if doc is None:
+            raise Exception("User not found")
+
+        old_kek = self.user_ingestion.unwrap_user_dek(doc)
+        if doc.get("kek_id") is None:
+            # Users created before the field: record the KEK writes must use
+            self.users.update_one({"_id": user_id, "kek_id": None}, {"$set": {"kek_id": kek_id(old_kek)}})
+        new_kek, pending = self._pending_kek(doc)
+        new_id = kek_id(new_kek)
+
+        rewrapped = {}
+        for name, (owner_field, prefix) in ROTATION_TARGETS.items():
+            rewrapped[name] = self._rewrap_collection(name, owner_field, prefix, user_id, old_kek, new_kek, new_id, batch_size, progress)
+
+        res = self.users.update_one(
+            {"_id": user_id, "pending_user_dek": pending},
+            {"$set": {"encrypted_user_dek": pending, "kek_id": new_id}, "$unset": {"pending_user_dek": ""}}
+        )
+        if res.matched_count != 1:
+            raise Exception("Key rotation was finished by another session, log in again")
+        invalidate_cached_dek(user_id)
+
+        # Stale writes are rejected from here on; pick up any that landed
+        # between their check and the swap
+        for name, (owner_field, prefix) in ROTATION_TARGETS.items():
+            rewrapped[name] += self._rewrap_collection(name, owner_field, prefix, user_id, old_kek, new_kek, new_id, batch_size, progress)
+
+        return {"dek": new_kek, "kek_id": new_id, "rewrapped": rewrapped}
+
+    def _pending_kek(self, doc: dict) -> tuple:
+        """
+        Returns (new KEK, its RSA-wrapped form), reusing the pending KEK of an
+        interrupted rotation.
+        """
+        if doc.get("pending_user_dek") is None:
+            wrapped = self.user_ingestion.encrypt_with_public(
+                self.user_ingestion.load_public_key(doc), base64.urlsafe_b64encode(os.urandom(DATA_KEY_SIZE)).decode()
+            )
+            # Only one rotation may pick the new key
+            self.users.update_one(
+                {"_id": doc["_id"], "pending_user_dek": {"$exists": False}},
+                {"$set": {"pending_user_dek": wrapped}}
+            )
+            doc = self.users.find_one({"_id": doc["_id"]})
+
+        private_key = self.user_ingestion.load_private_key(doc)
+        kek = base64.urlsafe_b64decode(self.user_ingestion.decrypt_with_private(private_key, doc["pending_user_dek"]).encode('utf-8'))
+        return kek, doc["pending_user_dek"]
+
+    def _rewrap_collection(self, name: str, owner_field: str, prefix: str, user_id: ObjectId, old_kek: bytes, new_kek: bytes, new_id: str, batch_size: int, progress) -> int:
+        collection = self.database[name]
+        stale = {owner_field: user_id, f"{prefix}kek_id": {"$ne": new_id}}
+        if name == COLLECTION_FILES:
+            stale["metadata.blob_id"] = {"$exists": False}
+        projection = {f"{prefix}wrapped_key": 1, f"{prefix}kek_id": 1}
+
+        rewrapped = 0
+        # Documents written concurrently with the old KEK are picked up by
+        # another pass
+        while True:
+            total = collection.count_documents(stale)
+            if not total:
+                return rewrapped
+
+            done = 0
+            modified = 0
+            last_id = None
+            while True:
+                query = dict(stale)
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                batch = list(collection.find(query, projection).sort("_id", 1).limit(batch_size))
+                if not batch:
+                    break
+                last_id = batch[-1]["_id"]
+
+                requests = []
+                for doc in batch:
+                    fields = doc.get("metadata", {}) if prefix else doc
+                    wrapped_key, wrapped_kek_id = fields.get("wrapped_key"), fields.get("kek_id")
+                    # Objects from before envelopes are encrypted with the old KEK itself
+                    data_key = object_key(old_kek, wrapped_key, wrapped_kek_id)
+                    update = {f"{prefix}{field}": value for field, value in wrap_data_key(new_kek, data_key).items()}
+                    if wrapped_key is None:
+                        update[f"{prefix}legacy_key"] = True
+                    requests.append(UpdateOne(
+                        {"_id": doc["_id"], f"{prefix}wrapped_key": wrapped_key, f"{prefix}kek_id": wrapped_kek_id},
+                        {"$set": update}
+                    ))
+
+                res = collection.bulk_write(requests, ordered=False)
+                modified += res.modified_count
+                done += len(requests)
+                if progress:
+                    progress(name, done, total)
+
+            if not modified:
+                raise Exception(f"Could not rewrap {total} object keys in {name}")
+            rewrapped += modified
+
+
+# ------------------
+# Master key rotation
+# ------------------
+# Private key PEMs are encrypted with the master key (st.secrets["MASTER_KEY"])
+# and record its `master_key_version`. To rotate, deploy the new key with
+# MASTER_KEY_VERSION increased and the old one as PREVIOUS_MASTER_KEY: logins
+# then open each PEM with the key of its version, while this rotation
+# re-encrypts them in a process pool (PKCS8 key derivation is CPU-bound).
+# Updates are conditional on the PEM that was read and the version field makes
+# the run resumable: migrated users are simply no longer selected.
+MASTER_KEY_BATCH_SIZE = 200
+
+
+class MasterKeyRotation:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.users = self.client[DATABASE_NAME][COLLECTION_USERS]
+
+    def _stale(self, new_version: int) -> dict:
+        # Users created before versioning have no field (version 1)
+        return {"master_key_version": {"$ne": new_version}}
+
+    def pending(self, new_version: int = MASTER_KEY_VERSION) -> int:
+        """Users whose private key is not encrypted with `new_version` yet."""
+        return self.users.count_documents(self._stale(new_version))
+
+    def run(self, old_key: str = previous_master_key, new_key: str = master_key, new_version: int = MASTER_KEY_VERSION,
+            batch_size: int = MASTER_KEY_BATCH_SIZE, workers: int = None, max_per_second: float = None, progress=None) -> dict:
+        """
+        Re-encrypts every private key still under `old_key` with `new_key`.
+
+        Args:
+            old_key, new_key (str): Master keys (default: the configured previous and current ones).
+            new_version (int): Version recorded with `new_key`.
+            batch_size (int): Users per bulk_write.
+            workers (int): Processes re-encrypting PEMs (None = CPU count).
+            max_per_second (float): Throttle on users per second (None = unthrottled).
+            progress: Optional callable(done, total, users_per_second).
+
+        Returns:
+            dict: {"migrated", "skipped", "failed", "seconds"}; skipped users changed
+                concurrently, failed ones could not be opened with `old_key`.
+        """
+        if not old_key:
+            raise Exception("Set PREVIOUS_MASTER_KEY to the master key being replaced")
+
+        stale = self._stale(new_version)
+        total = self.users.count_documents(stale)
+        counts = {"migrated": 0, "skipped": 0, "failed": []}
+        started = time.monotonic()
+        last_id = None
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                query = dict(stale)
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                batch = list(self.users.find(query, {"private_key_pem_encrypted": 1}).sort("_id", 1).limit(batch_size))
+                if not batch:
+                    break
+                last_id = batch[-1]["_id"]
+
+                pems = [doc["private_key_pem_encrypted"] for doc in batch]
+                results = pool.map(_reencrypt_or_none, pems, [old_key] * len(pems), [new_key] * len(pems))
+
+                requests = []
+                for doc, pem in zip(batch, results):
+                    if pem is None:
+                        counts["failed"].append(str(doc["_id"]))
+                        continue
+                    requests.append(UpdateOne(
+                        {"_id": doc["_id"], "private_key_pem_encrypted": doc["private_key_pem_encrypted"]},
+                        {"$set": {"private_key_pem_encrypted": pem, "master_key_version": new_version}}
+                    ))
+                if requests:
+                    res = self.users.bulk_write(requests, ordered=False)
+                    counts["migrated"] += res.modified_count
+                    counts["skipped"] += len(requests) - res.matched_count
+
+                done = counts["migrated"] + counts["skipped"] + len(counts["failed"])
+                elapsed = time.monotonic() - started
+                if progress:
+                    progress(done, total, done / elapsed if elapsed else 0.0)
+                if max_per_second:
+                    # Sleep off any lead over the allowed rate
+                    time.sleep(max(done / max_per_second - elapsed, 0))
+
+        counts["seconds"] = round(time.monotonic() - started, 3)
+        return counts
+
+
+def _reencrypt_or_none(private_pem: str, old_key: str, new_key: str):
+    try:
+        return reencrypt_private_key(private_pem, old_key, new_key)
+    except (ValueError, TypeError):
+        # Wrong password: encrypted with neither key we know
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate a user's key-encryption key or the master key")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"), help="MongoDB URI (default: $MONGO_URI)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    user = commands.add_parser("user", help="Rotate one user's KEK")
+    user.add_argument("user_id", help="_id of the user")
+    user.add_argument("--batch-size", type=int, default=ROTATION_BATCH_SIZE)
+
+    master = commands.add_parser("master-key", help="Re-encrypt private keys under the current MASTER_KEY")
+    master.add_argument("--batch-size", type=int, default=MASTER_KEY_BATCH_SIZE)
+    master.add_argument("--workers", type=int, default=None, help="Processes (default: CPU count)")
+    master.add_argument("--max-per-second", type=float, default=None, help="Throttle, users per second")
+    master.add_argument("--status", action="store_true", help="Only count users left to migrate")
+    args = parser.parse_args()
+
+    if not args.uri:
+        sys.exit("Set MONGO_URI or pass --uri")
+
+    if args.command == "user":
+        result = KeyRotation(args.uri).rotate(
+            args.user_id,
+            batch_size=args.batch_size,
+            progress=lambda name, done, total: print(f"{name}: {done}/{total}")
+        )
+        pprint({"kek_id": result["kek_id"], "rewrapped": result["rewrapped"]})
+    elif args.status:
+        print(MasterKeyRotation(args.uri).pending())
+    else:
+        pprint(MasterKeyRotation(args.uri).run(
+            batch_size=args.batch_size,
+            workers=args.workers,
+            max_per_second=args.max_per_second,
+            progress=lambda done, total, rate: print(f"users: {done}/{total} ({rate:.1f}/s)")
+        ))
@@ -0,0 +1,253 @@
+import base64
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from services.components.connection import get_client
+from services.components.users import UserIngestion
+from services.components.notes import NoteIngestion
+from services.components.envelope import object_key
+from services.constant.collection_pipeline import (
+    DATABASE_NAME,
+    COLLECTION_USERS,
+    COLLECTION_NOTES,
+    COLLECTION_FILES,
+    COLLECTION_SHARES
+)
+
+# ------------------
+# Sharing
+# ------------------
+# A share hands one object's data key to another user: the key is encrypted
+# with the recipient's RSA public key (like their own DEK) and stored in the
+# Shares collection. The ciphertext is never copied, so sharing a file of any
+# size costs one RSA-OAEP wrap.
+#
+# Objects from before per-object keys (no wrapped_key, or legacy_key after a
+# KEK rotation) are encrypted with a key shared by other objects of the owner.
+# Notes are re-encrypted under a fresh key before being shared; such files
+# have to be uploaded again.
+#
+# Revoking a note share re-encrypts the note under a new data key and rewraps
+# it for the remaining recipients, so a key the former recipient kept opens
+# neither later edits nor the current ciphertext. Files are not re-encrypted
+# on revoke (that would mean rewriting the whole file): a former recipient who
+# kept the key and later obtains the ciphertext from the database can still
+# read that version of the file.
+SHARE_NOTE = "note"
+SHARE_FILE = "file"
+
+# Listings only need what the "shared with me" index query returns
+SHARE_LIST_PROJECTION = {"encrypted_key": 0}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ShareIngestion:
+    def __init__(self, client):
+        self.client = get_client(client)
+        self.database = self.client[DATABASE_NAME]
+        self.collection = self.database[COLLECTION_SHARES]
+        self.users = UserIngestion(self.client)
+        self.notes = NoteIngestion(self.client)
+
+    def share_note(self, owner_id: ObjectId, dek: bytes, note_id, recipient_username: str) -> str:
+        """
+        Shares a note with another user. Returns the share id.
+        """
+        # The raw document: fetch_note leaves out the search tokens
+        note = self.database[COLLECTION_NOTES].find_one({"_id": ObjectId(note_id), "owner_id": ObjectId(owner_id)})
+        if note is None:
+            raise Exception("Note not found")
+
+        if note.get("wrapped_key") is None or note.get("legacy_key"):
+            # Give the note a key of its own first
+            plaintext = self.notes.decrypt_note_with_dek(dek, note["encrypted_content"], note["nonce"], note.get("wrapped_key"), note.get("kek_id"))
+            enc = self.notes.encrypt_note_with_dek(dek, plaintext)
+            # Same text, so the blind-index tokens stay valid
+            self.notes.update_note(note_id, enc["ciphertext"], enc["nonce"], enc["sha256"], enc["wrapped_key"], enc["kek_id"], note.get("search_tokens"), owner_id=owner_id)
+            note.update(enc)
+
+        data_key = object_key(dek, note["wrapped_key"], note["kek_id"])
+        return self._share(owner_id, recipient_username, SHARE_NOTE, ObjectId(note_id), data_key)
+
+    def share_file(self, owner_id: ObjectId, dek: bytes, file_id, recipient_username: str) -> str:
+        """
+        Shares a file with another user. Returns the share id.
+        """
+        files = self.database[COLLECTION_FILES]
+        entry = files.find_one({"_id": ObjectId(file_id), "metadata.owner_id": ObjectId(owner_id)})
+        if entry is None:
+            raise Exception("File not found")
+
+        metadata = entry["metadata"]
+        if metadata.get("blob_id") is not None:
+            # Deduplicated entry: the key is stored with the blob
+            metadata = files.find_one({"_id": metadata["blob_id"]})["metadata"]
+        if metadata.get("wrapped_key") is None or metadata.get("legacy_key"):
+            raise Exception("This file was uploaded before per-file keys, upload it again to share it")
+
+        data_key = object_key(dek, metadata["wrapped_key"], metadata.get("kek_id"))
+        return self._share(
+            owner_id, recipient_username, SHARE_FILE, entry["_id"], data_key,
+            label=entry["metadata"].get("original_filename"),
+            content_type=entry["metadata"].get("content_type")
+        )
+
+    def _share(self, owner_id: ObjectId, recipient_username: str, kind: str, object_id: ObjectId, data_key: bytes, label: str = None, content_type: str = None) -> str:
+        owner_id = ObjectId(owner_id)
+        recipient = self.database[COLLECTION_USERS].find_one(
+            {"username": recipient_username}, {"public_key_pem": 1}
+        )
+        if recipient is None:
+            raise Exception("User not found")
+        if recipient["_id"] == owner_id:
+            raise Exception("You cannot share with yourself")
+        owner = self.database[COLLECTION_USERS].find_one({"_id": owner_id}, {"username": 1})
+
+        encrypted_key = self._encrypt_key(recipient, data_key)
+        # Sharing again with the same user just refreshes the share
+        doc = self.collection.find_one_and_update(
+            {"object_id": object_id, "recipient_id": recipient["_id"]},
+            {
+                "$set": {
+                    "kind": kind,
+                    "owner_id": owner_id,
+                    "owner_username": owner["username"],
+                    "encrypted_key": encrypted_key,
+                    "label": label,
+                    "content_type": content_type
+                },
+                "$setOnInsert": {"created_at": _now()}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return str(doc["_id"])
+
+    def _encrypt_key(self, recipient: dict, data_key: bytes) -> str:
+        return self.users.encrypt_with_public(
+            self.users.load_public_key(recipient),
+            base64.urlsafe_b64encode(data_key).decode()
+        )
+
+    def shared_with(self, recipient_id: ObjectId, kind: str, limit: int = 100) -> list:
+        """
+        Lists the notes or files shared with a user, newest first, with one
+        query on the recipient index.
+        """
+        cursor = self.collection.find(
+            {"recipient_id": ObjectId(recipient_id), "kind": kind}, SHARE_LIST_PROJECTION
+        ).sort("created_at", -1).limit(limit)
+        return [self._serialize_share(doc) for doc in cursor]
+
+    def recipients(self, owner_id: ObjectId, object_id) -> list:
+        """Lists the shares of one of the owner's objects."""
+        return self.recipients_by_object(owner_id, [object_id]).get(str(object_id), [])
+
+    def recipients_by_object(self, owner_id: ObjectId, object_ids: list) -> dict:
+        """
+        Shares of several of the owner's objects (e.g. one page of notes),
+        as {object id: [share, ...]}, with one query for the shares and one
+        for the recipients' usernames.
+        """
+        cursor = self.collection.find(
+            {"object_id": {"$in": [ObjectId(object_id) for object_id in object_ids]}, "owner_id": ObjectId(owner_id)},
+            SHARE_LIST_PROJECTION
+        )
+        shares = [self._serialize_share(doc) for doc in cursor]
+        names = {
+            doc["_id"]: doc["username"]
+            for doc in self.database[COLLECTION_USERS].find(
+                {"_id": {"$in": list({ObjectId(share["recipient_id"]) for share in shares})}}, {"username": 1}
+            )
+        } if shares else {}
+
+        by_object = {}
+        for share in shares:
+            share["recipient_username"] = names.get(ObjectId(share["recipient_id"]))
+            by_object.setdefault(share["object_id"], []).append(share)
+        return by_object
+
+    def revoke(self, share_id, owner_id: ObjectId, dek: bytes = None) -> bool:
+        """
+        Deletes a share. For a note, pass the owner's `dek` so the note is
+        re-encrypted under a new key the former recipient never had.
+        """
+        owner_id = ObjectId(owner_id)
+        share = self.collection.find_one({"_id": ObjectId(share_id), "owner_id": owner_id})
+        if share is None:
+            return False
+        if share["kind"] == SHARE_NOTE and dek is not None:
+            # Before the delete: if the rekey fails, the share is still there
+            # and the revoke can be retried
+            self._rekey_note(owner_id, dek, share["object_id"], revoked_id=share["_id"])
+        res = self.collection.delete_one({"_id": share["_id"], "owner_id": owner_id})
+        return res.deleted_count == 1
+
+    def _rekey_note(self, owner_id: ObjectId, dek: bytes, note_id: ObjectId, revoked_id: ObjectId = None):
+        """
+        Re-encrypts a note under a fresh data key and rewraps that key for
+        each recipient except the share being revoked.
+        """
+        note = self.database[COLLECTION_NOTES].find_one({"_id": note_id, "owner_id": owner_id})
+        if note is None:
+            return
+
+        plaintext = self.notes.decrypt_note_with_dek(dek, note["encrypted_content"], note["nonce"], note.get("wrapped_key"), note.get("kek_id"))
+        enc = self.notes.encrypt_note_with_dek(dek, plaintext)
+        # Same text, so the blind-index tokens stay valid
+        self.notes.update_note(note_id, enc["ciphertext"], enc["nonce"], enc["sha256"], enc["wrapped_key"], enc["kek_id"], note.get("search_tokens"), owner_id=owner_id)
+
+        shares = list(self.collection.find(
+            {"object_id": note_id, "owner_id": owner_id, "_id": {"$ne": revoked_id}}, {"recipient_id": 1}
+        ))
+        if not shares:
+            return
+        data_key = object_key(dek, enc["wrapped_key"], enc["kek_id"])
+        recipients = {
+            doc["_id"]: doc
+            for doc in self.database[COLLECTION_USERS].find(
+                {"_id": {"$in": [share["recipient_id"] for share in shares]}}, {"public_key_pem": 1}
+            )
+        }
+        requests = [
+            UpdateOne({"_id": share["_id"]}, {"$set": {"encrypted_key": self._encrypt_key(recipients[share["recipient_id"]], data_key)}})
+            for share in shares if share["recipient_id"] in recipients
+        ]
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def open_key(self, share_id, recipient_id: ObjectId) -> tuple:
+        """
+        Returns (share, data key) for a share addressed to `recipient_id`.
+        """
+        share = self.collection.find_one({"_id": ObjectId(share_id), "recipient_id": ObjectId(recipient_id)})
+        if share is None:
+            raise Exception("Share not found")
+
+        recipient = self.database[COLLECTION_USERS].find_one({"_id": ObjectId(recipient_id)})
+        private_key = self.users.load_private_key(recipient)
+        data_key = base64.urlsafe_b64decode(self.users.decrypt_with_private(private_key, share["encrypted_key"]).encode('utf-8'))
+        return self._serialize_share(share), data_key
+
+    def decrypt_shared_note(self, share: dict, data_key: bytes) -> str:
+        note = self.database[COLLECTION_NOTES].find_one({"_id": ObjectId(share["object_id"])})
+        if note is None:
+            raise Exception("The note is no longer available")
+        # The data key opens the ciphertext directly
+        return self.notes.decrypt_note_with_dek(data_key, note["encrypted_content"], note["nonce"])
+
+    def _serialize_share(self, doc: dict) -> dict:
+        return {
+            "_id": str(doc["_id"]),
+            "kind": doc["kind"],
+            "object_id": str(doc["object_id"]),
+            "owner_id": str(doc["owner_id"]),
+            "owner_username": doc.get("owner_username"),
+            "recipient_id": str(doc["recipient_id"]),
+            "label": doc.get("label"),
+            "content_type": doc.get("content_type"),
+            "created_at": doc["created_at"]
+        }
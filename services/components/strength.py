@@ -0,0 +1,81 @@
+import os
+import hmac
+import hashlib
+import threading
+from collections import OrderedDict
+
+# ------------------
+# Memoized password strength scoring
+# ------------------
+# zxcvbn is CPU-heavy (dictionary matching) and Streamlit reruns the vault page
+# on every widget change. Results are cached under an HMAC of the candidate
+# with a per-process random key, so the cache never holds a plaintext or an
+# unkeyed hash that could be brute-forced.
+STRENGTH_CACHE_SIZE = int(os.getenv("CRYPTOLAB_STRENGTH_CACHE_SIZE", "256"))
+# zxcvbn's brute-force bound for n characters is 10**n guesses, and score 0 is
+# anything under 10**3 + 5, so inputs this short always score 0.
+FAST_PATH_MAX_LENGTH = 3
+
+
+class StrengthScorer:
+    def __init__(self, max_entries: int = STRENGTH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._zxcvbn = None
+
+    def score(self, password: str) -> dict:
+        """
+        Returns {"score", "good_password", "feedback"} like zxcvbn-based
+        VaultIngestion.check_password_strength, from the cache when possible.
+        """
+        if len(password) <= FAST_PATH_MAX_LENGTH:
+            return self._result(0, {
+                "warning": "This password is too short.",
+                "suggestions": ["Add another word or two. Uncommon words are better."]
+            })
+
+        digest = hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None:
+                self._cache.move_to_end(digest)
+                return self._copy(cached)
+
+        result = self._load_zxcvbn()(password)
+        scored = self._result(result["score"], result["feedback"])
+
+        with self._lock:
+            self._cache[digest] = scored
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return self._copy(scored)
+
+    def _load_zxcvbn(self):
+        # Importing zxcvbn builds its frequency dictionaries, so defer it
+        # until a password actually needs scoring
+        if self._zxcvbn is None:
+            from zxcvbn import zxcvbn
+            self._zxcvbn = zxcvbn
+        return self._zxcvbn
+
+    def _result(self, score: int, feedback: dict) -> dict:
+        return {
+            "score": score,
+            "good_password": score >= 3,
+            "feedback": feedback
+        }
+
+    def _copy(self, result: dict) -> dict:
+        feedback = dict(result["feedback"])
+        feedback["suggestions"] = list(feedback.get("suggestions", []))
+        return {**result, "feedback": feedback}
+
+
+_scorer = StrengthScorer()
+
+
+def score_password(password: str) -> dict:
+    """Scores a password with the process-wide StrengthScorer."""
+    return _scorer.score(password)
@@ -1,8 +1,21 @@
 import os 
 import streamlit as st
 import base64
-from pymongo import MongoClient
-import bcrypt
+import hashlib
+from services.components.connection import get_client
+from services.components.cache import SecretCache, ObjectCache
+from services.components.keypool import KeypairPool
+from services.components.blind_index import SEARCH_KEY_SIZE
+from services.components.file import DEDUP_KEY_SIZE
+from services.components.envelope import kek_id
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from services.components.executor import (
+    get_crypto_executor,
+    hash_password,
+    check_password,
+    BCRYPT_ROUNDS
+)
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import hashes, serialization
 import binascii
@@ -14,32 +27,86 @@ from datetime import datetime
 
 # Read the master key
 master_key = st.secrets["MASTER_KEY"]
+# Version of MASTER_KEY; while rotating to it, PREVIOUS_MASTER_KEY still opens
+# the private keys of users not migrated yet (see services.components.rotation)
+MASTER_KEY_VERSION = int(st.secrets.get("MASTER_KEY_VERSION", 1))
+previous_master_key = st.secrets.get("PREVIOUS_MASTER_KEY")
+
+def master_key_for(version: int) -> str:
+    """Returns the master key of a given version (documents without one are version 1)."""
+    if version == MASTER_KEY_VERSION:
+        return master_key
+    if version == MASTER_KEY_VERSION - 1 and previous_master_key:
+        return previous_master_key
+    raise Exception(f"Master key version {version} is not configured")
+
+def _serialize_private_key(private_key, key: str) -> str:
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        # Production: Encryption algorithm must be a KeySerializationEncryption instance
+        encryption_algorithm=serialization.BestAvailableEncryption(key.encode('utf-8'))
+    ).decode('utf-8')
+
+def reencrypt_private_key(private_pem: str, old_key: str, new_key: str) -> str:
+    """
+    Re-encrypts a private key PEM under another master key. Module-level so it
+    can run in a process pool.
+    """
+    private_key = serialization.load_pem_private_key(private_pem.encode('utf-8'), password=old_key.encode('utf-8'))
+    return _serialize_private_key(private_key, new_key)
+
+# Server-side, memory-only cache of unwrapped DEKs. A hit skips the PEM
+# decryption (KDF over the master key) and the RSA-OAEP unwrap on login; the
+# bcrypt check always runs first.
+DEK_CACHE_SIZE = int(os.getenv("CRYPTOLAB_DEK_CACHE_SIZE", "1024"))
+DEK_CACHE_TTL = float(os.getenv("CRYPTOLAB_DEK_CACHE_TTL", "900"))
+_dek_cache = SecretCache(max_entries=DEK_CACHE_SIZE, ttl_seconds=DEK_CACHE_TTL)
+
+def invalidate_cached_dek(user_id):
+    """Drops a user's cached DEK (call after key changes or account deletion)."""
+    _dek_cache.invalidate(str(user_id))
+
+# Process-wide cache of parsed RSA public keys, for code wrapping key material
+# for many users (sharing, rotation). Keyed like the DEK cache by user id and
+# a fingerprint of the PEM, so a changed public_key_pem is parsed again.
+PUBLIC_KEY_CACHE_SIZE = int(os.getenv("CRYPTOLAB_PUBLIC_KEY_CACHE_SIZE", "4096"))
+_public_key_cache = ObjectCache(max_entries=PUBLIC_KEY_CACHE_SIZE)
+
+def invalidate_cached_public_key(user_id):
+    """Drops a user's parsed public key (call after account deletion)."""
+    _public_key_cache.invalidate(str(user_id))
+
+def _new_rsa_keypair():
+    # Generate RSA private key
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key = private_key.public_key()
+
+    # Serialize keys to PEM (text) for storage/use
+    private_pem = _serialize_private_key(private_key, master_key)
+
+    public_pem = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+
+    return private_key, public_key, private_pem, public_pem
+
+# Registration takes a ready keypair from the pool instead of generating inline
+RSA_POOL_SIZE = int(os.getenv("CRYPTOLAB_RSA_POOL_SIZE", "8"))
+RSA_POOL_LOW_WATER = int(os.getenv("CRYPTOLAB_RSA_POOL_LOW_WATER", "2"))
+_keypair_pool = KeypairPool(_new_rsa_keypair, size=RSA_POOL_SIZE, low_water=RSA_POOL_LOW_WATER)
 
 class UserIngestion:
     def __init__(self, client):
-        self.client = MongoClient(client)
+        self.client = get_client(client)
         self.database = self.client[DATABASE_NAME]
         self.collection = self.database[COLLECTION_USERS]
+        # Start filling the keypair pool before the first sign-up
+        _keypair_pool.start()
     
     def generate_rsa_keypair(self):
-        # Generate RSA private key
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-
-        # Serialize keys to PEM (text) for storage/use
-        private_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            # Production: Encryption algorithm must be a KeySerializationEncryption instance
-            encryption_algorithm=serialization.BestAvailableEncryption(master_key.encode('utf-8'))
-        ).decode('utf-8')
-
-        public_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        ).decode('utf-8')
-
-        return private_key, public_key, private_pem, public_pem
+        return _new_rsa_keypair()
 
     def encrypt_with_public(self, public_key, plaintext: str) -> str:
         ciphertext = public_key.encrypt(
@@ -66,12 +133,23 @@ class UserIngestion:
         return plaintext.decode('utf-8')
     
     def create_user(self, username: str, password: str):
-        # 1) Hash password for 
-        salt = bcrypt.gensalt()
-        pwd_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        # Duplicate check first, so taken names cost no bcrypt or RSA work
+        if self.collection.find_one({"username": username}):
+            return "User already exists!"
+        doc = self._build_user_doc(username, password)
+        try:
+            self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            # Lost a race against another sign-up (unique username index)
+            return "User already exists!"
+        return "User created successfully!"
+
+    def _build_user_doc(self, username: str, password: str) -> dict:
+        # 1) Hash password (bcrypt, on the crypto executor)
+        pwd_hash = get_crypto_executor().run(hash_password, password.encode('utf-8'), BCRYPT_ROUNDS)
 
-        # 2) Generate RSA keypair for the user (for encrypting DEKs / metadata)
-        priv, pub, priv_pem, pub_pem = self.generate_rsa_keypair()
+        # 2) Take a pre-generated RSA keypair for the user (for encrypting DEKs / metadata)
+        priv, pub, priv_pem, pub_pem = _keypair_pool.acquire()
 
         # 3) Generate a DEK for the user’s future data
         user_dek = base64.urlsafe_b64encode(os.urandom(32)).decode()
@@ -85,12 +163,11 @@ class UserIngestion:
             "public_key_pem": pub_pem,
             "private_key_pem_encrypted": priv_pem,
             "encrypted_user_dek": encrypted_user_dek,
+            "kek_id": kek_id(base64.urlsafe_b64decode(user_dek)),
+            "master_key_version": MASTER_KEY_VERSION,
             "date_created": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p'),
         }
-        if self.collection.find_one({"username": username}):
-            return "User already exists!"
-        self.collection.insert_one(doc)
-        return "User created successfully!"
+        return doc
 
     def verify_password(self, username: str, candidate_password: str) -> bool:
         """
@@ -104,9 +181,119 @@ class UserIngestion:
             bool: True if the password matches the hash, False otherwise.
         """
         doc = self.collection.find_one({"username": username})
+        return self._check_password_hash(doc, candidate_password)
+
+    def _check_password_hash(self, doc: dict, candidate_password: str) -> bool:
         stored_hash = doc.get("password_hash")
-        if bcrypt.checkpw(candidate_password.encode('utf-8'), stored_hash.encode('utf-8')):
+        if get_crypto_executor().run(check_password, candidate_password.encode('utf-8'), stored_hash.encode('utf-8')):
             return True
         else:
             return False
 
+    def login(self, username: str, candidate_password: str) -> dict:
+        """
+        Authenticates a user and unwraps their DEK with a single user lookup.
+
+        Args:
+            username (str): The username.
+            candidate_password (str): The plain text password.
+
+        Returns:
+            dict: {"success", "message"} plus "user_id", "username" and "dek"
+                (raw bytes) when the login succeeds.
+        """
+        doc = self.collection.find_one({"username": username})
+        if not doc:
+            return {"success": False, "message": "User not found!"}
+
+        if not self._check_password_hash(doc, candidate_password):
+            return {"success": False, "message": "Incorrect Password. Access denied!"}
+
+        return {
+            "success": True,
+            "message": "Access granted!",
+            "user_id": str(doc["_id"]),
+            "username": username,
+            "dek": self.unwrap_user_dek(doc)
+        }
+
+    def load_public_key(self, doc: dict):
+        """Returns the user's parsed RSA public key, from the process-wide cache when possible."""
+        pem = doc["public_key_pem"]
+        key = (str(doc["_id"]), hashlib.sha256(pem.encode('utf-8')).hexdigest())
+        return _public_key_cache.get_or_set(
+            key,
+            lambda: serialization.load_pem_public_key(pem.encode('utf-8')),
+            tag=str(doc["_id"])
+        )
+
+    def search_key(self, user_id, create: bool = True) -> bytes:
+        """
+        Returns the user's blind-index key (see services.components.blind_index),
+        creating it on first use unless `create` is False (then None means the
+        user has not enabled search). Like the DEK it is stored RSA-wrapped,
+        but it is a separate key: DEK rotation does not change it.
+        """
+        return self._user_secret(user_id, "encrypted_search_key", "search", SEARCH_KEY_SIZE, create)
+
+    def dedup_key(self, user_id) -> bytes:
+        """
+        Returns the key of the user's file content HMACs (see
+        FileIngestion.upload_deduplicated), creating it on first use. It is
+        stored like the search key, so dedup survives DEK rotation.
+        """
+        return self._user_secret(user_id, "encrypted_dedup_key", "dedup", DEDUP_KEY_SIZE)
+
+    def _user_secret(self, user_id, field: str, label: str, size: int, create: bool = True) -> bytes:
+        doc = self.collection.find_one({"_id": ObjectId(user_id)})
+        if doc.get(field) is None:
+            if not create:
+                return None
+            wrapped = self.encrypt_with_public(
+                self.load_public_key(doc), base64.urlsafe_b64encode(os.urandom(size)).decode()
+            )
+            # A concurrent session may have created it first
+            self.collection.update_one(
+                {"_id": doc["_id"], field: {"$exists": False}},
+                {"$set": {field: wrapped}}
+            )
+            doc = self.collection.find_one({"_id": doc["_id"]})
+
+        fingerprint = hashlib.sha256(
+            (doc[field] + doc["private_key_pem_encrypted"]).encode('utf-8')
+        ).hexdigest()
+        key = (str(doc["_id"]), label, fingerprint)
+
+        secret = _dek_cache.get(key)
+        if secret is None:
+            private_key = self.load_private_key(doc)
+            secret = base64.urlsafe_b64decode(self.decrypt_with_private(private_key, doc[field]).encode('utf-8'))
+            _dek_cache.put(key, secret, tag=str(doc["_id"]))
+        return secret
+
+    def load_private_key(self, doc: dict):
+        """Decrypts the user's private key PEM with the master key it was encrypted with."""
+        return serialization.load_pem_private_key(
+            doc["private_key_pem_encrypted"].encode('utf-8'),
+            password=master_key_for(doc.get("master_key_version", 1)).encode('utf-8')
+        )
+
+    def unwrap_user_dek(self, doc: dict) -> bytes:
+        """
+        Returns the user's raw DEK, from the in-memory cache when possible.
+
+        The cache key includes a fingerprint of the wrapped key material, so a
+        changed user document never returns a stale DEK.
+        """
+        fingerprint = hashlib.sha256(
+            (doc["encrypted_user_dek"] + doc["private_key_pem_encrypted"]).encode('utf-8')
+        ).hexdigest()
+        key = (str(doc["_id"]), fingerprint)
+
+        dek = _dek_cache.get(key)
+        if dek is None:
+            private_key = self.load_private_key(doc)
+            user_dek_base64 = self.decrypt_with_private(private_key, doc["encrypted_user_dek"])
+            dek = base64.urlsafe_b64decode(user_dek_base64.encode('utf-8'))
+            _dek_cache.put(key, dek, tag=str(doc["_id"]))
+        return dek
@@ -1,61 +1,81 @@
 import os 
+import io
+import csv
 import base64
-from pymongo import MongoClient
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from services.components.connection import get_client
 import hashlib
-from zxcvbn import zxcvbn
+from services.components.strength import score_password
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import binascii
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from services.components.encoding import to_binary, from_stored
+from services.components.envelope import new_data_key, object_key, check_current_kek
 from services.constant.collection_pipeline import (
     DATABASE_NAME,
-	COLLECTION_VAULT
+	COLLECTION_VAULT,
+    COLLECTION_USERS,
+    SCHEMA_VERSION_BINARY
 )
 from datetime import datetime
 
+def password_strength(password: str) -> dict:
+    # Module-level so it can be pickled into a process pool for bulk imports
+    return score_password(password)
+
+# Header names used by common password manager CSV exports
+# (Chrome/Edge, Firefox, Bitwarden, LastPass, 1Password)
+CSV_COLUMNS = {
+    "service": ("name", "title", "service"),
+    "url": ("url", "login_uri", "website"),
+    "username": ("username", "login_username", "user", "email", "login"),
+    "password": ("password", "login_password"),
+}
+
 class VaultIngestion:
     def __init__(self, client):
-        self.client = MongoClient(client)
+        self.client = get_client(client)
         self.database = self.client[DATABASE_NAME]
         self.collection = self.database[COLLECTION_VAULT]
         
     def encrypt_password_with_dek(self, dek: bytes, password: str) -> dict:
         """
-        dek: raw bytes (32 bytes for AES-256)
+        dek: raw bytes (32 bytes for AES-256), wraps the entry's own data key
         password: string
-        returns dict: {ciphertext, nonce, sha256}
+        returns dict: {password_encrypted, nonce} as raw bytes plus {wrapped_key, kek_id}
         """
-        if isinstance(dek, str):
-            # defensive: if someone passes base64 string accidentally
-            dek = base64.b64decode(dek)
-        
-        aesgcm = AESGCM(dek)
+        data_key, wrapped = new_data_key(dek)
+
         nonce = os.urandom(12) # 12 bytes * 8 bits/byte = 96-bit nonce for GCM
-        password_encrypted = aesgcm.encrypt(nonce, password.encode('utf-8'), associated_data=None)
+        password_encrypted = AESGCM(data_key).encrypt(nonce, password.encode('utf-8'), associated_data=None)
         
         return {
-            "password_encrypted": base64.b64encode(password_encrypted).decode('utf-8'),
-            "nonce": base64.b64encode(nonce).decode('utf-8')
+            "password_encrypted": password_encrypted,
+            "nonce": nonce,
+            **wrapped
         }
         
-    def decrypt_password_with_dek(self, dek: bytes, password_encrypted_b64: str, nonce_64: str) -> str:
+    def decrypt_password_with_dek(self, dek: bytes, password_encrypted_b64: str, nonce_64: str, wrapped_key=None, kek_id: str = None) -> str:
         """
         dek: raw bytes
-        password_encrypted_b64, nonce_b64: base64 strings from DB
+        password_encrypted_b64, nonce_b64: stored values, Binary or legacy base64 strings
+        wrapped_key, kek_id: the entry's wrapped data key (None for entries
+        encrypted directly with the DEK)
         returns password string (raises on auth failure)
         """
-        if isinstance(dek, str):
-            dek = base64.b64decode(dek)
-        
-        aesgcm = AESGCM(dek)
-        nonce = base64.b64decode(nonce_64)
-        password_encrypted = base64.b64decode(password_encrypted_b64)
+        aesgcm = AESGCM(object_key(dek, wrapped_key, kek_id))
+        nonce = from_stored(nonce_64)
+        password_encrypted = from_stored(password_encrypted_b64)
         password = aesgcm.decrypt(nonce, password_encrypted, associated_data=None)
         
         return password.decode('utf-8')
     
     def check_password_strength(self, password: str) -> dict:
         """
-        Check the strength of a given password using the zxcvbn library.
+        Check the strength of a given password using the zxcvbn library
+        (memoized, see services.components.strength).
 
         Args:
             password (str): The password to be evaluated.
@@ -63,19 +83,7 @@ class VaultIngestion:
         Returns:
             dict: A dictionary containing the strength score and feedback.
         """
-        result = zxcvbn(password)
-        score = result["score"]
-        feedback = result["feedback"]
-        
-        good_password = False
-        if score >= 3:
-            good_password = True
-
-        return {
-            "score": score,
-            "good_password": good_password,
-            "feedback": feedback
-        }
+        return password_strength(password)
 
     def fetch_services(self, owner_id: ObjectId):
         """
@@ -86,22 +94,98 @@ class VaultIngestion:
             {"owner_id": ObjectId(owner_id)}
         )
         return sorted(services)
+
+    def fetch_vault_overview(self, owner_id: ObjectId, service: str = None, page_size: int = 50) -> dict:
+        """
+        Loads everything the vault page needs in one aggregation round-trip.
+
+        Args:
+            owner_id (ObjectId): The owner of the entries.
+            service (str): The selected service. If None, or if it no longer
+                exists, the next service in alphabetical order is used.
+            page_size (int): Maximum number of entries returned.
+
+        Returns:
+            dict: {"services": [{"service", "count", "last_modified"}],
+                "service": the service the entries belong to (or None),
+                "entries": serialized entries of that service}
+        """
+        result = next(self.collection.aggregate(self._overview_pipeline(owner_id, service, page_size)), None)
+        return self._build_overview(result)
+
+    def _overview_pipeline(self, owner_id: ObjectId, service: str, page_size: int) -> list:
+        owner_id = ObjectId(owner_id)
+        # The selected service, or the next one in alphabetical order, or
+        # (if the selection sorted last and was deleted) the first one
+        first = {"$arrayElemAt": ["$services.service", 0]}
+        selected = first
+        if service:
+            selected = {"$ifNull": [
+                {"$arrayElemAt": [{"$filter": {"input": "$services.service", "cond": {"$gte": ["$$this", service]}}}, 0]},
+                first
+            ]}
+
+        return [
+            # Served by the (owner_id, service) index
+            {"$match": {"owner_id": owner_id}},
+            {"$group": {
+                "_id": "$service",
+                "count": {"$sum": 1},
+                # Entries written before modified_at existed fall back
+                # to the creation time embedded in their ObjectId
+                "last_modified": {"$max": {"$ifNull": ["$modified_at", {"$toDate": "$_id"}]}}
+            }},
+            {"$sort": {"_id": 1}},
+            {"$group": {
+                "_id": None,
+                "services": {"$push": {"service": "$_id", "count": "$count", "last_modified": "$last_modified"}}
+            }},
+            {"$set": {"service": selected}},
+            # Only the selected service's entries, again through the
+            # (owner_id, service) index
+            {"$lookup": {
+                "from": COLLECTION_VAULT,
+                "localField": "service",
+                "foreignField": "service",
+                "pipeline": [{"$match": {"owner_id": owner_id}}, {"$limit": page_size}],
+                "as": "entries"
+            }}
+        ]
+
+    def _build_overview(self, result: dict) -> dict:
+        result = result or {"services": [], "service": None, "entries": []}
+        return {
+            "services": result["services"],
+            "service": result.get("service"),
+            "entries": [self._serialize_password(doc) for doc in result["entries"]]
+        }
         
     # -------------------
     # CRUD for passsword
     # -------------------
-    def create_password_entry(self, owner_id: ObjectId, password_encrypted: str, nonce: str, service: str, username: str, url: str):
+    def create_password_entry(self, owner_id: ObjectId, password_encrypted: str, nonce: str, service: str, username: str, url: str, wrapped_key=None, kek_id: str = None):
+        doc = self._new_password_doc(owner_id, password_encrypted, nonce, service, username, url, wrapped_key, kek_id)
+        check_current_kek(self.database[COLLECTION_USERS], owner_id, kek_id)
+        res = self.collection.insert_one(doc)
+        return str(res.inserted_id)
+
+    def _new_password_doc(self, owner_id: ObjectId, password_encrypted: str, nonce: str, service: str, username: str, url: str, wrapped_key=None, kek_id: str = None) -> dict:
         doc = {
             "owner_id": ObjectId(owner_id),
             "username": username,
             "service": service,
             "url": url,
-            "password_encrypted": password_encrypted,
-            "nonce": nonce,
-            "created_at": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p')
+            "password_encrypted": to_binary(password_encrypted),
+            "nonce": to_binary(nonce),
+            "schema_version": SCHEMA_VERSION_BINARY,
+            "created_at": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p'),
+            "modified_at": datetime.now()
         }
-        res = self.collection.insert_one(doc)
-        return str(res.inserted_id)
+        # Entries without a wrapped key are encrypted with the DEK directly
+        if wrapped_key is not None:
+            doc["wrapped_key"] = to_binary(wrapped_key)
+            doc["kek_id"] = kek_id
+        return doc
 
     def fetch_passwords_by_service(self, owner_id: ObjectId, service: str):
         # self.collection.find({"owner_id": ObjectId(owner_id)})
@@ -112,28 +196,160 @@ class VaultIngestion:
         })
         notes = []
         for doc in cursor:
-            notes.append({
-                "_id": str(doc["_id"]),
-                "owner_id": str(doc["owner_id"]),
-                "username": doc["username"],
-                "service": doc["service"],
-                "url": doc["url"],
-                "password_encrypted": doc["password_encrypted"],
-                "nonce": doc["nonce"],
-                "created_at": doc.get("created_at")
-            })
+            notes.append(self._serialize_password(doc))
         return notes
+
+    def _serialize_password(self, doc: dict) -> dict:
+        return {
+            "_id": str(doc["_id"]),
+            "owner_id": str(doc["owner_id"]),
+            "username": doc["username"],
+            "service": doc["service"],
+            "url": doc["url"],
+            "password_encrypted": doc["password_encrypted"],
+            "nonce": doc["nonce"],
+            "wrapped_key": doc.get("wrapped_key"),
+            "kek_id": doc.get("kek_id"),
+            "created_at": doc.get("created_at")
+        }
     
+    # -------------------
+    # Bulk CSV import
+    # -------------------
+    def import_csv(self, owner_id: ObjectId, dek: bytes, csv_file, username: str = "", batch_size: int = 500, max_workers: int = None, require_strong: bool = False):
+        """
+        Imports a password manager CSV export, yielding one result per row.
+
+        Rows are streamed in batches. Each batch is strength-scored in a process
+        pool, checked for existing services with one $in query, encrypted (each
+        entry under its own wrapped data key) and written with one insert_many.
+
+        Args:
+            owner_id (ObjectId): The owner of the entries.
+            dek (bytes): The user's DEK.
+            csv_file: A binary or text file-like object with a header row.
+            username (str): Fallback username for rows without one.
+            batch_size (int): Rows per batch.
+            max_workers (int): Scoring processes (None = CPU count).
+            require_strong (bool): Skip passwords zxcvbn scores below 3.
+
+        Yields:
+            dict: {"row", "service", "status", "score", "_id", "error"} where status
+                is "inserted", "duplicate", "weak", "invalid" or "error".
+        """
+        if isinstance(dek, str):
+            dek = base64.b64decode(dek)
+
+        if not isinstance(csv_file, io.TextIOBase):
+            csv_file = io.TextIOWrapper(csv_file, encoding="utf-8-sig", newline="")
+        reader = csv.DictReader(csv_file)
+        columns = self._csv_columns(reader.fieldnames or [])
+
+        seen = set()
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Row 1 is the header
+            rows = enumerate(reader, start=2)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                for result in self._import_batch(owner_id, dek, batch, columns, username, require_strong, seen, pool, workers):
+                    yield result
+
+    def _csv_columns(self, fieldnames: list) -> dict:
+        lowered = {name.strip().lower(): name for name in fieldnames if name}
+        columns = {}
+        for field, aliases in CSV_COLUMNS.items():
+            columns[field] = next((lowered[a] for a in aliases if a in lowered), None)
+        return columns
+
+    def _import_batch(self, owner_id: ObjectId, dek: bytes, batch: list, columns: dict, username: str, require_strong: bool, seen: set, pool, workers: int) -> list:
+        results = []
+        entries = []
+        for row_number, row in batch:
+            entry = {field: (row.get(column) or "").strip() if column else "" for field, column in columns.items()}
+            result = {"row": row_number, "service": entry["service"], "status": None, "score": None, "_id": None, "error": None}
+            results.append(result)
+            if not entry["service"] or not entry["password"]:
+                result["status"] = "invalid"
+                result["error"] = "Missing service or password"
+            else:
+                entries.append((result, entry))
+
+        # Strength scoring is CPU-bound (zxcvbn), so it runs in worker processes
+        passwords = [entry["password"] for _, entry in entries]
+        chunksize = max(1, len(passwords) // (workers * 4))
+        for (result, _), strength in zip(entries, pool.map(password_strength, passwords, chunksize=chunksize)):
+            result["score"] = strength["score"]
+
+        # One round-trip for the whole batch's duplicate check
+        existing = set(self.collection.distinct("service", {
+            "owner_id": ObjectId(owner_id),
+            "service": {"$in": list({entry["service"] for _, entry in entries})}
+        }))
+
+        docs = []
+        pending = []
+        for result, entry in entries:
+            if entry["service"] in existing or entry["service"] in seen:
+                result["status"] = "duplicate"
+                continue
+            if require_strong and result["score"] < 3:
+                result["status"] = "weak"
+                continue
+
+            seen.add(entry["service"])
+            enc = self.encrypt_password_with_dek(dek, entry["password"])
+            docs.append(self._new_password_doc(
+                owner_id,
+                enc["password_encrypted"],
+                enc["nonce"],
+                entry["service"],
+                entry["username"] or username,
+                entry["url"],
+                enc["wrapped_key"],
+                enc["kek_id"]
+            ))
+            pending.append(result)
+
+        if docs:
+            check_current_kek(self.database[COLLECTION_USERS], owner_id, docs[0].get("kek_id"))
+            failed = {}
+            try:
+                self.collection.insert_many(docs, ordered=False)
+            except BulkWriteError as bwe:
+                failed = {err["index"]: err.get("errmsg", "Write error") for err in bwe.details.get("writeErrors", [])}
+
+            for i, (result, doc) in enumerate(zip(pending, docs)):
+                if i in failed:
+                    result["status"] = "error"
+                    result["error"] = failed[i]
+                else:
+                    result["status"] = "inserted"
+                    result["_id"] = str(doc["_id"])
+
+        return results
+
     # Why use `service` not `id`? Because service is unique for each user
-    def update_password_entry(self, service: str, encrypted_content: str, nonce: str):
-        doc = {
-            "password_encrypted": encrypted_content,
-            "nonce": nonce
-        }
-        res = self.collection.update_one({"service": service}, {"$set": doc})
+    def update_password_entry(self, owner_id: ObjectId, service: str, encrypted_content: str, nonce: str, wrapped_key=None, kek_id: str = None):
+        doc = self._updated_password_doc(encrypted_content, nonce, wrapped_key, kek_id)
+        check_current_kek(self.database[COLLECTION_USERS], owner_id, kek_id)
+        res = self.collection.update_one({"owner_id": ObjectId(owner_id), "service": service}, {"$set": doc, "$unset": {"legacy_key": ""}})
         return res
+
+    def _updated_password_doc(self, encrypted_content: str, nonce: str, wrapped_key=None, kek_id: str = None) -> dict:
+        return {
+            "password_encrypted": to_binary(encrypted_content),
+            "nonce": to_binary(nonce),
+            # A new ciphertext always replaces the previous key
+            "wrapped_key": to_binary(wrapped_key) if wrapped_key is not None else None,
+            "kek_id": kek_id,
+            "schema_version": SCHEMA_VERSION_BINARY,
+            "modified_at": datetime.now()
+        }
     
-    def delete_password_entry(self, service: str):
-        res = self.collection.delete_one({"service": service})
+    def delete_password_entry(self, owner_id: ObjectId, service: str):
+        res = self.collection.delete_one({"owner_id": ObjectId(owner_id), "service": service})
         return res
 
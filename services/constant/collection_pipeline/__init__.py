@@ -2,17 +2,66 @@
 
 '''
 - `users`
-    - `_id`, `username`, `password_hash` (bcrypt), `public_key_pem`, `private_key_pem_encrypted`, `encrypted_user_dek`, `date_created`
+    - `_id`, `username`, `password_hash` (bcrypt), `public_key_pem`, `private_key_pem_encrypted`, `encrypted_user_dek`, `kek_id` (current KEK), `pending_user_dek` (key rotation), `master_key_version`, `encrypted_search_key`, `encrypted_dedup_key`, `date_created`
 - `notes`
-    - `_id`, `owner_id`, `encrypted_content`, `iv` or 'nonce', `sha256`, `created_at`, `updated_at
+    - `_id`, `owner_id`, `encrypted_content`, `iv` or 'nonce', `sha256`, `wrapped_key`, `kek_id`, `search_tokens` (blind index), `created_at`, `updated_at
 - `vault` (passwords)
-    - `_id`, `owner_id`, `service`, `username`, `password_encrypted`, `iv`, `url`, `created_at`
+    - `_id`, `owner_id`, `service`, `username`, `password_encrypted`, `iv`, `url`, `wrapped_key`, `kek_id`, `created_at`
 - `files` (GridFS metadata(fs.files) and data(fs.chunks))
-    - `_id`, , `filename`, `uploadDate`, `chunkSize`, `length`, `metadata: owner_id, original_filename, sha256, encrypted=True, uploaded_at, content_type(image/pdf/...)`
+    - `_id`, , `filename`, `uploadDate`, `chunkSize`, `length`, `metadata: owner_id, original_filename, sha256, encrypted=True, uploaded_at, content_type(image/pdf/...), wrapped_key, kek_id, content_hmac, refcount, hidden | blob_id (dedup aliases)`
     - `_id`, `files_id`, `n`(index of chunks), `data`
+- `shares` (see services.components.shares)
+    - `_id`, `kind` (note/file), `object_id`, `owner_id`, `owner_username`, `recipient_id`, `encrypted_key`, `label`, `content_type`, `created_at`
+- `jobs` (background work, see services.components.jobs)
+    - `_id`, `kind`, `payload`, `owner_id`, `status`, `attempts`, `max_attempts`, `run_at`, `worker_id`, `lease_expires_at`, `progress`, `result`, `error`, `created_at`, `updated_at`
 '''
 
+'''
+`schema_version` of notes and vault entries: 2 stores `encrypted_content` / `password_encrypted`
+and `nonce` as BSON Binary, documents without it (version 1) hold base64 strings.
+'''
+SCHEMA_VERSION_BINARY: int = 2
+
 DATABASE_NAME: str = "CryptoLabDB"
 COLLECTION_USERS: str = "Users"
 COLLECTION_NOTES: str = "Notes"
 COLLECTION_VAULT: str = "Vault"
+COLLECTION_FILES: str = "fs.files"
+COLLECTION_CHUNKS: str = "fs.chunks"
+COLLECTION_JOBS: str = "Jobs"
+COLLECTION_SHARES: str = "Shares"
+
+'''
+Indexes provisioned by services.components.indexes (collection -> [(keys, options)]).
+Every hot query filters on the owner, so each user-scoped collection is led by it.
+'''
+INDEXES: dict = {
+    COLLECTION_USERS: [
+        ([("username", 1)], {"name": "username_unique", "unique": True}),
+    ],
+    COLLECTION_NOTES: [
+        ([("owner_id", 1), ("created_at", 1)], {"name": "owner_created_at"}),
+        ([("owner_id", 1), ("_id", -1)], {"name": "owner_id_desc"}),
+        # Blind-index lookups (multikey over the token array)
+        ([("owner_id", 1), ("search_tokens", 1)], {"name": "owner_search_tokens"}),
+    ],
+    COLLECTION_VAULT: [
+        ([("owner_id", 1), ("service", 1)], {"name": "owner_service"}),
+    ],
+    COLLECTION_FILES: [
+        ([("metadata.owner_id", 1), ("uploadDate", -1)], {"name": "owner_upload_date"}),
+        ([("metadata.owner_id", 1), ("metadata.content_hmac", 1)], {"name": "owner_content_hmac", "partialFilterExpression": {"metadata.content_hmac": {"$exists": True}}}),
+    ],
+    COLLECTION_JOBS: [
+        ([("status", 1), ("run_at", 1)], {"name": "status_run_at"}),
+        ([("status", 1), ("lease_expires_at", 1)], {"name": "status_lease"}),
+        ([("owner_id", 1), ("created_at", -1)], {"name": "owner_created_at"}),
+    ],
+    COLLECTION_SHARES: [
+        # "Shared with me" listings
+        ([("recipient_id", 1), ("kind", 1), ("created_at", -1)], {"name": "recipient_kind_created_at"}),
+        # One share per object and recipient; also lists an object's recipients
+        ([("object_id", 1), ("recipient_id", 1)], {"name": "object_recipient_unique", "unique": True}),
+        ([("owner_id", 1)], {"name": "owner"}),
+    ],
+}
@@ -2,11 +2,60 @@ import streamlit as st
 from bson import ObjectId
 from datetime import datetime
 from services.components.file import FileIngestion
+from services.components.shares import ShareIngestion, SHARE_FILE
+from services.components.users import UserIngestion
 
 # Connection to MongoDB
 uri = st.secrets["MONGO_URI"]
 
 file_ingestion = FileIngestion(uri)
+share_ingestion = ShareIngestion(uri)
+user_ingestion = UserIngestion(uri)
+
+# Bytes shown by the text preview
+PREVIEW_BYTES = 4096
+
+def share_controls(file_id, user_id: str, shares: list):
+    """Share form and current recipients (`shares`) of one of the user's files."""
+    recipient = st.text_input("Share with (username)", key=f"share-to-{file_id}")
+    if st.button("Share 🔗", key=f"share-{file_id}"):
+        try:
+            # One RSA wrap of the file's key, the ciphertext is not copied
+            share_ingestion.share_file(ObjectId(user_id), st.session_state["dek"], file_id, recipient)
+            st.success(f"Shared with {recipient}.")
+        except Exception as e:
+            st.error(f"Share failed: {e}")
+
+    for share in shares:
+        if st.button(f"Stop sharing with {share['recipient_username']}", key=f"revoke-{share['_id']}"):
+            share_ingestion.revoke(share["_id"], ObjectId(user_id))
+            st.rerun()
+
+def shared_files(user_id: str):
+    """Files other users shared with the current user."""
+    st.subheader("Shared with me")
+    shares = share_ingestion.shared_with(ObjectId(user_id), SHARE_FILE)
+    if not shares:
+        st.info("No files have been shared with you.")
+        return
+
+    for share in shares:
+        with st.expander(f"{share['label']} (from {share['owner_username']})"):
+            if st.button("Decrypt & Prepare Download", key=f"dl-share-{share['_id']}"):
+                try:
+                    share_doc, data_key = share_ingestion.open_key(share["_id"], ObjectId(user_id))
+                    decrypted_data = b"".join(file_ingestion.stream_decrypted_file(
+                        ObjectId(share_doc["object_id"]), None, data_key=data_key
+                    ))
+                    st.download_button(
+                        label="Download File",
+                        data=decrypted_data,
+                        file_name=share["label"],
+                        mime=share["content_type"],
+                        key=f"save-share-{share['_id']}"
+                    )
+                except Exception as e:
+                    st.error(f"Download failed: {e}")
 
 def files_page():
     # -------------------------------
@@ -15,18 +64,19 @@ def files_page():
     st.title("📁 Files")
 
     # File uploader of whatever type(all)
-    uploaded_file = st.file_uploader(
-        "Upload a file",
+    uploaded_files = st.file_uploader(
+        "Upload files",
         type=None,
         key="file_uploader",
-        help="Upload any file for storage."
+        accept_multiple_files=True,
+        help="Upload any files for storage."
     )
 
     if st.button("Upload file"):
         st.session_state.pop("uploaded_file_processed", None)
         st.rerun()
 
-    if uploaded_file is not None and "uploaded_file_processed" not in st.session_state:
+    if uploaded_files and "uploaded_file_processed" not in st.session_state:
         
         st.session_state["uploaded_file_processed"] = True
         
@@ -36,29 +86,43 @@ def files_page():
         else:
             dek = st.session_state['dek']
             user_id = st.session_state['user_id']
-            
-            data = uploaded_file.read()  
-                
-            enc = file_ingestion.encrypt_file(
-                data=data,
-                dek=dek
-            )
-
-            metadata = {
-                "owner_id": ObjectId(user_id),
-                "original_filename": uploaded_file.name,
-                "sha256": enc['sha256'],
-                "encrypted": True,
-                "content_type": uploaded_file.type,
-                "uploaded_at": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p')
-            }
-            
-            file_id = file_ingestion.upload_to_gridfs(
-                filename=f"{uploaded_file.name[:7]}.enc", 
-                encrypted_bytes=enc['encrypted_bytes'], 
-                metadata=metadata
-            )
-            st.success(f"File uploaded with ID: {file_id}")
+
+            uploads = []
+            for uploaded_file in uploaded_files:
+                metadata = {
+                    "owner_id": ObjectId(user_id),
+                    "original_filename": uploaded_file.name,
+                    "encrypted": True,
+                    "content_type": uploaded_file.type,
+                    "uploaded_at": datetime.now().strftime('%m/%d/%Y %I:%M:%S %p')
+                }
+                uploads.append((uploaded_file, f"{uploaded_file.name[:7]}.enc", metadata))
+
+            # Files are encrypted (and compressed/deduplicated) in parallel and
+            # streamed segment by segment into GridFS
+            overall = st.progress(0.0, text=f"Uploading {len(uploads)} file(s)...")
+            bars = {}
+            finished = 0
+            for event in file_ingestion.upload_many(uploads, dek, user_ingestion.dedup_key(user_id)):
+                index = event["index"]
+                if index not in bars:
+                    bars[index] = st.empty()
+
+                if event["event"] == "progress":
+                    label = "Hashing" if event["phase"] == "hash" else "Encrypting"
+                    fraction = event["done"] / event["total"] if event["total"] else 1.0
+                    bars[index].progress(fraction, text=f"{event['filename']}: {label}")
+                    continue
+
+                finished += 1
+                overall.progress(finished / len(uploads), text=f"Uploaded {finished} of {len(uploads)} file(s)")
+                name = uploaded_files[index].name
+                if event["event"] == "error":
+                    bars[index].error(f"{name}: upload failed: {event['error']}")
+                elif event["deduplicated"]:
+                    bars[index].success(f"{name}: identical file already stored, linked as ID: {event['file_id']}")
+                else:
+                    bars[index].success(f"{name}: uploaded with ID: {event['file_id']}")
             
     st.subheader("Your uploaded files")
     
@@ -67,6 +131,8 @@ def files_page():
         st.stop()
         
     files = file_ingestion.get_files_list(owner_id=st.session_state["user_id"])
+    # Recipients of every listed file in one query
+    recipients = share_ingestion.recipients_by_object(ObjectId(st.session_state["user_id"]), [file["_id"] for file in files])
     st.write(f"Welcome {st.session_state['username']}!")
 
     for file in files:
@@ -79,28 +145,39 @@ def files_page():
         with col1:
             if st.button("Decrypt & Prepare Download", key=f"dl-{file_id}"):
                 try:
-                    encrypted_bytes = file_ingestion.download_from_gridfs(file_id)
                     dek = st.session_state["dek"]
-                    decrypted_data = file_ingestion.decrypt_file(encrypted_bytes, dek)
-
-                    # Integrity check
-                    if not file_ingestion.integrity_check(decrypted_data, file["metadata"]["sha256"]):
-                        st.error("Integrity check failed — file may be corrupted.")
-                        st.info("Delete this file...")
-                    else:
-                        st.download_button(
-                            label="Download File",
-                            data=decrypted_data,
-                            file_name=file["metadata"]["original_filename"],
-                            mime=file["metadata"]["content_type"]
-                        )
+                    # Segments are fetched, decrypted and verified one at a time
+                    decrypted_data = b"".join(file_ingestion.stream_decrypted_file(file_id, dek))
+
+                    st.download_button(
+                        label="Download File",
+                        data=decrypted_data,
+                        file_name=file["metadata"]["original_filename"],
+                        mime=file["metadata"]["content_type"]
+                    )
                 except Exception as e:
                     st.error(f"Download failed: {e}")
+                    st.info("The file may be corrupted. Delete this file...")
+
+            # Range read: only the first segment is fetched and decrypted
+            if (file["metadata"].get("content_type") or "").startswith("text/"):
+                if st.button("Preview", key=f"preview-{file_id}"):
+                    try:
+                        head = b"".join(file_ingestion.stream_decrypted_file(
+                            file_id, st.session_state["dek"], start=0, end=PREVIEW_BYTES
+                        ))
+                        st.code(head.decode('utf-8', errors='replace'), language='plaintext')
+                    except Exception as e:
+                        st.error(f"Preview failed: {e}")
 
             with col2:
                 if st.button(f"Delete", key=f"del-{file_id}"):
-                    file_ingestion.delete_from_gridfs(file_id)
+                    file_ingestion.delete_file(file_id)
                     st.success("Deleted!")
                     st.rerun()
+
+                share_controls(file_id, st.session_state["user_id"], recipients.get(str(file_id), []))
+
+    shared_files(st.session_state["user_id"])
                     
     st.divider()
\ No newline at end of file
@@ -1,11 +1,121 @@
 import streamlit as st 
 from bson import ObjectId
-from services.components.notes import NoteIngestion     
+from services.components.notes import NoteIngestion
+from services.components.shares import ShareIngestion, SHARE_NOTE
+from services.components.users import UserIngestion
+from services.components.cache import session_cache
 
 # Connection to MongoDB
 uri = st.secrets["MONGO_URI"]
 
 note_ingestion = NoteIngestion(uri)
+share_ingestion = ShareIngestion(uri)
+user_ingestion = UserIngestion(uri)
+
+NOTES_PAGE_SIZE = 20
+
+def decrypt_note_cached(note_meta: dict, dek: bytes, user_id: str) -> str:
+    """
+    Decrypts a note through the session's plaintext cache, so reruns (e.g.
+    every keystroke while editing) don't repeat the fetch and AES work.
+    """
+    def decrypt():
+        note = note_ingestion.fetch_note(note_meta['_id'], owner_id=user_id)
+        return note_ingestion.decrypt_note_with_dek(
+            dek=dek,
+            ciphertext_b64=note['encrypted_content'],
+            nonce_b64=note['nonce'],
+            wrapped_key=note.get('wrapped_key'),
+            kek_id=note.get('kek_id')
+        ).encode('utf-8')
+
+    cache = session_cache(st.session_state)
+    return cache.get_or_set((note_meta['_id'], note_meta['nonce']), decrypt, tag=note_meta['_id']).decode('utf-8')
+
+def session_search_key(user_id: str, create: bool = False):
+    """
+    The logged-in user's blind-index key (None if search is not enabled).
+    Stored with the user id it belongs to, so a later login in the same
+    browser session never reuses another user's key.
+    """
+    stored = st.session_state.get("search_key")
+    if create or stored is None or stored[0] != user_id:
+        stored = (user_id, user_ingestion.search_key(user_id, create=create))
+        st.session_state["search_key"] = stored
+    return stored[1]
+
+def note_search(dek: bytes, user_id: str):
+    """Blind-index search: one indexed lookup, then only the matches are decrypted."""
+    st.subheader("Search")
+    search_key = session_search_key(user_id)
+
+    if search_key is None:
+        st.caption("Search stores keyed word hashes with your notes, never the words themselves.")
+        if st.button("Enable encrypted search"):
+            session_search_key(user_id, create=True)
+            st.rerun()
+        return
+
+    unindexed = note_ingestion.count_unindexed(user_id)
+    if unindexed and st.button(f"Index {unindexed} note(s) for search"):
+        bar = st.progress(0.0, text="Indexing notes...")
+        note_ingestion.index_notes(
+            user_id, dek, search_key,
+            progress=lambda done, total: bar.progress(min(done / total, 1.0), text=f"Indexed {done} of {total}")
+        )
+        st.rerun()
+
+    query = st.text_input("Search notes (whole words)", key="notes_search")
+    if not query:
+        return
+
+    results = note_ingestion.search_notes(user_id, search_key, query)
+    if not results:
+        st.info("No matching notes.")
+    for note_meta in results:
+        with st.expander(f"Match • {note_meta['created_at']}"):
+            st.code(decrypt_note_cached(note_meta, dek, user_id), language='plaintext')
+
+def share_controls(note_id: str, dek: bytes, user_id: str, shares: list):
+    """Share form and current recipients (`shares`) of one of the user's notes."""
+    recipient = st.text_input("Share with (username)", key=f"share-to-{note_id}")
+    if st.button("Share 🔗", key=f"share-{note_id}"):
+        try:
+            share_ingestion.share_note(ObjectId(user_id), dek, note_id, recipient)
+            # Sharing may re-encrypt an older note under its own key
+            session_cache(st.session_state).invalidate(note_id)
+            st.success(f"Shared with {recipient}.")
+        except Exception as e:
+            st.error(f"Share failed: {e}")
+
+    for share in shares:
+        if st.button(f"Stop sharing with {share['recipient_username']}", key=f"revoke-{share['_id']}"):
+            try:
+                # Re-encrypts the note under a key the recipient never had
+                share_ingestion.revoke(share["_id"], ObjectId(user_id), dek)
+            except Exception as e:
+                st.error(f"Could not stop sharing: {e}")
+            else:
+                session_cache(st.session_state).invalidate(note_id)
+                st.rerun()
+
+def shared_notes(user_id: str):
+    """Notes other users shared with the current user."""
+    st.subheader("Shared with me")
+    shares = share_ingestion.shared_with(ObjectId(user_id), SHARE_NOTE)
+    if not shares:
+        st.info("No notes have been shared with you.")
+        return
+
+    for share in shares:
+        with st.expander(f"Note from {share['owner_username']} • {share['created_at']:%m/%d/%Y %I:%M %p}"):
+            if st.button("View ⤵️", key=f"view-share-{share['_id']}"):
+                try:
+                    # Not cached: the owner may have edited the note since
+                    share_doc, data_key = share_ingestion.open_key(share["_id"], ObjectId(user_id))
+                    st.code(share_ingestion.decrypt_shared_note(share_doc, data_key), language='plaintext')
+                except Exception as e:
+                    st.error(f"Decrypt failed: {e}")
 
 def notes_page():
     # -------------------------------
@@ -24,9 +134,21 @@ def notes_page():
         dek = st.session_state['dek']
         user_id = st.session_state['user_id']  # str of ObjectId
         st.write(f"Welcome {st.session_state['username']}!")
+
+        note_search(dek, user_id)
         
-        # show existing notes
-        notes_list = note_ingestion.fetch_notes(owner_id=user_id)
+        # show existing notes, one page at a time (metadata only)
+        if "notes_cursors" not in st.session_state:
+            st.session_state["notes_cursors"] = [None]
+
+        page = note_ingestion.fetch_notes_page(
+            owner_id=user_id,
+            page_size=NOTES_PAGE_SIZE,
+            cursor=st.session_state["notes_cursors"][-1]
+        )
+        notes_list = page["notes"]
+        # Recipients of every note on the page in one query
+        recipients = share_ingestion.recipients_by_object(ObjectId(user_id), [note["_id"] for note in notes_list])
 
         st.subheader("Your notes")
         if notes_list:
@@ -34,23 +156,22 @@ def notes_page():
                 with st.expander(f"Note • {note_meta['created_at']}"):
                     if st.button(f"View ⤵️", key=f"view-{note_meta['_id']}"):
                         try:
-                            plaintext = note_ingestion.decrypt_note_with_dek(
-                                dek=dek,
-                                ciphertext_b64=note_meta['encrypted_content'],
-                                nonce_b64=note_meta['nonce']
-                            )
+                            plaintext = decrypt_note_cached(note_meta, dek, user_id)
                             st.code(plaintext, language='plaintext')
                         except Exception as e:
                             st.error(f"Decrypt failed: {e}")
 
                     if st.button(f"Delete 🗑️", key=f"del-{note_meta['_id']}"):
                         deleted = note_ingestion.delete_note(note_meta['_id'])
+                        session_cache(st.session_state).invalidate(note_meta['_id'])
                         if deleted:
                             st.success("Deleted.")
                             st.rerun()
                         else:
                             st.error("Delete failed.")
 
+                    share_controls(note_meta['_id'], dek, user_id, recipients.get(note_meta['_id'], []))
+
                     # update flow
                     # Edit button
                     if st.button(f"Edit ✏️", key=f"edit-{note_meta['_id']}"):
@@ -59,24 +180,31 @@ def notes_page():
                     
                     # If this note is currently being edited
                     if st.session_state["editing_note"] == note_meta["_id"]:
-                        existing_plain = note_ingestion.decrypt_note_with_dek(
-                            dek=dek,
-                            ciphertext_b64=note_meta['encrypted_content'],
-                            nonce_b64=note_meta['nonce']
-                        )
+                        existing_plain = decrypt_note_cached(note_meta, dek, user_id)
 
                         st.write("**Editing:**")
                         new_text = st.text_area("Edit note text", value=existing_plain, key=f"text-{note_meta['_id']}")
 
                         if st.button("Save Changes", key=f"save-{note_meta['_id']}"):
-                            enc = note_ingestion.encrypt_note_with_dek(dek=dek, plaintext=new_text)
+                            # Keeps the note's data key, so its shares stay valid
+                            enc = note_ingestion.encrypt_note_with_dek(
+                                dek=dek,
+                                plaintext=new_text,
+                                note=note_ingestion.fetch_note(note_meta['_id'], owner_id=user_id),
+                                search_key=session_search_key(user_id)
+                            )
 
                             note_ingestion.update_note(
                                 note_id=note_meta['_id'],
                                 encrypted_content=enc['ciphertext'],
                                 nonce=enc['nonce'],
-                                sha256=enc['sha256']
+                                sha256=enc['sha256'],
+                                wrapped_key=enc['wrapped_key'],
+                                kek_id=enc['kek_id'],
+                                search_tokens=enc['search_tokens'],
+                                owner_id=ObjectId(user_id)
                             )
+                            session_cache(st.session_state).invalidate(note_meta['_id'])
 
                             st.success("Updated successfully!")
                             st.session_state["editing_note"] = None
@@ -88,6 +216,17 @@ def notes_page():
         else:
             st.info("No notes yet. Add your first note below.")
 
+        # pagination
+        col_prev, col_next = st.columns(2)
+        with col_prev:
+            if len(st.session_state["notes_cursors"]) > 1 and st.button("⬅️ Newer", key="notes-prev"):
+                st.session_state["notes_cursors"].pop()
+                st.rerun()
+        with col_next:
+            if page["next_cursor"] and st.button("Older ➡️", key="notes-next"):
+                st.session_state["notes_cursors"].append(page["next_cursor"])
+                st.rerun()
+
         # add new note
         st.subheader("Add a new note")
         new_note_text = st.text_area("Write something...", key="new_note_text")
@@ -95,14 +234,21 @@ def notes_page():
             if not new_note_text:
                 st.warning("Please write a note.")
             else:
-                enc = note_ingestion.encrypt_note_with_dek(dek=dek, plaintext=new_note_text)
+                enc = note_ingestion.encrypt_note_with_dek(dek=dek, plaintext=new_note_text, search_key=session_search_key(user_id))
                 inserted_id = note_ingestion.create_note(
                     owner_id=ObjectId(user_id),
                     encrypted_content=enc['ciphertext'],
                     nonce=enc['nonce'],
-                    sha256=enc['sha256']
+                    sha256=enc['sha256'],
+                    wrapped_key=enc['wrapped_key'],
+                    kek_id=enc['kek_id'],
+                    search_tokens=enc['search_tokens']
                 )
                 st.success("Note saved.")
+                # jump back to the first page to show the new note
+                st.session_state["notes_cursors"] = [None]
                 st.rerun()
 
+        shared_notes(user_id)
+
     st.divider()
@@ -1,18 +1,69 @@
 import streamlit as st
 import time
+from datetime import datetime, timezone
 from bson import ObjectId
-from services.components.users import UserIngestion
-from services.components.notes import NoteIngestion
-from services.components.vault import VaultIngestion
-from services.components.file import FileIngestion
+from services.components.users import UserIngestion, invalidate_cached_dek, invalidate_cached_public_key
+from services.components.jobs import JobQueue, JobWorker, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED
+from services.components.cache import session_cache
+from services.components.rotation import KeyRotation
 
 # Connection to MongoDB
 uri = st.secrets["MONGO_URI"]
 
 user_ingestion = UserIngestion(uri)
-note_ingestion = NoteIngestion(uri)
-vault_ingestion = VaultIngestion(uri)
-file_ingestion = FileIngestion(uri)
+job_queue = JobQueue(uri)
+key_rotation = KeyRotation(uri)
+
+# If no background worker claims the purge within this many seconds, the
+# session runs it itself (claims are atomic, so it never runs twice)
+PURGE_INLINE_AFTER = 5
+PURGE_STEPS = ["files", "notes", "vault", "shares", "user"]
+
+
+def track_purge_job(user_id: str):
+    """
+    Shows the progress of the user's purge job and finishes the logout once
+    it succeeded. Reruns the page every second until then. The job is looked
+    up by owner, so a browser refresh picks it up again.
+    """
+    job = job_queue.latest_job(user_id, "purge_account")
+    if job is None:
+        return
+
+    if job["status"] == JOB_SUCCEEDED:
+        invalidate_cached_dek(user_id)
+        invalidate_cached_public_key(user_id)
+
+        # Wipe cached plaintexts, then clear session and refresh
+        session_cache(st.session_state).clear()
+        st.session_state.clear()
+
+        st.success("Your account and all notes were deleted permanently.")
+        time.sleep(1)
+        st.rerun()
+
+    if job["status"] == JOB_FAILED:
+        st.error(f"Account deletion failed: {job['error']}")
+        return
+
+    created_at = job["created_at"]
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    waited = (datetime.now(timezone.utc) - created_at).total_seconds()
+    if job["attempts"] == 0 and waited > PURGE_INLINE_AFTER:
+        with st.spinner("Deleting account..."):
+            JobWorker(job_queue).run_once(job_id=job["_id"])
+        st.rerun()
+
+    progress = job["progress"] or {"step": PURGE_STEPS[0], "done": 0, "total": 0}
+    fraction = (PURGE_STEPS.index(progress["step"]) + (progress["done"] / progress["total"] if progress["total"] else 0)) / len(PURGE_STEPS)
+    label = f"Deleting {progress['step']}..." if job["status"] == JOB_RUNNING else "Waiting for a worker..."
+    if job["error"]:
+        label += f" (retrying after: {job['error']})"
+    st.progress(min(fraction, 1.0), text=label)
+
+    time.sleep(1)
+    st.rerun()
 
 
 def delete_user():
@@ -28,6 +79,9 @@ def delete_user():
         
     st.subheader("❌ Delete My Account")
 
+    # Deletion runs as a background job; keep polling it across reruns
+    track_purge_job(st.session_state["user_id"])
+
     del_pass = st.text_input("Password", type="password", key="del_pass")
 
     if st.button("Delete My Account Permanently"):
@@ -37,26 +91,39 @@ def delete_user():
         else:    
             user_id = st.session_state["user_id"]
 
-            # 1) Delete user's notes
-            note_ingestion.collection.delete_many({"owner_id": ObjectId(user_id)})
-
-            # 2) Delete vault
-            vault_ingestion.collection.delete_many({"owner_id": ObjectId(user_id)})
-            
-            # 3) Delete files
-            # 3) Delete files by file_id
-            for file in file_ingestion.get_files_list(owner_id=ObjectId(user_id)):
-                file_ingestion.delete_from_gridfs({"_id": file['_id']})
-            
-            # 4) Delete user
-            user_ingestion.collection.delete_one({"_id": ObjectId(user_id)})
-
-            # Clear session and refresh
-            st.session_state.clear()
-
-            st.success("Your account and all notes were deleted permanently.")
-            
-            time.sleep(1)
+            # Files, notes, vault and the user itself, atomically where the
+            # deployment supports transactions
+            job_queue.enqueue(
+                "purge_account",
+                payload={"owner_id": user_id},
+                owner_id=ObjectId(user_id)
+            )
             st.rerun()
 
-    st.divider()
\ No newline at end of file
+    st.divider()
+
+def rotate_key():
+    # -------------------------------
+    # ROTATE ENCRYPTION KEY
+    # -------------------------------
+    if "username" not in st.session_state:
+        return
+
+    st.subheader("🔄 Rotate Encryption Key")
+    st.caption("Rewraps the keys of all your notes, passwords and files under a new key. Saving is paused until it finishes (run it again if it is interrupted), and other open sessions will have to log in again.")
+
+    rot_pass = st.text_input("Password", type="password", key="rot_pass")
+
+    if st.button("Rotate Encryption Key"):
+        if not user_ingestion.verify_password(st.session_state["username"], rot_pass):
+            st.error("❌ Incorrect Password. Access denied!")
+        else:
+            bar = st.progress(0.0, text="Rotating key...")
+
+            def report(collection, done, total):
+                bar.progress(min(done / total, 1.0), text=f"Rewrapping {collection} keys...")
+
+            result = key_rotation.rotate(st.session_state["user_id"], progress=report)
+            st.session_state["dek"] = result["dek"]
+            session_cache(st.session_state).clear()
+            st.success(f"Key rotated ({sum(result['rewrapped'].values())} object keys rewrapped).")
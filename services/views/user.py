@@ -1,9 +1,7 @@
 import streamlit as st
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-import binascii, base64
 from services.components.users import UserIngestion
 from services.components.notes import NoteIngestion
+from services.components.cache import session_cache
 
 # Connection to MongoDB
 uri = st.secrets["MONGO_URI"]
@@ -11,9 +9,6 @@ uri = st.secrets["MONGO_URI"]
 user_ingestion = UserIngestion(uri)
 note_ingestion = NoteIngestion(uri)
 
-# Read the master key
-master_key = st.secrets["MASTER_KEY"]
-
 def new_user():
     # ---------------------------
     # USER CREATION SECTION
@@ -30,16 +25,14 @@ def new_user():
             if not username or not password:
                 st.warning("Please enter both username and password.")
             else:
-                doc = user_ingestion.collection.find_one({"username": username})
-
-                if doc:
+                # create_user checks for duplicates before any crypto work
+                result = user_ingestion.create_user(username, password)
+                if result == "User created successfully!":
+                    st.success("User created successfully!")
+                elif result == "User already exists!":
                     st.error("User already exists!")
                 else:
-                    result = user_ingestion.create_user(username, password)
-                    if result == "User created successfully!":
-                        st.success("User created successfully!")
-                    else:
-                        st.error("Failed to create user. Try again.")
+                    st.error("Failed to create user. Try again.")
 
     st.divider()
 
@@ -70,46 +63,29 @@ def login_page():
                 if not username_login or not password_attempt:
                     st.warning("Please enter both username and password.")
                 else:
-                    doc = user_ingestion.collection.find_one({"username": username_login})
+                    # ---- Verify password & unwrap DEK (single user lookup) ----
+                    try:
+                        result = user_ingestion.login(username_login, password_attempt)
 
-                    if not doc:
-                        st.error("User not found!")
-                    else:
-                        if user_ingestion.verify_password(username_login, password_attempt):
+                        if not result["success"]:
+                            st.error(result["message"])
+                        else:
                             st.success("Access granted! Decrypting services...")
                             st.info("You can now view and manage your vault, notes and files through the sidebar.")
-                            # ---- Decrypt private key & DEK ----
-                            try:
-                                private_pem_encrypted = doc["private_key_pem_encrypted"]
-                                private_key = serialization.load_pem_private_key(
-                                    private_pem_encrypted.encode('utf-8'),
-                                    password=master_key.encode('utf-8')
-                                )
-
-                                encrypted_user_dek_hex = doc["encrypted_user_dek"]
-                                encrypted_bytes = binascii.unhexlify(encrypted_user_dek_hex)
 
-                                user_dek_base64 = private_key.decrypt(
-                                    encrypted_bytes,
-                                    padding.OAEP(
-                                        mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                                        algorithm=hashes.SHA256(),
-                                        label=None
-                                    )
-                                ).decode('utf-8')
-
-                                dek_bytes = base64.urlsafe_b64decode(user_dek_base64.encode('utf-8'))
-
-                                # ---- Store session values ----
-                                st.session_state["username"] = username_login
-                                st.session_state["user_id"] = str(doc["_id"])
-                                st.session_state["dek"] = dek_bytes
-                                
-                                # time.sleep(1)
-                                # st.rerun()
-                            except Exception as e:
-                                st.error(f"Decryption failed: {e}")
-                        else:
-                            st.error("Incorrect Password. Access denied!")
+                            # ---- Store session values ----
+                            # Drop plaintexts and keys cached for a previous login in this session
+                            session_cache(st.session_state).clear()
+                            st.session_state.pop("search_key", None)
+                            # Page cursors of the previous user's notes
+                            st.session_state.pop("notes_cursors", None)
+                            st.session_state["username"] = result["username"]
+                            st.session_state["user_id"] = result["user_id"]
+                            st.session_state["dek"] = result["dek"]
+
+                            # time.sleep(1)
+                            # st.rerun()
+                    except Exception as e:
+                        st.error(f"Decryption failed: {e}")
 
     
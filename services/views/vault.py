@@ -1,12 +1,40 @@
 import streamlit as st 
 from bson import ObjectId
 from services.components.vault import VaultIngestion
+from services.components.cache import session_cache
 
 # Connection to MongoDB
 uri = st.secrets["MONGO_URI"]
 
 vault_ingestion = VaultIngestion(uri)
 
+def score_new_password():
+    """
+    on_change callback of the new password field: the strength is only
+    recomputed when the password itself changes (the scorer is memoized too).
+    """
+    password = st.session_state.get("new_password")
+    st.session_state["new_password_strength"] = (
+        vault_ingestion.check_password_strength(password) if password else None
+    )
+
+def decrypt_password_cached(password: dict, dek: bytes) -> str:
+    """
+    Decrypts a vault entry through the session's plaintext cache, so reruns
+    while viewing or editing don't repeat the base64 + AES work.
+    """
+    def decrypt():
+        return vault_ingestion.decrypt_password_with_dek(
+            dek=dek,
+            password_encrypted_b64=password['password_encrypted'],
+            nonce_64=password['nonce'],
+            wrapped_key=password.get('wrapped_key'),
+            kek_id=password.get('kek_id')
+        ).encode('utf-8')
+
+    cache = session_cache(st.session_state)
+    return cache.get_or_set((password['_id'], password['nonce']), decrypt, tag=password['_id']).decode('utf-8')
+
 def vault_page():
     # -------------------------------
     # VAULT SECTION
@@ -25,21 +53,25 @@ def vault_page():
         user_id = st.session_state['user_id']  # str of ObjectId
         st.write(f"Welcome {st.session_state['username']}!")
         
-        # ---- SERVICE DROPDOWN ----
-        services = vault_ingestion.fetch_services(owner_id=user_id)
+        # ---- SERVICES + SELECTED SERVICE'S PASSWORDS (one round-trip) ----
+        overview = vault_ingestion.fetch_vault_overview(
+            owner_id=user_id,
+            service=st.session_state.get("service")
+        )
+        services = overview["services"]
+        password_list = overview["entries"]
 
         if services:
-            service = st.selectbox("Select a service:", services, key="service", placeholder='Service')
-        else:
-            service = None
-        
-        # ---- FETCH PASSWORDS ----
-        password_list = []
-        if service:
-            password_list = vault_ingestion.fetch_passwords_by_service(
-                owner_id=user_id,
-                service=service  
-            )   
+            # The overview falls back to another service if the selection is gone
+            st.session_state["service"] = overview["service"]
+            counts = {s["service"]: s["count"] for s in services}
+            st.selectbox(
+                "Select a service:",
+                list(counts),
+                key="service",
+                placeholder='Service',
+                format_func=lambda name: f"{name} ({counts[name]})"
+            )
 
         if password_list:
             for password in password_list:
@@ -51,11 +83,7 @@ def vault_page():
                 with col1:
                     if st.button(f"View ⤵️", key=f"view-{password['_id']}"):
                         try:
-                            plaintext = vault_ingestion.decrypt_password_with_dek(
-                                dek=dek,
-                                password_encrypted_b64=password['password_encrypted'],
-                                nonce_64=password['nonce']
-                            )
+                            plaintext = decrypt_password_cached(password, dek)
                             st.write('Service:',password['service'])
                             st.write('Password:')
                             st.code(plaintext, language='plaintext')
@@ -72,11 +100,7 @@ def vault_page():
                         
                     # If this note is currently being edited
                     if st.session_state["editing_password"] == password["_id"]:
-                        existing_plain = vault_ingestion.decrypt_password_with_dek(
-                            dek=dek,
-                            password_encrypted_b64=password['password_encrypted'],
-                            nonce_64=password['nonce']
-                        )
+                        existing_plain = decrypt_password_cached(password, dek)
 
                         st.write("**Editing:**")
                         new_password = st.text_input("Edit password", value=existing_plain, key=f"text-{password['_id']}")
@@ -85,10 +109,14 @@ def vault_page():
                             enc = vault_ingestion.encrypt_password_with_dek(dek=dek, password=new_password)
 
                             vault_ingestion.update_password_entry(
+                                owner_id=ObjectId(user_id),
                                 service=password['service'],
                                 encrypted_content=enc['password_encrypted'],
-                                nonce=enc['nonce']
+                                nonce=enc['nonce'],
+                                wrapped_key=enc['wrapped_key'],
+                                kek_id=enc['kek_id']
                             )
+                            session_cache(st.session_state).invalidate(password['_id'])
 
                             st.success("Updated successfully!")
                             st.session_state["editing_password"] = None
@@ -101,7 +129,8 @@ def vault_page():
                 # Delete button
                 with col3:
                     if st.button(f"Delete 🗑️", key=f"del-{password['_id']}"):
-                        deleted = vault_ingestion.delete_password_entry(password['service'])
+                        deleted = vault_ingestion.delete_password_entry(ObjectId(user_id), password['service'])
+                        session_cache(st.session_state).invalidate(password['_id'])
                         if deleted:
                             st.success("Deleted.")
                             st.rerun()
@@ -115,10 +144,14 @@ def vault_page():
         
         new_service = st.text_input("Service", key="new_service")
         url = st.text_input("URL", key="url")
-        new_password = st.text_input("Password", type="password", key="new_password")
+        new_password = st.text_input("Password", type="password", key="new_password", on_change=score_new_password)
             
         if new_password:
-            strength = vault_ingestion.check_password_strength(new_password)
+            # Scored by the on_change callback; reruns from other widgets reuse it
+            strength = st.session_state.get("new_password_strength")
+            if strength is None:
+                score_new_password()
+                strength = st.session_state["new_password_strength"]
             st.write(f"Strength Score: {strength['score']}")
             st.write(strength['feedback'])
         
@@ -145,9 +178,38 @@ def vault_page():
                             username=st.session_state['username'],
                             url=url,
                             password_encrypted=enc['password_encrypted'],
-                            nonce=enc['nonce']
+                            nonce=enc['nonce'],
+                            wrapped_key=enc['wrapped_key'],
+                            kek_id=enc['kek_id']
                         )
                         st.success("Password saved.")
                         st.rerun()
 
+        # bulk import from another password manager
+        with st.expander("📥 Import from CSV"):
+            st.caption("Chrome, Firefox, Bitwarden, LastPass and 1Password exports are supported.")
+            csv_file = st.file_uploader("CSV export", type=["csv"], key="vault_import_csv")
+            require_strong = st.checkbox("Skip weak passwords", value=False, key="vault_import_strong")
+
+            if csv_file is not None and st.button("Import", key="vault_import"):
+                counts = {}
+                skipped = []
+                progress = st.empty()
+                for result in vault_ingestion.import_csv(
+                    owner_id=ObjectId(user_id),
+                    dek=dek,
+                    csv_file=csv_file,
+                    username=st.session_state['username'],
+                    require_strong=require_strong
+                ):
+                    counts[result["status"]] = counts.get(result["status"], 0) + 1
+                    if result["status"] != "inserted":
+                        skipped.append({k: result[k] for k in ("row", "service", "status", "score", "error")})
+                    progress.write(f"Processed {sum(counts.values())} rows...")
+
+                progress.empty()
+                st.success(f"Imported {counts.get('inserted', 0)} of {sum(counts.values())} rows.")
+                if skipped:
+                    st.dataframe(skipped)
+
     st.divider()
@@ -0,0 +1,14 @@
+import os
+import tempfile
+import streamlit as st
+from streamlit import config
+
+# services.components.users reads the master key from st.secrets at import;
+# use a throwaway one when no secrets.toml is configured
+try:
+    st.secrets["MASTER_KEY"]
+except Exception:
+    secrets_path = os.path.join(tempfile.mkdtemp(), "secrets.toml")
+    with open(secrets_path, "w") as f:
+        f.write('MASTER_KEY = "test-master-key"\n')
+    config.set_option("secrets.files", [secrets_path])
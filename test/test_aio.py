@@ -0,0 +1,158 @@
+import io
+import os
+import asyncio
+import pytest
+import mongomock
+from bson import ObjectId
+from pymongo import AsyncMongoClient
+from services.components.aio import AsyncFileIngestion, AsyncNoteIngestion
+from services.components.compression import CODEC_NONE, CODEC_ZLIB
+from services.components.file import FILE_FORMAT_SEGMENTED
+
+# The async components are exercised without a server: GridFS reads go to
+# an in-memory bucket and file metadata to mongomock behind awaitable calls.
+SEGMENT_SIZE = 1024
+PLAINTEXT = os.urandom(3000) + b"compressible " * 400
+
+
+class _GridOut:
+    def __init__(self, data: bytes, metadata: dict):
+        self._buffer = io.BytesIO(data)
+        self.length = len(data)
+        self.metadata = metadata
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+    async def seek(self, position: int):
+        self._buffer.seek(position)
+
+
+class _MemoryBucket:
+    def __init__(self):
+        self.files = {}
+
+    async def open_download_stream(self, file_id):
+        data, metadata = self.files[file_id]
+        return _GridOut(data, metadata)
+
+
+class _AsyncCollection:
+    """Awaitable front for the few mongomock collection calls used below."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class _AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+        self.fs = type("fs", (), {"files": _AsyncCollection(database.fs.files)})()
+
+    def __getitem__(self, name):
+        return _AsyncCollection(self._database[name])
+
+
+class _DeletedFiles:
+    def __init__(self):
+        self.deleted = []
+
+    async def delete(self, file_id):
+        self.deleted.append(file_id)
+
+
+@pytest.fixture
+def client():
+    client = AsyncMongoClient("mongodb://localhost:27017", connect=False)
+    yield client
+    asyncio.run(client.close())
+
+
+@pytest.fixture
+def files(client):
+    files = AsyncFileIngestion(client)
+    files.bucket = _MemoryBucket()
+    return files
+
+
+def _store(files, dek: bytes, compression: int, **metadata) -> str:
+    state = {}
+    data = b"".join(files.blocking._encrypt_segments(PLAINTEXT, dek, SEGMENT_SIZE, state, compression))
+    file_metadata = files.blocking._stream_metadata({}, state, SEGMENT_SIZE)
+    file_metadata.update(metadata)
+    file_id = len(files.bucket.files)
+    files.bucket.files[file_id] = (data, file_metadata)
+    return file_id
+
+
+async def _read(files, file_id, dek: bytes, start: int = 0, end: int = None) -> bytes:
+    return b"".join([chunk async for chunk in files.stream_decrypted_file(file_id, dek, start, end)])
+
+
+@pytest.mark.parametrize("compression", [CODEC_NONE, CODEC_ZLIB])
+def test_stream_round_trip(files, compression):
+    dek = os.urandom(32)
+    file_id = _store(files, dek, compression)
+
+    assert files.bucket.files[file_id][1]["format"] == FILE_FORMAT_SEGMENTED
+    assert asyncio.run(_read(files, file_id, dek)) == PLAINTEXT
+    assert asyncio.run(_read(files, file_id, dek, 1500, 2600)) == PLAINTEXT[1500:2600]
+
+
+@pytest.mark.parametrize("compression", [CODEC_NONE, CODEC_ZLIB])
+def test_full_read_checks_sha256(files, compression):
+    dek = os.urandom(32)
+    file_id = _store(files, dek, compression, sha256="0" * 64)
+
+    with pytest.raises(Exception, match="Integrity check failed"):
+        asyncio.run(_read(files, file_id, dek))
+    # Range reads cannot be checked against the whole-file hash
+    assert asyncio.run(_read(files, file_id, dek, 10, 20)) == PLAINTEXT[10:20]
+
+
+def test_tampered_segment_is_rejected(files):
+    dek = os.urandom(32)
+    file_id = _store(files, dek, CODEC_NONE)
+    data, metadata = files.bucket.files[file_id]
+    tampered = bytearray(data)
+    tampered[-1] ^= 1
+    files.bucket.files[file_id] = (bytes(tampered), metadata)
+
+    with pytest.raises(Exception):
+        asyncio.run(_read(files, file_id, dek))
+
+
+def test_note_round_trip(client):
+    notes = AsyncNoteIngestion(client)
+    dek = os.urandom(32)
+
+    async def round_trip():
+        enc = await notes.encrypt_note_with_dek(dek, "hello " * 50)
+        return await notes.decrypt_note_with_dek(dek, enc["ciphertext"], enc["nonce"], enc["wrapped_key"], enc["kek_id"])
+
+    assert asyncio.run(round_trip()) == "hello " * 50
+
+
+def test_delete_file_releases_blob_once(files):
+    database = mongomock.MongoClient().db
+    files.database = _AsyncDatabase(database)
+    files.fs = _DeletedFiles()
+    owner_id = ObjectId()
+    blob_id = database.fs.files.insert_one({"metadata": {"owner_id": owner_id, "refcount": 2}}).inserted_id
+    alias_id = database.fs.files.insert_one({"metadata": {"owner_id": owner_id, "blob_id": blob_id}}).inserted_id
+
+    assert asyncio.run(files.delete_file(blob_id))
+    assert not asyncio.run(files.delete_file(blob_id))
+    assert database.fs.files.find_one({"_id": blob_id})["metadata"]["refcount"] == 1
+    assert files.fs.deleted == []
+
+    assert asyncio.run(files.delete_file(alias_id))
+    assert not asyncio.run(files.delete_file(alias_id))
+    assert files.fs.deleted == [blob_id]
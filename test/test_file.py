@@ -0,0 +1,70 @@
+import os
+import pytest
+import mongomock
+import mongomock.gridfs
+from bson import ObjectId
+from services.components.file import FileIngestion
+from services.constant.collection_pipeline import COLLECTION_USERS
+
+mongomock.gridfs.enable_gridfs_integration()
+
+PLAINTEXT = b"deduplicated " * 500
+DEDUP_KEY = os.urandom(32)
+
+
+@pytest.fixture
+def files():
+    return FileIngestion(mongomock.MongoClient())
+
+
+@pytest.fixture
+def owner_id(files):
+    return files.database[COLLECTION_USERS].insert_one({"username": "alice"}).inserted_id
+
+
+def _read(files, file_id, dek: bytes) -> bytes:
+    return b"".join(files.stream_decrypted_file(file_id, dek))
+
+
+def test_identical_upload_is_deduplicated(files, owner_id):
+    dek = os.urandom(32)
+    first = files.upload_deduplicated(PLAINTEXT, dek, DEDUP_KEY, "a.txt", {"owner_id": owner_id})
+    second = files.upload_deduplicated(PLAINTEXT, dek, DEDUP_KEY, "b.txt", {"owner_id": owner_id})
+
+    assert not first["deduplicated"]
+    assert second["deduplicated"] and second["blob_id"] == first["file_id"]
+    assert _read(files, second["file_id"], dek) == PLAINTEXT
+
+
+def test_dedup_survives_dek_rotation(files, owner_id):
+    first = files.upload_deduplicated(PLAINTEXT, os.urandom(32), DEDUP_KEY, "a.txt", {"owner_id": owner_id})
+    second = files.upload_deduplicated(PLAINTEXT, os.urandom(32), DEDUP_KEY, "b.txt", {"owner_id": owner_id})
+
+    assert second["deduplicated"] and second["blob_id"] == first["file_id"]
+
+
+@pytest.mark.parametrize("deleted", ["blob", "alias"])
+def test_double_delete_releases_once(files, owner_id, deleted):
+    dek = os.urandom(32)
+    blob = files.upload_deduplicated(PLAINTEXT, dek, DEDUP_KEY, "a.txt", {"owner_id": owner_id})
+    alias = files.upload_deduplicated(PLAINTEXT, dek, DEDUP_KEY, "b.txt", {"owner_id": owner_id})
+    first, other = (blob, alias) if deleted == "blob" else (alias, blob)
+
+    assert files.delete_file(first["file_id"])
+    assert not files.delete_file(first["file_id"])
+
+    listed = [doc["_id"] for doc in files.get_files_list(owner_id)]
+    assert first["file_id"] not in listed and other["file_id"] in listed
+    assert _read(files, other["file_id"], dek) == PLAINTEXT
+
+
+def test_last_delete_removes_ciphertext(files, owner_id):
+    dek = os.urandom(32)
+    blob = files.upload_deduplicated(PLAINTEXT, dek, DEDUP_KEY, "a.txt", {"owner_id": owner_id})
+    alias = files.upload_deduplicated(PLAINTEXT, dek, DEDUP_KEY, "b.txt", {"owner_id": owner_id})
+
+    assert files.delete_file(blob["file_id"])
+    assert files.delete_file(alias["file_id"])
+    assert not files.delete_file(alias["file_id"])
+    assert files.database.fs.files.count_documents({}) == 0
+    assert files.database.fs.chunks.count_documents({}) == 0